@@ -1,26 +1,36 @@
-import torch
+# Everything is imported lazily (PEP 562) so that `import bioimage_embed`
+# and the bie CLI start quickly, see lazy.py
+from .lazy import attach
 
-torch.cuda.empty_cache()
-# from . import models, lightning, cli, export, config
-from .lightning import AESupervised, AEUnsupervised, AE,  AutoEncoderSupervised, AutoEncoderUnsupervised, AutoEncoder
-
-# TODO: Fix this import as it currently produces too many warnings
-from .models import ModelFactory, create_model
-from .bie import BioImageEmbed
-from .config import Config
-from . import augmentations
-
-# import logging
-# logging.captureWarnings(True)
-
-__all__ = [
-    "AESupervised",
-    "AutoEncoderUnsupervised",
-    "AEUnsupervised",
-    "AutoEncoderSupervised",
-    "AutoEncoder"
-    "AE"
-    "BioImageEmbed",
-    "Config",
-    "augmentations",
-]
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        "augmentations",
+        "bie",
+        "cli",
+        "config",
+        "datasets",
+        "distributed",
+        "inference",
+        "lightning",
+        "models",
+        "shapes",
+        "sharding",
+        "tiling",
+        "transforms",
+        "utils",
+    ],
+    submod_attrs={
+        "lightning": [
+            "AESupervised",
+            "AEUnsupervised",
+            "AE",
+            "AutoEncoderSupervised",
+            "AutoEncoderUnsupervised",
+            "AutoEncoder",
+        ],
+        "models": ["ModelFactory", "create_model"],
+        "bie": ["BioImageEmbed"],
+        "config": ["Config"],
+    },
+)
@@ -1,25 +1,58 @@
 import os
 import numpy as np
-import torch
-from pytorch_lightning.callbacks import ModelCheckpoint
 import logging
 from .config import Config
-from .lightning import DataModule
 from hydra.utils import instantiate
-from torch.autograd import Variable
-from pytorch_lightning import seed_everything
-from . import utils, config
+from omegaconf import OmegaConf
+from . import config
+
+# torch, Lightning and the models are imported by the methods that need
+# them, importing BioImageEmbed alone stays cheap
 
 logging.basicConfig(level=logging.INFO)
 
+# Marks a checkpoint directory whose training ran to the end
+COMPLETE = "_COMPLETE"
+
+
+class LazySections:
+    """
+    The instantiated config, every section is instantiated from the
+    resolved config on first access and kept. Commands only build what
+    they use: no dataset scan without the dataloader, no model without
+    lit_model, no loggers or callbacks without the trainer.
+    """
+
+    def __init__(self, ocfg):
+        self._ocfg = ocfg
+        self._sections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._ocfg:
+            raise AttributeError(name)
+        if name not in self._sections:
+            section = self._ocfg[name]
+            if OmegaConf.is_config(section):
+                section = instantiate(section)
+            self._sections[name] = section
+        return self._sections[name]
+
+    def built(self):
+        """Names of the sections instantiated so far"""
+        return list(self._sections)
+
 
 class BioImageEmbed:
     cfg: Config
 
     def __init__(self, cfg: Config):
-        self.cfg = cfg
-        self.icfg = instantiate(cfg)
+        self.cfg = config.apply_profiles(cfg)
+        if not self.cfg.uuid:
+            # Runs of the same config share their checkpoints
+            self.cfg.uuid = config.config_hash(self.cfg)
         self.ocfg = self.resolve()
+        # Sections are built on first use, see LazySections
+        self.icfg = LazySections(self.ocfg)
         self.setup()
 
     def resolve(self):
@@ -31,17 +64,17 @@ class BioImageEmbed:
         return self.ocfg
 
     def checkpoint_hash(self):
-        recipe = self.icfg.recipe
-        self.checkpoint_dir = utils.hashing_fn(recipe)
+        return config.config_hash(self.cfg)
 
     def setup(self):
-        np.random.seed(self.icfg.recipe.seed)
-        seed_everything(self.icfg.recipe.seed)
-        self.make_dirs()
-        self.icfg.lit_model.model.eval()
+        from pytorch_lightning import seed_everything
+
+        np.random.seed(self.ocfg.recipe.seed)
+        seed_everything(self.ocfg.recipe.seed)
 
     def model_check(self):
         dataloader = self.icfg.dataloader
+        self.icfg.lit_model.model.eval()
 
         # dataloader_0 = next(iter(dataloader.predict_dataloader()))
         # TODO smarter way to do this
@@ -50,6 +83,35 @@ class BioImageEmbed:
         logging.info("Model Check Passed")
         return self
 
+    def dry_run(self, batch_size=2, device="meta", depth=2):
+        """
+        Checks the model's shapes, loss and collation on a fake batch of
+        input_dim, without the dataset or a trainer, and logs a per module
+        parameter, FLOP and activation memory report, see profiling.dry_run.
+
+        On the meta device a copy of the model is built without memory,
+        models with data dependent operations fall back to the CPU.
+        """
+        import torch
+        from . import profiling
+
+        input_dim = self.ocfg.lit_model.model.input_dim
+        try:
+            with torch.device(device):
+                lit_model = instantiate(self.ocfg.lit_model)
+            report = profiling.dry_run(
+                lit_model, input_dim, batch_size, device, depth
+            )
+        except (NotImplementedError, RuntimeError) as e:
+            if device == "cpu":
+                raise
+            logging.warning(f"Dry run on {device} failed ({e}), using cpu")
+            report = profiling.dry_run(
+                self.icfg.lit_model, input_dim, batch_size, "cpu", depth
+            )
+        logging.info("Dry run passed\n" + profiling.format_report(report))
+        return report
+
     def trainer_check(self):
         trainer = instantiate(self.ocfg.trainer, fast_dev_run=True, accelerator="cpu")
         trainer.test(self.icfg.lit_model, self.icfg.dataloader)
@@ -62,33 +124,64 @@ class BioImageEmbed:
         logging.info("Trainer Check Passed")
         return self
 
-    # TODO fix resume
     def make_dirs(self):
         for path in (self.icfg.paths).values():
             os.makedirs(path, exist_ok=True)
 
+    def checkpoint_dir(self):
+        """Directory of the ModelCheckpoint callback, paths.model/uuid"""
+        # Read from the config, so the trainer is not built to find it
+        for callback in self.ocfg.trainer.callbacks:
+            if not OmegaConf.is_dict(callback):
+                continue
+            if callback.get("_target_", "").endswith(".ModelCheckpoint"):
+                return callback.dirpath
+
     def find_checkpoint(self):
-        for callback in self.icfg.trainer.callbacks:
-            if isinstance(callback, ModelCheckpoint):
-                return callback.last_model_path
+        """last.ckpt of a previous run of the same config, if any"""
+        checkpoint_dir = self.checkpoint_dir()
+        if checkpoint_dir is None:
+            return None
+        path = os.path.join(checkpoint_dir, "last.ckpt")
+        return path if os.path.isfile(path) else None
 
-    def train(self, resume: bool = True):
-        # FYI
-        # last_checkpoint = chkpt_callbacks.last_model_path
-        # best_checkpoint_path = chkpt_callbacks.best_model_path
+    def is_complete(self):
+        checkpoint_dir = self.checkpoint_dir()
+        return checkpoint_dir is not None and os.path.isfile(
+            os.path.join(checkpoint_dir, COMPLETE)
+        )
 
-        # TODO add tests for checkpointing (properply)
-        return self._train()
+    def train(self, resume: bool = True):
+        """
+        Trains, or with resume, continues from the last checkpoint of an
+        interrupted run of the same config and skips a finished one
+        """
+        if not resume:
+            return self._train()
+        if self.is_complete():
+            logging.info(f"Run {self.cfg.uuid} is complete, skipping training")
+            return self
+        ckpt_path = self.find_checkpoint()
+        if ckpt_path:
+            logging.info(f"Resuming run {self.cfg.uuid} from {ckpt_path}")
+        return self._train(ckpt_path)
 
     def train_resume(self):
-        return self.train("last")
+        return self.train(resume=True)
 
     def _train(self, ckpt_path=None):
-        self.icfg.trainer.fit(
+        self.make_dirs()
+        trainer = self.icfg.trainer
+        trainer.fit(
             self.icfg.lit_model,
             datamodule=self.icfg.dataloader,
             ckpt_path=ckpt_path,
         )
+        checkpoint_dir = self.checkpoint_dir()
+        finished = checkpoint_dir and not trainer.interrupted
+        if finished and trainer.is_global_zero:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            open(os.path.join(checkpoint_dir, COMPLETE), "w").close()
         return self
 
     def validate(self):
@@ -104,11 +197,13 @@ class BioImageEmbed:
         return self
 
     def __call__(self, x, ckpt_path="best"):
+        from .lightning import DataModule
+
         dataloader = DataModule(
             x,
             batch_size=1,
             shuffle=False,
-            num_workers=self.icfg.receipe.num_workers,
+            num_workers=self.ocfg.dataloader.num_workers,
             # TODO: Add transform here if batch_size > 1 assuming averaging?
             # Transform is commented here to avoid augmentations in real data
             # HOWEVER, applying a the transform multiple times and averaging the results might produce better latent embeddings
@@ -127,7 +222,7 @@ class BioImageEmbed:
         self.icfg.lit_model(x)
 
     def infer(self, ckpt_path="best"):
-        return self(self.icfg.dataset, ckpt_path)
+        return self(self.icfg.dataloader.dataset, ckpt_path)
 
         # dataloader = DataModule(
 
@@ -146,8 +241,37 @@ class BioImageEmbed:
         #     ckpt_path=ckpt_path,
         # )
 
+    def embed(self):
+        """
+        Encoder only embedding of the whole dataset, sharded across
+        processes and resumable, see config.Embed
+        """
+        from . import sharding
+
+        return sharding.embed(
+            self.icfg.lit_model,
+            self.icfg.dataloader.dataset,
+            **self.icfg.embed,
+        )
+
+    def embed_tiles(self, image, **kwargs):
+        """
+        Embeds a single large image, a path to a .npy/.tif file or an
+        array, tile by tile, see config.Tiling and tiling.embed_tiles
+        """
+        from . import tiling
+
+        options = {**self.icfg.tiling, **kwargs}
+        input_dim = self.icfg.lit_model.model.model_config.input_dim
+        options["tile_size"] = options["tile_size"] or input_dim[-1]
+        options["stride"] = options["stride"] or options["tile_size"] // 2
+        return tiling.embed_tiles(self.icfg.lit_model, image, **options)
+
     def export(self):
         # TODO export best model to onnx
+        import torch
+        from torch.autograd import Variable
+
         data = torch.rand(1, *self.cfg.recipe.input_dim)
         assert self(data)
         example_input = Variable()
@@ -1,17 +1,22 @@
-# TODO: CLI autocomplete is currently quite slow
-from . import BioImageEmbed, Config
+import functools
+import sys
+import typer
 
-from omegaconf import OmegaConf
-from hydra import compose, initialize
-from hydra.core.config_store import ConfigStore
+# Only typer is imported up front so `bie --help` and tab completion are
+# fast, hydra, the config and the models are imported when a command runs
 
-import hydra
 
-cs = ConfigStore.instance()
-cs.store(name="config", node=Config)
+def register_configs():
+    from hydra.core.config_store import ConfigStore
+    from .config import Config
+
+    cs = ConfigStore.instance()
+    cs.store(name="config", node=Config)
 
 
 def write_default_config_file(config_path):
+    from omegaconf import OmegaConf
+
     cfg = get_default_config()
     config_path.parent.mkdir(parents=True, exist_ok=True)
     with open(config_path, "w") as file:
@@ -26,6 +31,9 @@ def write_default_config_file(config_path):
 
 
 def init_hydra(config_dir="conf", config_file="config.yaml", job_name="bie"):
+    import hydra
+
+    register_configs()
     hydra.initialize(
         version_base=None,
         config_path=config_dir,
@@ -35,35 +43,102 @@ def init_hydra(config_dir="conf", config_file="config.yaml", job_name="bie"):
 
 
 def get_default_config(config_name="config"):
+    from hydra import compose, initialize
+
+    register_configs()
     with initialize(config_path=None, version_base=None):
         cfg = compose(config_name=config_name)
     return cfg
 
 
+def hydra_main(task):
+    """
+    hydra.main(config_path=".", config_name="config"), with hydra only
+    imported once the command is called
+    """
+
+    @functools.wraps(task)
+    def main(cfg_passthrough=None):
+        import hydra
+
+        register_configs()
+        return hydra.main(
+            config_path=".", config_name="config", version_base="1.1.0"
+        )(task)(cfg_passthrough)
+
+    return main
+
+
 # TODO smarter way to handle this
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
+@hydra_main
 def infer():
     pass
 
 
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def train(cfg: Config):
+@hydra_main
+def train(cfg):
+    from .bie import BioImageEmbed
+
     bie = BioImageEmbed(cfg)
     bie.train()
 
 
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def check(cfg: Config):
+@hydra_main
+def check(cfg):
+    from .bie import BioImageEmbed
+
     bie = BioImageEmbed(cfg)
     bie.check()
 
 
-@hydra.main(config_path=".", config_name="config", version_base="1.1.0")
-def finetune(cfg: Config):
+@hydra_main
+def dry_run(cfg):
+    from .bie import BioImageEmbed
+
+    bie = BioImageEmbed(cfg)
+    bie.dry_run()
+
+
+@hydra_main
+def finetune(cfg):
     pass
+    from .bie import BioImageEmbed
+
     bie = BioImageEmbed(cfg)
     bie.finetune()
 
 
-# app.command()(train)
-# app.command()(infer)
+@hydra_main
+def embed(cfg):
+    from .bie import BioImageEmbed
+
+    bie = BioImageEmbed(cfg)
+    bie.embed()
+
+
+app = typer.Typer(help="Autoencoders for biological image data")
+
+
+def hydra_command(main):
+    """
+    Exposes a hydra main as a typer sub-command,
+    extra arguments are passed through as hydra overrides
+    e.g. bie embed embed.num_workers=8
+    """
+
+    def command(ctx: typer.Context):
+        sys.argv = [f"bie {main.__name__}", *ctx.args]
+        main()
+
+    command.__doc__ = f"bie_{main.__name__} with hydra overrides"
+    return command
+
+
+for main in (train, check, dry_run, infer, finetune, embed):
+    app.command(
+        name=main.__name__,
+        context_settings={
+            "allow_extra_args": True,
+            "ignore_unknown_options": True,
+        },
+    )(hydra_command(main))
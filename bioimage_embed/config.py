@@ -13,13 +13,13 @@ are valid.
 """
 
 from omegaconf import OmegaConf
-from bioimage_embed import augmentations as augs
+import copy
 import os
 from dataclasses import field
 from pydantic.dataclasses import dataclass
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 
-from pydantic import Field, root_validator
+from pydantic import Field
 from omegaconf import II
 from . import utils
 
@@ -53,18 +53,49 @@ class Recipe:
     cooldown_epochs: int = 5
     warmup_t: int = 0
     seed: int = 42
+    # Supervised contrastive training
+    supcon: bool = False
+    max_pairs_per_class: Optional[int] = None
+    # Image logging, every n steps and/or seconds, None or 0 disables either
+    log_images_every_n_steps: Optional[int] = 50
+    log_images_every_n_seconds: Optional[float] = None
+    log_images_max_samples: int = 16
+    # Shape test time augmentation, 0 disables, -1 uses every cyclic shift
+    tta_shifts: int = 0
+    tta_flips: bool = False
+    tta_reduction: str = "mean"
+    # Probability of a random contour start index per training sample
+    rotate_indexing_p: float = 0.0
+    # "average" or "triangle" symmetric distogram decoding, None disables
+    symmetric_decoder: Optional[str] = None
+    # Batches are packed upper triangles, see shapes.symmetric.PackTriangle
+    packed_distograms: bool = False
+    # torch.compile the encoder, decoder and loss, see AutoEncoder.compile_model
+    compile: bool = False
+    compile_mode: Optional[str] = None
+    compile_dynamic: Optional[bool] = None
+    # Memory format and activation checkpointing, usually set by a profile
+    channels_last: bool = False
+    grad_checkpointing: bool = False
+    # Checkpointed segments per residual stack, None for one per block
+    checkpoint_segments: Optional[int] = None
 
 
 # Use the ALbumentations .to_dict() method to get the dictionary
 # that pydantic can use
+def default_albumentation():
+    # albumentations (and cv2) are only imported once a config is built
+    from . import augmentations as augs
+
+    return augs.DEFAULT_ALBUMENTATION.to_dict()
+
+
 @dataclass
 class ATransform:
     _target_: str = "albumentations.from_dict"
     _convert_: str = "object"
     # _convert_: str = "all"
-    transform_dict: Dict = Field(
-        default_factory=lambda: augs.DEFAULT_ALBUMENTATION.to_dict()
-    )
+    transform_dict: Dict = Field(default_factory=default_albumentation)
 
 
 # VisionWrapper is a helper class for applying albumentations pipelines for image augmentations in autoencoding
@@ -75,9 +106,7 @@ class Transform:
     _target_: str = "bioimage_embed.augmentations.VisionWrapper"
     _convert_: str = "object"
     # transform: ATransform = field(default_factory=ATransform)
-    transform_dict: Dict = Field(
-        default_factory=lambda: augs.DEFAULT_ALBUMENTATION.to_dict()
-    )
+    transform_dict: Dict = Field(default_factory=default_albumentation)
 
 
 @dataclass
@@ -144,14 +173,22 @@ class EarlyStopping(Callback):
 @dataclass
 class ModelCheckpoint(Callback):
     _target_: str = "pytorch_lightning.callbacks.ModelCheckpoint"
-    save_last = True
-    save_top_k = 1
-    monitor = "loss/val"
-    mode = "min"
-    # dirpath: str = Field(default_factory=lambda: utils.hashing_fn(Recipe()))
+    save_last: bool = True
+    save_top_k: int = 1
+    monitor: str = "loss/val"
+    mode: str = "min"
+    # Checkpoints of a run live under the hash of its config, see config_hash
     dirpath: str = f"{II('paths.model')}/{II('uuid')}"
 
 
+@dataclass
+class AsyncCheckpointIO:
+    # Checkpoints written in a background thread, see lightning.checkpoint
+    _target_: str = "bioimage_embed.lightning.checkpoint.AsyncCheckpointIO"
+    shard: bool = False
+    max_pending: int = 2
+
+
 @dataclass
 class LightningModel:
     _target_: str = "bioimage_embed.lightning.torch.AEUnsupervised"
@@ -177,9 +214,16 @@ class Trainer:
     # logger: Optional[any]
     gradient_clip_val: float = 0.5
     enable_checkpointing: bool = True
-    devices: str = "auto"
+    devices: Union[int, str] = "auto"
     accelerator: str = "auto"
     accumulate_grad_batches: int = 16
+    precision: Union[int, str] = 32
+    # Data parallel, e.g. strategy="ddp" with devices processes on every
+    # one of num_nodes nodes, on CPU Lightning uses the gloo backend
+    strategy: Optional[str] = None
+    num_nodes: int = 1
+    # e.g. [AsyncCheckpointIO()]
+    plugins: Optional[List[Any]] = None
     min_epochs: int = 1
     max_epochs: int = II("recipe.max_epochs")
     log_every_n_steps: int = 1
@@ -192,22 +236,33 @@ class Trainer:
 # TODO add argument caching for checkpointing
 
 
+@dataclass
+class Embed:
+    # Sharded, resumable embedding extraction, see bioimage_embed.sharding
+    output_dir: str = "embeddings"
+    num_workers: int = 1
+    num_shards: Optional[int] = None
+    batch_size: int = 32
+    threads_per_worker: Optional[int] = None
+
+
+@dataclass
+class Tiling:
+    # Tiled embedding of large images, see bioimage_embed.tiling
+    tile_size: Optional[int] = None  # Defaults to the model's input size
+    stride: Optional[int] = None  # Defaults to half a tile
+    batch_size: int = 32
+    num_workers: int = 0
+    pool: str = "mean"
+
+
 @dataclass
 class Paths:
     model: str = "models"
     logs: str = "logs"
     tensorboard: str = "tensorboard"
     wandb: str = "wandb"
-
-    @root_validator(
-        pre=False, skip_on_failure=True
-    )  # Ensures this runs after all other validations
-    @classmethod
-    def create_dirs(cls, values):
-        # The `values` dict contains all the validated field values
-        for path in values.values():
-            os.makedirs(path, exist_ok=True)
-        return values
+    # Created by BioImageEmbed when training, not when the config is built
 
 
 @dataclass
@@ -219,7 +274,12 @@ class Config:
     trainer: Any = field(default_factory=Trainer)
     lit_model: Any = field(default_factory=LightningModel)
     callbacks: Any = field(default_factory=Callbacks)
-    uuid: str = field(default_factory=lambda: utils.hashing_fn(Recipe()))
+    embed: Any = field(default_factory=Embed)
+    tiling: Any = field(default_factory=Tiling)
+    # Named performance profiles applied on top, see PROFILES
+    profiles: List[str] = field(default_factory=list)
+    # Run id, BioImageEmbed sets it to config_hash(cfg) if None
+    uuid: Optional[str] = None
 
 
 @dataclass
@@ -227,6 +287,48 @@ class SupervisedConfig(Config):
     lit_model: LightningModel = field(default_factory=LightningModel)
 
 
+# Performance profiles, overrides of config sections by name.
+# bf16 autocast runs on CPU and GPU, the shape losses are computed in
+# float32 regardless (see shapes.lightning.MaskEmbed.loss_function).
+PROFILES = {
+    "bf16-mixed": {"trainer": {"precision": "bf16"}},
+    "16-mixed": {"trainer": {"precision": 16}},
+    "channels_last": {"recipe": {"channels_last": True}},
+    "grad-checkpointing": {"recipe": {"grad_checkpointing": True}},
+    # One process per trainer.devices, gloo process group
+    "ddp-cpu": {"trainer": {"accelerator": "cpu", "strategy": "ddp"}},
+    "async-checkpoint": {"trainer": {"plugins": [AsyncCheckpointIO()]}},
+    # Sharded checkpoints only load through a Trainer with AsyncCheckpointIO
+    # or lightning.checkpoint.load_checkpoint, LightningModule's
+    # load_from_checkpoint and plugin-less Trainers raise on them
+    "async-checkpoint-sharded": {
+        "trainer": {"plugins": [AsyncCheckpointIO(shard=True)]}
+    },
+}
+
+
+def profile_overrides(profiles):
+    """Merged {section: {field: value}} overrides of the named profiles"""
+    overrides = {}
+    for name in profiles:
+        if name not in PROFILES:
+            raise ValueError(
+                f"Unknown profile {name}, expected any of {list(PROFILES)}"
+            )
+        for section, values in PROFILES[name].items():
+            # Copies, profiles hold config objects that may be modified
+            overrides.setdefault(section, {}).update(copy.deepcopy(values))
+    return overrides
+
+
+def apply_profiles(cfg):
+    """Applies cfg.profiles to the config, a Config or a DictConfig"""
+    for section, values in profile_overrides(cfg.profiles).items():
+        for key, value in values.items():
+            setattr(getattr(cfg, section), key, value)
+    return cfg
+
+
 __schemas__ = {
     "recipe": Recipe,
     "transform": Transform,
@@ -252,3 +354,60 @@ def resolve_config(cfg):
     ocfg = OmegaConf.structured(cfg, flags={"allow_objects": True})
     OmegaConf.resolve(ocfg)
     return ocfg
+
+
+# Fields that do not change what is trained: where things are written,
+# how fast it runs and logging. Dotted paths into the config, * matches
+# every item of a list or dict.
+NON_SEMANTIC_FIELDS = (
+    "uuid",
+    "paths",
+    "profiles",
+    "callbacks.*.dirpath",
+    "embed",
+    "tiling",
+    # The recipe, repeated
+    "lit_model.args",
+    "dataloader.num_workers",
+    "trainer.callbacks.*.dirpath",
+    "trainer.devices",
+    "trainer.accelerator",
+    "trainer.strategy",
+    "trainer.num_nodes",
+    "trainer.plugins",
+    "trainer.enable_checkpointing",
+    "trainer.log_every_n_steps",
+    "recipe.log_images_every_n_steps",
+    "recipe.log_images_every_n_seconds",
+    "recipe.log_images_max_samples",
+    "recipe.compile",
+    "recipe.compile_mode",
+    "recipe.compile_dynamic",
+    "recipe.channels_last",
+    "recipe.grad_checkpointing",
+    "recipe.checkpoint_segments",
+)
+
+
+def config_hash(cfg, exclude=NON_SEMANTIC_FIELDS):
+    """
+    Stable hash of the fully resolved config without the exclude fields,
+    equal configs give the same run id (and checkpoint directory)
+    """
+    container = OmegaConf.to_container(resolve_config(cfg), resolve=True)
+    for key in exclude:
+        drop_field(container, key.split("."))
+    return utils.canonical_hash(container)
+
+
+def drop_field(node, path):
+    head, *rest = path
+    if head == "*":
+        children = node.values() if isinstance(node, dict) else node
+        for child in children if isinstance(node, (dict, list)) else []:
+            drop_field(child, rest)
+    elif isinstance(node, dict) and head in node:
+        if rest:
+            drop_field(node[head], rest)
+        else:
+            node.pop(head)
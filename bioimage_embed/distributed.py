@@ -0,0 +1,33 @@
+"""
+Helpers for data parallel training over several processes, Lightning's
+ddp strategies on GPUs or on CPU cores (gloo backend) and across nodes.
+
+Without an initialised process group, or with a single process, they fall
+back to single process behaviour so the same code runs everywhere.
+"""
+
+import torch.distributed as dist
+
+
+def is_distributed():
+    return (
+        dist.is_available()
+        and dist.is_initialized()
+        and dist.get_world_size() > 1
+    )
+
+
+def world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def all_reduce_sum(*tensors):
+    """Sums every tensor over all processes, in place"""
+    if is_distributed():
+        for tensor in tensors:
+            dist.all_reduce(tensor)
+    return tensors
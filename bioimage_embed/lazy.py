@@ -0,0 +1,45 @@
+"""
+PEP 562 lazy attributes for packages, after lazy_loader.attach.
+
+Submodules and the names they export are only imported on first access,
+so importing a package (and running the CLI) does not pull in Lightning,
+pythae, timm, monai and friends until they are actually needed.
+"""
+
+import importlib
+import sys
+
+
+def attach(package_name, submodules=(), submod_attrs=None):
+    """
+    Returns __getattr__, __dir__ and __all__ for package_name, where
+    submodules are imported on access and submod_attrs maps a submodule to
+    the names it provides.
+    """
+    submodules = set(submodules)
+    attr_to_module = {
+        attr: module
+        for module, attrs in (submod_attrs or {}).items()
+        for attr in attrs
+    }
+    __all__ = sorted(submodules | set(attr_to_module))
+
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module(f"{package_name}.{name}")
+        if name in attr_to_module:
+            module = importlib.import_module(
+                f"{package_name}.{attr_to_module[name]}"
+            )
+            value = getattr(module, name)
+            # Later lookups find it directly and skip __getattr__
+            setattr(sys.modules[package_name], name, value)
+            return value
+        raise AttributeError(
+            f"module {package_name!r} has no attribute {name!r}"
+        )
+
+    def __dir__():
+        return __all__
+
+    return __getattr__, __dir__, list(__all__)
@@ -1,5 +1,27 @@
-from .pyro import LitAutoEncoderPyro
-from .torch import AESupervised, AEUnsupervised, AutoEncoder, AE, AutoEncoderSupervised, AutoEncoderUnsupervised
-from .dataloader import DataModule
+from ..lazy import attach
 
-__all__ = ["LitAutoEncoderPyro", "AESupervised", "AEUnsupervised", "DataModule", "AutoEncoder","AE","AutoEncoderUnsupervised","AutoEncoderSupervised"]
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        "checkpoint",
+        "dataloader",
+        "image_logger",
+        "pyro",
+        "torch",
+        "writer",
+    ],
+    submod_attrs={
+        "pyro": ["LitAutoEncoderPyro"],
+        "torch": [
+            "AESupervised",
+            "AEUnsupervised",
+            "AutoEncoder",
+            "AE",
+            "AutoEncoderSupervised",
+            "AutoEncoderUnsupervised",
+        ],
+        "dataloader": ["DataModule", "SizeBucketBatchSampler"],
+        "writer": ["EmbeddingWriter"],
+        "checkpoint": ["AsyncCheckpointIO"],
+    },
+)
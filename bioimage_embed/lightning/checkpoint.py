@@ -0,0 +1,219 @@
+"""
+Checkpoints written in a background thread so training does not stall on
+disk writes, as a Lightning CheckpointIO plugin: Trainer(plugins=[...]).
+
+Saving only takes a copy of every tensor of the checkpoint in host memory,
+the copy is then written by a single writer thread. Every file is written
+to a temporary name and renamed, so a crash or a failed write leaves the
+previous checkpoint untouched. Errors of a write are raised by the next
+save, load or at teardown.
+
+Sharded checkpoints keep every top level module of the state dict and the
+optimizer states in a file of its own next to the checkpoint, which then
+only holds the rest and the names of its shards:
+
+last.ckpt -> epoch, loops, callbacks ... and the shard names
+last.ckpt.<token>.state_dict.model
+last.ckpt.<token>.optimizer_states
+
+They are read back by load_checkpoint (and by the plugin when resuming).
+"""
+
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from pytorch_lightning.plugins.io import TorchCheckpointIO
+
+SHARDS = "_shards"
+
+
+def snapshot(obj):
+    """Copy of a nested checkpoint with every tensor copied to the host"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        copy = obj.copy()
+        for key, value in obj.items():
+            copy[key] = snapshot(value)
+        return copy
+    if isinstance(obj, list):
+        return [snapshot(value) for value in obj]
+    if isinstance(obj, tuple) and not hasattr(obj, "_fields"):
+        return tuple(snapshot(value) for value in obj)
+    return obj
+
+
+def split_shards(checkpoint):
+    """
+    (index, {name: shard}) with a shard per top level module of the state
+    dict and one for the optimizer states, the index holds the rest
+    """
+    index = dict(checkpoint)
+    shards = {}
+    for key, value in index.pop("state_dict", {}).items():
+        module = key.split(".", 1)[0]
+        shards.setdefault(f"state_dict.{module}", {})[key] = value
+    if "optimizer_states" in index:
+        shards["optimizer_states"] = index.pop("optimizer_states")
+    return index, shards
+
+
+def atomic_save(obj, path):
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        torch.save(obj, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def shard_paths(path):
+    """Shard files of the checkpoint at path, none if it is not sharded"""
+    if not os.path.isfile(path):
+        return []
+    # Memory mapped, only the names are read and not the tensors
+    index = torch.load(path, map_location="cpu", weights_only=False, mmap=True)
+    directory = os.path.dirname(path)
+    return [
+        os.path.join(directory, name) for name in index.get(SHARDS, {}).values()
+    ]
+
+
+def merge_shards(checkpoint, path, map_location=None):
+    directory = os.path.dirname(path)
+    for name, filename in checkpoint.pop(SHARDS, {}).items():
+        shard = torch.load(
+            os.path.join(directory, filename),
+            map_location=map_location,
+            weights_only=False,
+        )
+        if name.startswith("state_dict."):
+            checkpoint.setdefault("state_dict", {}).update(shard)
+        else:
+            checkpoint[name] = shard
+    return checkpoint
+
+
+def load_checkpoint(path, map_location=None):
+    """torch.load of a checkpoint written by AsyncCheckpointIO, sharded or not"""
+    path = os.fspath(path)
+    checkpoint = torch.load(path, map_location=map_location, weights_only=False)
+    return merge_shards(checkpoint, path, map_location)
+
+
+def write_checkpoint(checkpoint, path, shard=False, stale=()):
+    """
+    Writes a checkpoint, its shards first and the checkpoint last, then
+    removes the stale shard files of the checkpoint it replaced. Returns
+    the shard files written.
+    """
+    path = os.fspath(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    written = []
+    if not shard:
+        atomic_save(checkpoint, path)
+    else:
+        index, shards = split_shards(checkpoint)
+        # A new token per write, the previous shards stay valid until
+        # the checkpoint pointing at them is replaced
+        token = uuid.uuid4().hex[:8]
+        directory = os.path.dirname(path)
+        names = {
+            name: f"{os.path.basename(path)}.{token}.{name}" for name in shards
+        }
+        index[SHARDS] = names
+        written = [os.path.join(directory, name) for name in names.values()]
+        try:
+            for name, part in shards.items():
+                atomic_save(part, os.path.join(directory, names[name]))
+            atomic_save(index, path)
+        except BaseException:
+            # Shards of a checkpoint that was never written
+            for shard_path in written:
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+            raise
+    for stale_path in stale:
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    return written
+
+
+class AsyncCheckpointIO(TorchCheckpointIO):
+    """
+    Saves checkpoints in a background thread, at most max_pending of them
+    wait in host memory, further saves block until one is written.
+    Removals are queued behind the writes, so they never block training.
+    """
+
+    def __init__(self, shard=False, max_pending=2):
+        super().__init__()
+        self.shard = shard
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="checkpoint"
+        )
+        self._pending = []
+        self._removals = []
+        # Shard files of the checkpoints written so far, by path. Only used
+        # by the writer thread.
+        self._shards = {}
+
+    @staticmethod
+    def _results(futures, max_pending=0):
+        while len(futures) > max_pending or (futures and futures[0].done()):
+            future = futures.pop(0)
+            try:
+                future.result()
+            except Exception:
+                logging.exception("Writing a checkpoint failed")
+                raise
+
+    def wait(self, max_pending=0):
+        """Blocks until at most max_pending writes are left"""
+        self._results(self._pending, max_pending)
+        self._results(self._removals, len(self._removals) if max_pending else 0)
+
+    def _shard_paths(self, path):
+        if path in self._shards:
+            return self._shards.pop(path)
+        # Only a sharded checkpoint of an earlier run has shards unknown
+        # to this plugin
+        return shard_paths(path) if self.shard else []
+
+    def _write(self, checkpoint, path):
+        stale = self._shard_paths(path)
+        self._shards[path] = write_checkpoint(
+            checkpoint, path, self.shard, stale
+        )
+
+    def _remove(self, path):
+        for shard_path in self._shard_paths(path):
+            if os.path.exists(shard_path):
+                os.remove(shard_path)
+        super().remove_checkpoint(path)
+
+    def save_checkpoint(self, checkpoint, path, storage_options=None):
+        self.wait(self.max_pending - 1)
+        self._pending.append(
+            self._executor.submit(
+                self._write, snapshot(checkpoint), os.fspath(path)
+            )
+        )
+
+    def load_checkpoint(self, path, map_location=None):
+        self.wait()
+        return load_checkpoint(path, map_location)
+
+    def remove_checkpoint(self, path):
+        self.wait(self.max_pending)
+        self._removals.append(
+            self._executor.submit(self._remove, os.fspath(path))
+        )
+
+    def teardown(self):
+        self.wait()
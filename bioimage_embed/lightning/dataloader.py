@@ -1,9 +1,12 @@
 import pytorch_lightning as pl
 import torch
-from torch.utils.data import DataLoader, Dataset, random_split
+from torch.utils.data import DataLoader, Dataset, Sampler, random_split
+from torch.utils.data.distributed import DistributedSampler
 from typing import Tuple
 from functools import partial
 
+from .. import distributed
+
 
 class SimpleCustomBatch:
     def __init__(self, dataset):
@@ -24,9 +27,12 @@ class DataModule(pl.LightningDataModule):
         pin_memory: bool = False,
         drop_last: bool = False,
         collate_fn=None,
+        seed: int = 42,
     ):
         super().__init__()
         self.dataset = dataset
+        self.drop_last = drop_last
+        self.seed = seed
         collate_fn = collate_fn if collate_fn else self.collate_filter_for_none
         self.dataloader = partial(
             DataLoader,
@@ -51,7 +57,7 @@ class DataModule(pl.LightningDataModule):
             self.train_dataset,
             self.val_dataset,
             self.test_dataset,
-        ) = self.splitting(self.dataset)
+        ) = self.splitting(self.dataset, seed=self.seed)
 
     def splitting(
         self, dataset: Dataset, split_train=0.8, split_val=0.1, seed=42
@@ -67,9 +73,10 @@ class DataModule(pl.LightningDataModule):
                 "The splitting ratios do not add up to the length of the dataset"
             )
 
-        torch.manual_seed(seed)
+        # Same splits in every process, without reseeding the global RNG
+        generator = torch.Generator().manual_seed(seed)
         train_indices, val_indices, test_indices = random_split(
-            indices, [train_size, val_size, test_size]
+            indices, [train_size, val_size, test_size], generator=generator
         )
 
         train_dataset = torch.utils.data.Subset(dataset, train_indices)
@@ -90,14 +97,30 @@ class DataModule(pl.LightningDataModule):
     def test_dataloader(self):
         return self.init_dataloader(self.test_dataset, shuffle=False)
 
-    def init_dataloader(self, dataset, shuffle=False):
-        return (
-            self.dataloader(
-                dataset,
-                shuffle=shuffle,
-            )
-            if dataset
-            else None
+    def predict_dataloader(self):
+        # Lightning shards prediction itself, without padding the last batch
+        return self.init_dataloader(self.dataset, shuffle=False, shard=False)
+
+    def distributed_sampler(self, dataset, shuffle=False):
+        """
+        Shards dataset over the processes of a data parallel run, every
+        process sees a disjoint part, reshuffled every epoch with the same
+        seed. None when running in a single process.
+        """
+        if not distributed.is_distributed():
+            return None
+        return DistributedSampler(
+            dataset, shuffle=shuffle, seed=self.seed, drop_last=self.drop_last
+        )
+
+    def init_dataloader(self, dataset, shuffle=False, shard=True):
+        if not dataset:
+            return None
+        sampler = self.distributed_sampler(dataset, shuffle) if shard else None
+        return self.dataloader(
+            dataset,
+            shuffle=shuffle and sampler is None,
+            sampler=sampler,
         )
 
 
@@ -116,3 +139,113 @@ def valid_indices(dataset):
     # Create a Subset using the valid indices
     subset = torch.utils.data.Subset(dataset, valid_indices)
     return subset
+
+
+def image_size(dataset, idx):
+    """
+    (height, width) of a sample from the dataset's image_size(idx), the size
+    after its transform, if it has one, otherwise by loading the sample
+    """
+    while isinstance(dataset, torch.utils.data.Subset):
+        dataset, idx = dataset.dataset, dataset.indices[idx]
+    if hasattr(dataset, "image_size"):
+        return tuple(dataset.image_size(idx))
+    return tuple(dataset[idx][0].shape[-2:])
+
+
+def image_sizes(dataset):
+    """(height, width) of every image in dataset, see image_size"""
+    return [image_size(dataset, idx) for idx in range(len(dataset))]
+
+
+class SizeBucketBatchSampler(Sampler):
+    """
+    Batches together samples of the same size so that images of different
+    sizes and aspect ratios can be embedded without resizing or padding,
+    e.g. by ImageEncoderViT with set_variable_resolution.
+
+    Use as DataLoader(dataset, batch_sampler=SizeBucketBatchSampler(...))
+
+    In a data parallel run the batches are dealt out to the processes,
+    num_replicas and rank default to those of the process group. They are
+    read when iterating, as the sampler is usually built before Lightning
+    starts the process group.
+    """
+
+    def __init__(
+        self,
+        sizes,
+        batch_size,
+        shuffle=False,
+        drop_last=False,
+        seed=42,
+        num_replicas=None,
+        rank=None,
+    ):
+        self.sizes = [tuple(size) for size in sizes]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self._num_replicas = num_replicas
+        self._rank = rank
+
+    @property
+    def num_replicas(self):
+        if self._num_replicas is None:
+            return distributed.world_size()
+        return self._num_replicas
+
+    @property
+    def rank(self):
+        return distributed.rank() if self._rank is None else self._rank
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def buckets(self):
+        buckets = {}
+        for idx, size in enumerate(self.sizes):
+            buckets.setdefault(size, []).append(idx)
+        return buckets
+
+    def batches(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        batches = []
+        for indices in self.buckets().values():
+            if self.shuffle:
+                perm = torch.randperm(len(indices), generator=generator)
+                indices = [indices[i] for i in perm]
+            for start in range(0, len(indices), self.batch_size):
+                batch = indices[start : start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch)
+        if self.shuffle:
+            perm = torch.randperm(len(batches), generator=generator)
+            batches = [batches[i] for i in perm]
+        return self.shard(batches)
+
+    def shard(self, batches):
+        """
+        Every process gets the same number of batches, by repeating the
+        first ones (dropping the last ones with drop_last)
+        """
+        num_replicas = self.num_replicas
+        if num_replicas == 1:
+            return batches
+        remainder = len(batches) % num_replicas
+        if remainder and self.drop_last:
+            batches = batches[: len(batches) - remainder]
+        elif remainder:
+            padding = num_replicas - remainder
+            batches = batches + (batches * padding)[:padding]
+        return batches[self.rank :: num_replicas]
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return len(self.batches())
@@ -0,0 +1,86 @@
+"""
+Throttled image logging for training.
+
+Making grids of the whole batch and writing them synchronously on every step
+stalls training, so images are only logged every `every_n_steps` steps and/or
+every `every_n_seconds` seconds, capped at `max_samples` images per tag.
+
+The selected samples are detached and copied to the CPU on the training
+thread; the grids are made and written by a single background thread.
+If the previous write is still running the new images are dropped instead
+of queued, so logging never falls behind training.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torchvision
+
+
+class ImageLogger:
+    def __init__(
+        self,
+        every_n_steps=50,
+        every_n_seconds=None,
+        max_samples=16,
+        clock=time.monotonic,
+    ):
+        self.every_n_steps = every_n_steps
+        self.every_n_seconds = every_n_seconds
+        self.max_samples = max_samples
+        self.clock = clock
+        self.last_time = None
+        self.executor = None
+        self.future = None
+
+    def __getstate__(self):
+        # Threads cannot be pickled or deep copied
+        state = self.__dict__.copy()
+        state["executor"] = None
+        state["future"] = None
+        return state
+
+    def should_log(self, step):
+        if self.future is not None and not self.future.done():
+            return False
+        if self.every_n_steps and step % self.every_n_steps == 0:
+            return True
+        if self.every_n_seconds:
+            now = self.clock()
+            if self.last_time is None:
+                self.last_time = now
+            return now - self.last_time >= self.every_n_seconds
+        return False
+
+    def snapshot(self, images):
+        return {
+            tag: image[: self.max_samples].detach().to("cpu", copy=True)
+            for tag, image in images.items()
+        }
+
+    def log(self, experiment, images, step):
+        """
+        Logs a grid for every tag in `images` if the policy allows it at
+        this step, returns whether anything was submitted.
+        """
+        if not self.should_log(step):
+            return False
+        self.last_time = self.clock()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.future = self.executor.submit(
+            self.write, experiment, self.snapshot(images), step
+        )
+        return True
+
+    @staticmethod
+    def write(experiment, images, step):
+        for tag, image in images.items():
+            experiment.add_image(tag, torchvision.utils.make_grid(image), step)
+
+    def close(self):
+        """Waits for the pending write"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.future = None
@@ -0,0 +1,18 @@
+from types import SimpleNamespace
+
+from bioimage_embed.lightning.torch import AutoEncoder
+from bioimage_embed.models import create_model
+
+
+def test_passed_args_override_defaults():
+    model = create_model("resnet18_vae", (1, 64, 64), 8)
+    args = SimpleNamespace(lr=1e-2, opt="sgd", log_images_every_n_steps=5)
+    lit_model = AutoEncoder(model, args)
+    assert lit_model.args.lr == 1e-2
+    assert lit_model.args.opt == "sgd"
+    assert lit_model.hparams.lr == 1e-2
+    assert lit_model.image_logger.every_n_steps == 5
+    # Arguments that are not passed keep the class defaults
+    assert lit_model.args.sched == AutoEncoder.args.sched
+    # The class defaults are not modified
+    assert AutoEncoder.args.lr == 1e-4
@@ -0,0 +1,133 @@
+import os
+
+import pytest
+import pytorch_lightning as pl
+import torch
+from pytorch_lightning.callbacks import ModelCheckpoint
+from torch.utils.data import DataLoader, TensorDataset
+
+from bioimage_embed.lightning import AEUnsupervised, checkpoint
+from bioimage_embed.lightning.checkpoint import AsyncCheckpointIO
+from bioimage_embed.models import create_model
+
+
+def state(value=1.0):
+    return {
+        "epoch": 3,
+        "state_dict": {
+            "model.encoder.weight": torch.full((4, 4), value),
+            "model.decoder.weight": torch.full((4,), value),
+            "head.bias": torch.full((2,), value),
+        },
+        "optimizer_states": [{"state": {0: {"exp_avg": torch.ones(3)}}}],
+    }
+
+
+def assert_equal(a, b):
+    assert a["epoch"] == b["epoch"]
+    assert a["state_dict"].keys() == b["state_dict"].keys()
+    for key in a["state_dict"]:
+        assert torch.equal(a["state_dict"][key], b["state_dict"][key])
+    assert torch.equal(
+        a["optimizer_states"][0]["state"][0]["exp_avg"],
+        b["optimizer_states"][0]["state"][0]["exp_avg"],
+    )
+
+
+@pytest.mark.parametrize("shard", [False, True])
+def test_save_load(tmp_path, shard):
+    io = AsyncCheckpointIO(shard=shard)
+    path = tmp_path / "last.ckpt"
+    ckpt = state()
+    io.save_checkpoint(ckpt, path)
+    # Training goes on while the snapshot is written
+    ckpt["state_dict"]["head.bias"].add_(1)
+    loaded = io.load_checkpoint(path)
+    assert_equal(loaded, state())
+    files = os.listdir(tmp_path)
+    assert len(files) == (4 if shard else 1)
+    assert not [name for name in files if ".tmp-" in name]
+
+
+def test_overwrite_removes_stale_shards(tmp_path):
+    io = AsyncCheckpointIO(shard=True)
+    path = tmp_path / "last.ckpt"
+    io.save_checkpoint(state(1.0), path)
+    io.save_checkpoint(state(2.0), path)
+    io.teardown()
+    assert len(os.listdir(tmp_path)) == 4
+    assert_equal(checkpoint.load_checkpoint(path), state(2.0))
+    io.remove_checkpoint(path)
+    io.teardown()
+    assert not os.listdir(tmp_path)
+
+
+def test_saves_do_not_read_checkpoints(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Checkpoint read back")
+
+    monkeypatch.setattr(torch, "load", fail)
+    io = AsyncCheckpointIO()
+    for epoch in range(3):
+        io.save_checkpoint(state(epoch), tmp_path / "last.ckpt")
+        io.save_checkpoint(state(epoch), tmp_path / f"epoch={epoch}.ckpt")
+        if epoch:
+            io.remove_checkpoint(tmp_path / f"epoch={epoch - 1}.ckpt")
+    io.teardown()
+    assert sorted(os.listdir(tmp_path)) == ["epoch=2.ckpt", "last.ckpt"]
+
+
+def test_failed_write_keeps_previous(tmp_path, monkeypatch):
+    io = AsyncCheckpointIO(shard=True)
+    path = tmp_path / "last.ckpt"
+    io.save_checkpoint(state(1.0), path)
+    io.teardown()
+
+    def fail(obj, f):
+        open(f, "w").close()
+        raise OSError("Disk full")
+
+    monkeypatch.setattr(torch, "save", fail)
+    io.save_checkpoint(state(2.0), path)
+    with pytest.raises(OSError):
+        io.teardown()
+    monkeypatch.undo()
+    assert len(os.listdir(tmp_path)) == 4
+    assert_equal(io.load_checkpoint(path), state(1.0))
+
+
+def fit(dirpath, max_epochs, ckpt_path=None, plugins=None):
+    torch.manual_seed(0)
+    dataset = TensorDataset(torch.rand(8, 1, 64, 64), torch.zeros(8))
+    lit_model = AEUnsupervised(create_model("resnet18_vae", (1, 64, 64), 8))
+    trainer = pl.Trainer(
+        max_epochs=max_epochs,
+        accelerator="cpu",
+        logger=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        callbacks=[ModelCheckpoint(dirpath=dirpath, save_last=True)],
+        plugins=plugins,
+    )
+    trainer.fit(
+        lit_model, DataLoader(dataset, batch_size=4), ckpt_path=ckpt_path
+    )
+    return trainer, lit_model
+
+
+def test_trainer_resume(tmp_path):
+    fit(tmp_path, 1, plugins=[AsyncCheckpointIO(shard=True)])
+    last = tmp_path / "last.ckpt"
+    assert checkpoint.shard_paths(last)
+
+    trainer, lit_model = fit(
+        tmp_path, 2, last, plugins=[AsyncCheckpointIO(shard=True)]
+    )
+    assert trainer.global_step == 4
+    state_dict = checkpoint.load_checkpoint(last)["state_dict"]
+    for key, value in lit_model.state_dict().items():
+        assert torch.equal(state_dict[key], value)
+
+    # Without the plugin the shards are never merged
+    with pytest.raises(RuntimeError, match="Sharded checkpoint"):
+        fit(tmp_path, 3, last)
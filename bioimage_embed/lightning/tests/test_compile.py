@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from bioimage_embed.lightning.torch import AutoEncoder
+from bioimage_embed.models import create_model
+from bioimage_embed.models.legacy.vq_vae import VectorQuantizerEMA
+
+
+def reference_ema(vq, encodings, flat_input):
+    # The update as it was before being made in place
+    cluster_size = vq._ema_cluster_size * vq._decay + (
+        1 - vq._decay
+    ) * torch.sum(encodings, 0)
+    n = torch.sum(cluster_size)
+    cluster_size = (
+        (cluster_size + vq._epsilon)
+        / (n + vq._num_embeddings * vq._epsilon)
+        * n
+    )
+    dw = torch.matmul(encodings.t(), flat_input)
+    ema_w = vq._ema_w * vq._decay + (1 - vq._decay) * dw
+    return ema_w / cluster_size.unsqueeze(1)
+
+
+def test_ema_update_in_place(num_embeddings=8, embedding_dim=4):
+    vq = VectorQuantizerEMA(num_embeddings, embedding_dim, 0.25, 0.99)
+    parameters = {name: id(p) for name, p in vq.named_parameters()}
+    x = torch.randn(2, embedding_dim, 3, 3)
+    flat = x.permute(0, 2, 3, 1).reshape(-1, embedding_dim)
+    # Encodings without the update of training mode
+    encodings = vq.eval()(x)[-1]
+    expected = reference_ema(vq, encodings, flat)
+    vq.update_ema(encodings, flat)
+    assert torch.allclose(vq._embedding.weight, expected, atol=1e-6)
+    # Nothing re-created, the optimizer keeps seeing the same tensors
+    assert parameters == {name: id(p) for name, p in vq.named_parameters()}
+
+
+@pytest.mark.parametrize("model", ["resnet18_vae", "resnet18_vqvae_legacy"])
+def test_compile_keeps_state_dict(model, input_dim=(1, 64, 64), ld=16):
+    eager = AutoEncoder(create_model(model, input_dim, ld))
+    compiled = AutoEncoder(
+        create_model(model, input_dim, ld), SimpleNamespace(compile=True)
+    )
+    assert eager.state_dict().keys() == compiled.state_dict().keys()
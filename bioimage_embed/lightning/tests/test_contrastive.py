@@ -0,0 +1,86 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from bioimage_embed.lightning.torch import (
+    create_label_based_pairs,
+    label_pair_indices,
+    SupervisedContrastiveLoss,
+)
+
+
+def loop_pairs(features, labels):
+    # Per class reference implementation
+    labels = labels.squeeze()
+    inputs, targets = [], []
+    for label in torch.unique(labels):
+        class_samples = features[labels == label]
+        if class_samples.size(0) > 1:
+            pairs = torch.combinations(torch.arange(class_samples.size(0)), r=2)
+            inputs.append(class_samples[pairs[:, 0]])
+            targets.append(class_samples[pairs[:, 1]])
+    return torch.cat(inputs), torch.cat(targets)
+
+
+@pytest.fixture(params=[16, 64])
+def batch_size(request):
+    return request.param
+
+
+@pytest.fixture()
+def features(batch_size, latent_dim=8):
+    return torch.randn(batch_size, latent_dim)
+
+
+@pytest.fixture()
+def labels(batch_size, classes=3):
+    labels = torch.arange(batch_size) % classes
+    return labels[torch.randperm(batch_size)][:, None]
+
+
+def test_pairs_match_loop(features, labels):
+    inputs, targets = create_label_based_pairs(features, labels)
+    expected_inputs, expected_targets = loop_pairs(features, labels)
+    assert torch.equal(inputs, expected_inputs)
+    assert torch.equal(targets, expected_targets)
+
+
+def test_single_class(features):
+    inputs, targets = create_label_based_pairs(
+        features, torch.zeros(len(features), 1)
+    )
+    assert inputs.shape == targets.shape == (0, features.size(1))
+
+
+@pytest.mark.parametrize("max_pairs_per_class", [0, 1, 5])
+def test_max_pairs_per_class(labels, max_pairs_per_class):
+    i, j = label_pair_indices(labels, max_pairs_per_class)
+    labels = labels.reshape(-1)
+    assert torch.equal(labels[i], labels[j])
+    assert (i < j).all()
+    _, counts = torch.unique(labels[i], return_counts=True)
+    assert (counts <= max_pairs_per_class).all()
+    all_i, _ = label_pair_indices(labels)
+    assert len(i) == sum(
+        min(int((labels[all_i] == label).sum()), max_pairs_per_class)
+        for label in torch.unique(labels)
+    )
+
+
+def test_supcon_matches_loop(features, labels, temperature=0.5):
+    features.requires_grad_(True)
+    loss = SupervisedContrastiveLoss(temperature)(features, labels)
+    loss.backward()
+    assert torch.isfinite(features.grad).all()
+
+    z = F.normalize(features.detach(), dim=1)
+    labels = labels.reshape(-1)
+    losses = []
+    for a in range(len(z)):
+        others = [k for k in range(len(z)) if k != a]
+        denominator = torch.logsumexp(z[a] @ z[others].T / temperature, 0)
+        positives = [k for k in others if labels[k] == labels[a]]
+        if positives:
+            log_prob = z[a] @ z[positives].T / temperature - denominator
+            losses.append(-log_prob.mean())
+    assert torch.allclose(loss.detach(), torch.stack(losses).mean(), atol=1e-5)
@@ -0,0 +1,54 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from bioimage_embed.lightning.dataloader import (
+    SizeBucketBatchSampler,
+    image_sizes,
+)
+
+
+class VariableSizeDataset(torch.utils.data.Dataset):
+    shapes = [(32, 32), (32, 64), (64, 32)]
+
+    def __len__(self):
+        return 20
+
+    def __getitem__(self, idx):
+        return torch.rand(1, *self.shapes[idx % 3]), idx
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_size_buckets(shuffle, drop_last, batch_size=3):
+    dataset = VariableSizeDataset()
+    sampler = SizeBucketBatchSampler(
+        image_sizes(dataset), batch_size, shuffle=shuffle, drop_last=drop_last
+    )
+    seen = []
+    for x, idx in DataLoader(dataset, batch_sampler=sampler):
+        # Every batch stacks, i.e. holds a single size
+        assert len(idx) <= batch_size
+        seen += idx.tolist()
+    assert len(set(seen)) == len(seen)
+    if not drop_last:
+        assert sorted(seen) == list(range(len(dataset)))
+    assert len(sampler) == len(sampler.batches())
+
+
+class SizedDataset(VariableSizeDataset):
+    # Sizes from metadata, e.g. image headers, without loading samples
+    def image_size(self, idx):
+        return self.shapes[idx % 3]
+
+    def __getitem__(self, idx):
+        raise AssertionError("Samples should not be loaded")
+
+
+def test_image_sizes_from_metadata():
+    dataset = SizedDataset()
+    expected = [VariableSizeDataset.shapes[i % 3] for i in range(20)]
+    assert image_sizes(dataset) == expected
+    subset = torch.utils.data.Subset(dataset, [2, 4])
+    assert image_sizes(subset) == [expected[2], expected[4]]
+    assert image_sizes(VariableSizeDataset()) == expected
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from bioimage_embed import distributed
+from bioimage_embed.lightning.dataloader import (
+    DataModule,
+    SizeBucketBatchSampler,
+)
+from bioimage_embed.models.legacy.vq_vae import VectorQuantizerEMA
+
+WORLD_SIZE = 2
+
+
+def inputs(num_embeddings=8, embedding_dim=4):
+    torch.manual_seed(0)
+    vq = VectorQuantizerEMA(num_embeddings, embedding_dim, 0.25, 0.99)
+    x = torch.randn(2 * WORLD_SIZE, embedding_dim, 3, 3)
+    return vq, x
+
+
+def worker(rank, init_file, output_dir):
+    # Built before the process group, as Lightning builds dataloaders
+    sampler = SizeBucketBatchSampler([(1, 1)] * 9 + [(2, 2)] * 2, 2)
+    dist.init_process_group(
+        "gloo",
+        init_method=f"file://{init_file}",
+        rank=rank,
+        world_size=WORLD_SIZE,
+    )
+    vq, x = inputs()
+    vq.train()(x.chunk(WORLD_SIZE)[rank])
+
+    datamodule = DataModule(torch.arange(40), batch_size=4, num_workers=0)
+    train = [i for batch in datamodule.train_dataloader() for i in batch]
+
+    torch.save(
+        {
+            "codebook": vq._embedding.weight,
+            "train": torch.stack(train).tolist(),
+            "batches": list(sampler),
+            "num_batches": len(sampler),
+        },
+        os.path.join(output_dir, f"{rank}.pt"),
+    )
+    dist.destroy_process_group()
+
+
+@pytest.fixture(scope="module")
+def results(tmp_path_factory):
+    if not dist.is_available():
+        pytest.skip("torch.distributed is not available")
+    output_dir = tmp_path_factory.mktemp("ddp")
+    init_file = output_dir / "init"
+    mp.spawn(worker, args=(str(init_file), str(output_dir)), nprocs=WORLD_SIZE)
+    return [torch.load(output_dir / f"{rank}.pt") for rank in range(2)]
+
+
+def test_single_process_fallback():
+    assert not distributed.is_distributed()
+    assert distributed.world_size() == 1
+    assert distributed.rank() == 0
+
+
+def test_codebooks_match_global_batch(results):
+    # Every process ends up with the codebook of the full batch
+    vq, x = inputs()
+    vq.train()(x)
+    for result in results:
+        assert torch.allclose(result["codebook"], vq._embedding.weight)
+
+
+def test_train_split_is_sharded(results):
+    train = [set(result["train"]) for result in results]
+    assert not train[0] & train[1]
+    expected = DataModule(torch.arange(40), num_workers=0).train_dataset
+    assert train[0] | train[1] == {int(i) for i in expected}
+
+
+def test_size_buckets_are_sharded(results):
+    batches = [result["batches"] for result in results]
+    assert len(batches[0]) == len(batches[1])
+    assert [result["num_batches"] for result in results] == [3, 3]
+    seen = [i for rank in batches for batch in rank for i in batch]
+    assert set(seen) == set(range(11))
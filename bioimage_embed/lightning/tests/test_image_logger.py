@@ -0,0 +1,44 @@
+import pytest
+import torch
+
+from bioimage_embed.lightning.image_logger import ImageLogger
+
+
+class Experiment:
+    # Stands in for a tensorboard SummaryWriter
+    def __init__(self):
+        self.images = []
+
+    def add_image(self, tag, image, step):
+        self.images.append((tag, image, step))
+
+
+@pytest.fixture()
+def images(batch_size=32):
+    return {"input": torch.rand(batch_size, 1, 8, 8, requires_grad=True)}
+
+
+def test_every_n_steps(images):
+    experiment = Experiment()
+    image_logger = ImageLogger(every_n_steps=10, max_samples=4)
+    for step in range(25):
+        image_logger.log(experiment, images, step)
+        image_logger.close()
+    assert [step for _, _, step in experiment.images] == [0, 10, 20]
+    _, grid, _ = experiment.images[0]
+    assert not grid.requires_grad
+    # Four 8x8 samples in a single row, with the default 2 pixel padding
+    assert grid.shape[-1] == 4 * (8 + 2) + 2
+
+
+def test_every_n_seconds(images):
+    now = [0.0]
+    experiment = Experiment()
+    image_logger = ImageLogger(
+        every_n_steps=None, every_n_seconds=5, clock=lambda: now[0]
+    )
+    for step in range(20):
+        image_logger.log(experiment, images, step)
+        image_logger.close()
+        now[0] += 1
+    assert [step for _, _, step in experiment.images] == [5, 10, 15]
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+from torch.utils.data import TensorDataset
+from transformers.utils import ModelOutput
+
+from bioimage_embed.models import create_model
+from bioimage_embed.shapes.lightning import MaskEmbed
+from bioimage_embed.lightning.writer import (
+    EmbeddingWriter,
+    read_embeddings,
+    embeddings_to_numpy,
+    written_indices,
+)
+
+
+@pytest.fixture(params=[4])
+def latent_dim(request):
+    return request.param
+
+
+@pytest.fixture()
+def dataset(latent_dim, samples=10):
+    x = torch.rand(samples, latent_dim)
+    y = torch.randint(0, 2, (samples,))
+    return TensorDataset(x, y)
+
+
+def predict(writer, dataset, batch_size=3):
+    # Mimics trainer.predict, the "model" is the identity on x
+    indices = list(range(len(dataset)))
+    for start in range(0, len(dataset), batch_size):
+        batch_indices = indices[start : start + batch_size]
+        x, y = dataset[batch_indices]
+        prediction = ModelOutput(z=x)
+        writer.write_on_batch_end(
+            None, None, prediction, batch_indices, (x, y), start, 0
+        )
+    writer.flush()
+
+
+def test_write_and_read(tmp_path, dataset, latent_dim):
+    writer = EmbeddingWriter(tmp_path, dataset=dataset, rows_per_part=4)
+    predict(writer, dataset)
+    table = read_embeddings(tmp_path)
+    z = embeddings_to_numpy(table)
+    assert z.shape == (len(dataset), latent_dim)
+    order = table["index"].to_pylist()
+    assert torch.allclose(torch.from_numpy(z), dataset.tensors[0][order])
+    assert table["label"].to_pylist() == dataset.tensors[1][order].tolist()
+
+
+def test_resume(tmp_path, dataset):
+    writer = EmbeddingWriter(tmp_path, dataset=dataset)
+    predict(writer, torch.utils.data.Subset(dataset, range(4)))
+    assert written_indices(tmp_path) == set(range(4))
+
+    writer = EmbeddingWriter(tmp_path, dataset=dataset)
+    pending = writer.pending()
+    assert len(pending) == len(dataset) - 4
+    predict(writer, pending)
+    assert written_indices(tmp_path) == set(range(len(dataset)))
+    assert len(read_embeddings(tmp_path)) == len(dataset)
+
+
+@pytest.mark.parametrize("frobenius_norm", [True, False])
+def test_mask_embed_scalings(tmp_path, frobenius_norm, samples=5, n=64):
+    # Through a real predict_step, as trainer.predict would call it
+    args = SimpleNamespace(frobenius_norm=frobenius_norm)
+    lit_model = MaskEmbed(create_model("resnet18_vae", (1, n, n), 4), args)
+    lit_model.eval()
+    x = torch.rand(samples, 1, n, n)
+    y = torch.zeros(samples, dtype=torch.long)
+    writer = EmbeddingWriter(tmp_path)
+    with torch.inference_mode():
+        prediction = lit_model.predict_step((x, y), 0)
+    writer.write_on_batch_end(
+        None, lit_model, prediction, list(range(samples)), (x, y), 0, 0
+    )
+    writer.flush()
+    scalings = read_embeddings(tmp_path)["scaling"].to_pylist()
+    expected = (
+        x.flatten(1).norm(dim=1) if frobenius_norm else torch.ones(samples)
+    )
+    assert torch.allclose(torch.tensor(scalings), expected, rtol=1e-5)
@@ -1,3 +1,4 @@
+import math
 import torchvision
 import torch
 import pytorch_lightning as pl
@@ -8,6 +9,11 @@ from transformers.utils import ModelOutput
 import torch.nn.functional as F
 from monai import losses
 
+from .checkpoint import SHARDS
+from .image_logger import ImageLogger
+from .. import distributed
+from ..models.nets.resnet import ResidualStack
+
 """
 x_recon -> output of the model
 z -> latent space
@@ -45,32 +51,93 @@ class AutoEncoder(pl.LightningModule):
         cooldown_epochs=5,
         warmup_t=0,
         channel_aware=False,
+        log_images_every_n_steps=50,
+        log_images_every_n_seconds=None,
+        log_images_max_samples=16,
+        compile=False,
+        compile_mode=None,
+        compile_dynamic=None,
+        channels_last=False,
+        grad_checkpointing=False,
+        checkpoint_segments=None,
     )
 
     def __init__(self, model, args=SimpleNamespace()):
         super().__init__()
+        # Lightning moves the model to its device, it may also be built
+        # on the meta device for a dry run
         self.model = model
-        self.model = self.model.to(self.device)
         # Flatten hparams
         self.encoder = self.model.encoder
         self.decoder = self.model.decoder
         if args:
-            self.args = SimpleNamespace(**{**vars(args), **vars(self.args)})
+            # Passed arguments (the recipe) take precedence over the class
+            # defaults. Previously the defaults won, silently ignoring e.g.
+            # the recipe's lr, opt and epochs.
+            self.args = SimpleNamespace(**{**vars(self.args), **vars(args)})
         self.save_hyperparameters(vars(self.args))
+        self.image_logger = ImageLogger(
+            every_n_steps=self.args.log_images_every_n_steps,
+            every_n_seconds=self.args.log_images_every_n_seconds,
+            max_samples=self.args.log_images_max_samples,
+        )
+        if self.args.grad_checkpointing or self.args.checkpoint_segments:
+            self.set_grad_checkpointing(segments=self.args.checkpoint_segments)
+        if self.args.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        if self.args.compile:
+            self.compile_model()
         # TODO update all models to use this for export to onxx
         # self.example_input_array = torch.randn(1, *self.model.input_dim)
         # self.model.train()
 
+    def set_grad_checkpointing(self, enable=True, segments=None):
+        """
+        Activation checkpointing in every submodule that supports it,
+        the ResNet residual stacks and timm models. segments only applies
+        to the residual stacks, by default one segment per residual block.
+        """
+        for module in self.model.modules():
+            if isinstance(module, ResidualStack):
+                module.set_grad_checkpointing(enable, segments)
+            elif hasattr(module, "set_grad_checkpointing"):
+                module.set_grad_checkpointing(enable)
+
+    def compile_model(self):
+        """
+        torch.compile the encoder, the decoder and the model's loss in place,
+        so parameter names and checkpoints are the same as without.
+
+        compile_dynamic=None compiles static shapes first and only marks
+        them dynamic after a recompile, e.g. for a smaller last batch.
+        """
+        options = dict(
+            mode=self.args.compile_mode, dynamic=self.args.compile_dynamic
+        )
+        for module in (self.model.encoder, self.model.decoder):
+            if isinstance(module, torch.nn.Module):
+                module.compile(**options)
+        if hasattr(self.model, "loss_function"):
+            self.model.loss_function = torch.compile(
+                self.model.loss_function, **options
+            )
+
     def forward(self, x):
         # batch = self.training_batch(x)
-        batch = ModelOutput(data=x.float())
-        return self.model(batch)
+        x = x.float()
+        if self.args.channels_last and x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        # A plain dict, pythae models only index it
+        return self.model({"data": x})
 
     def predict_step(self, batch, batch_idx, dataloader_idx=0):
         # model_input = self.training_batch(batch)
         # model_output = self(x)
         # Add the target to the model output
         # model_output.data, model_output.target = batch
+        # Dataloaders yield (x, y) whereas eval_step passes x directly
+        if isinstance(batch, (list, tuple)):
+            batch = batch[0]
         return self(batch)
 
     # Function is redundant ?
@@ -81,6 +148,17 @@ class AutoEncoder(pl.LightningModule):
     def embedding(self, model_output: ModelOutput):
         return model_output.z.view(model_output.z.shape[0], -1)
 
+    def encode(self, x):
+        """
+        Encoder only forward pass for inference, skips decoding and the loss.
+        Models with a non-standard encoder provide their own encode method.
+        """
+        batch = {"data": x.float()}
+        if hasattr(self.model, "encode"):
+            return self.model.encode(batch)
+        embedding = self.model.encoder(batch["data"]).embedding
+        return ModelOutput(z=embedding.flatten(1))
+
     def training_step(self, batch, batch_idx):
         self.model.train()
         loss, model_output = self.eval_step(batch, batch_idx)
@@ -204,18 +282,26 @@ class AutoEncoder(pl.LightningModule):
         pass
 
     def log_tensorboard(self, model_output, x):
-        # Optionally you can add more logging, for example, visualizations:
-        self.logger.experiment.add_image(
-            "test_input",
-            torchvision.utils.make_grid(model_output.data),
-            self.global_step,
-        )
-        self.logger.experiment.add_image(
-            "test_output",
-            torchvision.utils.make_grid(model_output.recon_x),
+        # Throttled and written in the background, see ImageLogger
+        self.image_logger.log(
+            self.logger.experiment,
+            {"test_input": x, "test_output": model_output.recon_x},
             self.global_step,
         )
 
+    def on_train_end(self):
+        self.image_logger.close()
+
+    def on_load_checkpoint(self, checkpoint):
+        # Only AsyncCheckpointIO and checkpoint.load_checkpoint merge the
+        # shards, anything else would find no state_dict
+        if SHARDS in checkpoint:
+            raise RuntimeError(
+                "Sharded checkpoint, load it with a Trainer using the "
+                "AsyncCheckpointIO plugin or with "
+                "bioimage_embed.lightning.checkpoint.load_checkpoint"
+            )
+
 
 class AE(AutoEncoder):
     pass
@@ -229,8 +315,46 @@ class AEUnsupervised(AutoEncoder):
     pass
 
 
+def label_pair_indices(
+    labels: torch.Tensor, max_pairs_per_class: int = None
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Indices (i, j), i < j, of all pairs of samples sharing a label.
+
+    Pairs are grouped by class in ascending label order, as torch.unique
+    would give. With max_pairs_per_class at most that many pairs are
+    randomly sampled from each class.
+    """
+    labels = labels.reshape(-1)
+    i, j = torch.triu_indices(
+        len(labels), len(labels), offset=1, device=labels.device
+    )
+    same = labels[i] == labels[j]
+    i, j = i[same], j[same]
+    pair_labels = labels[i]
+
+    if max_pairs_per_class is not None:
+        # Shuffle before the stable sort so each class is in random order
+        perm = torch.randperm(len(i), device=labels.device)
+        i, j, pair_labels = i[perm], j[perm], pair_labels[perm]
+    order = torch.sort(pair_labels, stable=True).indices
+    i, j, pair_labels = i[order], j[order], pair_labels[order]
+
+    if max_pairs_per_class is not None:
+        # Rank of every pair within its class, keep the first max_pairs
+        _, counts = torch.unique_consecutive(pair_labels, return_counts=True)
+        starts = torch.cumsum(counts, 0) - counts
+        rank = torch.arange(len(i), device=labels.device)
+        rank = rank - torch.repeat_interleave(starts, counts)
+        keep = rank < max_pairs_per_class
+        i, j = i[keep], j[keep]
+    return i, j
+
+
 def create_label_based_pairs(
-    features: torch.Tensor, labels: torch.Tensor
+    features: torch.Tensor,
+    labels: torch.Tensor,
+    max_pairs_per_class: int = None,
 ) -> tuple[torch.Tensor, torch.Tensor]:
     """
     Create positive pairs based on labels.
@@ -238,40 +362,79 @@ def create_label_based_pairs(
     Args:
     features: Tensor of shape (b, latent_dim)
     labels: Tensor of shape (b, 1)
+    max_pairs_per_class: Optional cap on the pairs sampled from each class
 
     Returns:
     tuple of two tensors, each of shape (n, latent_dim), where n is the number of pairs
     """
-    labels = labels.squeeze()  # Convert (b, 1) to (b,)
-    unique_labels = torch.unique(labels)
-
-    if len(unique_labels) == 1:
-        return torch.empty(0, features.size(1)), torch.empty(0, features.size(1))
-
-    positive_pairs = []
-
-    for label in unique_labels:
-        mask = labels == label
-        class_samples = features[mask]
-        if class_samples.size(0) > 1:  # We need at least 2 samples of the same class
-            # Create all possible pairs within this class
-            num_samples = class_samples.size(0)
-            pairs = torch.combinations(torch.arange(num_samples), r=2)
-            positive_pairs.append(
-                (class_samples[pairs[:, 0]], class_samples[pairs[:, 1]])
-            )
+    labels = labels.reshape(-1)  # Convert (b, 1) to (b,)
+    # A single class leaves no negatives for the contrastive loss
+    if len(labels) == 0 or bool((labels == labels[0]).all()):
+        empty = features.new_empty(0, features.size(1))
+        return empty, empty
+
+    i, j = label_pair_indices(labels, max_pairs_per_class)
+    return features[i], features[j]
 
-    if not positive_pairs:
-        return torch.empty(0, features.size(1)), torch.empty(0, features.size(1))
 
-    input_pairs = torch.cat([pair[0] for pair in positive_pairs])
-    target_pairs = torch.cat([pair[1] for pair in positive_pairs])
+class SupervisedContrastiveLoss(torch.nn.Module):
+    """
+    Supervised contrastive loss (Khosla et al. 2020), every other sample of
+    the same label is a positive and the rest of the batch are negatives.
+
+    Computed from the (b, b) similarity matrix of the batch so the pairs
+    are never materialised.
+    """
 
-    return input_pairs, target_pairs
+    def __init__(self, temperature: float = 0.5):
+        super().__init__()
+        self.temperature = temperature
+
+    def forward(self, features: torch.Tensor, labels: torch.Tensor):
+        z = F.normalize(features.flatten(1), dim=1)
+        logits = z @ z.T / self.temperature
+        self_mask = torch.eye(len(z), dtype=torch.bool, device=z.device)
+        # Finite fill so a lone sample gives zero rather than nan gradients
+        logits = logits.masked_fill(self_mask, torch.finfo(logits.dtype).min)
+        log_prob = logits - torch.logsumexp(logits, dim=1, keepdim=True)
+
+        labels = labels.reshape(-1)
+        positives = (labels[:, None] == labels[None, :]) & ~self_mask
+        num_positives = positives.sum(1)
+        positive_log_prob = torch.where(
+            positives, log_prob, torch.zeros_like(log_prob)
+        ).sum(1)
+        # Anchors without positives are left out of the mean
+        anchors = num_positives > 0
+        loss = -positive_log_prob / num_positives.clamp(min=1)
+        return (loss * anchors).sum() / anchors.sum().clamp(min=1)
 
 
 class AutoEncoderSupervised(AutoEncoder):
     criteron = losses.ContrastiveLoss()
+    supcon = SupervisedContrastiveLoss()
+
+    def gather(self, z, target):
+        """
+        Embeddings and labels of the global batch when data parallel, so
+        pairs are also formed across processes. Gradients flow back to
+        every process's own embeddings.
+        """
+        if not distributed.is_distributed():
+            return z, target
+        z = self.all_gather(z, sync_grads=True).flatten(0, 1)
+        target = self.all_gather(target).flatten(0, 1)
+        return z, target
+
+    def contrastive_loss(self, z, target):
+        z, target = self.gather(z, target)
+        # Fused loss on the similarity matrix, or monai's on explicit pairs
+        if getattr(self.args, "supcon", False):
+            return self.supcon(z, target)
+        pairs = create_label_based_pairs(
+            z, target, getattr(self.args, "max_pairs_per_class", None)
+        )
+        return self.criteron(*pairs)
 
     def loss_function(self, model_output, batch_idx):
         # x, y = batch
@@ -279,9 +442,10 @@ class AutoEncoderSupervised(AutoEncoder):
         # TODO check this
         # Scale is used as the rest of the loss functions are sums rather than means, which may mean we need to scale up the contrastive loss
 
-        scale = torch.prod(torch.tensor(model_output.z.shape[1:]))
-        pairs = create_label_based_pairs(model_output.z.squeeze(), model_output.target)
-        contrastive_loss = self.criteron(*pairs)
+        scale = math.prod(model_output.z.shape[1:])
+        contrastive_loss = self.contrastive_loss(
+            model_output.z.flatten(1), model_output.target
+        )
         loss["contrastive_loss"] = scale * contrastive_loss
         loss["loss"] += loss["contrastive_loss"]
         return loss
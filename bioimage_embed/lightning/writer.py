@@ -0,0 +1,187 @@
+"""
+Streams embeddings to disk during `trainer.predict` instead of collecting
+every prediction in memory.
+
+Each flush writes one Parquet part (part-00000.parquet, part-00001.parquet ...)
+to `output_dir` with the columns:
+
+index -> position of the sample in the prediction dataset
+z -> flattened latent vector (fixed size list of float32)
+label -> target from the batch, if any
+scaling -> per sample scaling (e.g. frobenius norm for shapes), if any
+path -> source file of the sample, if the dataset knows it
+
+Parts are written to a temporary file and renamed, so an interrupted run only
+ever leaves complete parts behind and can be resumed with `pending`.
+"""
+
+import os
+import glob
+import logging
+
+import numpy as np
+import torch
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pytorch_lightning.callbacks import BasePredictionWriter
+
+PART_GLOB = "part-*.parquet"
+
+
+def unwrap_index(dataset, idx):
+    """Follow (nested) Subsets back to the underlying dataset and index"""
+    while isinstance(dataset, torch.utils.data.Subset):
+        idx = dataset.indices[idx]
+        dataset = dataset.dataset
+    return dataset, idx
+
+
+def source_path(dataset, idx):
+    if dataset is None:
+        return None
+    dataset, idx = unwrap_index(dataset, idx)
+    # torchvision.datasets.ImageFolder
+    if hasattr(dataset, "samples"):
+        return str(dataset.samples[idx][0])
+    # bioimage_embed.datasets.DatasetGlob
+    if hasattr(dataset, "image_paths"):
+        return str(dataset.image_paths[idx])
+    return None
+
+
+def part_paths(output_dir):
+    return sorted(glob.glob(os.path.join(output_dir, PART_GLOB)))
+
+
+def read_embeddings(output_dir, columns=None, memory_map=True):
+    """
+    Reads all parts in `output_dir` as a single pyarrow Table.
+    With memory_map the parts are mapped rather than read into RAM.
+    """
+    paths = part_paths(output_dir)
+    if not paths:
+        raise FileNotFoundError(f"No embeddings found in {output_dir}")
+    tables = [
+        pq.read_table(path, columns=columns, memory_map=memory_map)
+        for path in paths
+    ]
+    return pa.concat_tables(tables)
+
+
+def embeddings_to_numpy(table):
+    """
+    Returns the z column as a (n, latent_dim) float32 array,
+    without copying when the table holds a single chunk.
+    """
+    z = table["z"].combine_chunks()
+    latent_dim = z.type.list_size
+    values = z.flatten().to_numpy(zero_copy_only=False)
+    return values.reshape(-1, latent_dim)
+
+
+def written_indices(output_dir):
+    """Dataset indices that already have an embedding in `output_dir`"""
+    if not part_paths(output_dir):
+        return set()
+    table = read_embeddings(output_dir, columns=["index"])
+    return set(table["index"].to_pylist())
+
+
+class EmbeddingWriter(BasePredictionWriter):
+    def __init__(
+        self,
+        output_dir,
+        dataset=None,
+        rows_per_part: int = 4096,
+    ):
+        super().__init__(write_interval="batch")
+        self.output_dir = output_dir
+        self.dataset = dataset
+        self.rows_per_part = rows_per_part
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Appending continues the part numbering of any previous run
+        self.part = len(part_paths(self.output_dir))
+        self.buffer = []
+        # Maps indices of the predicted (pending) subset back to the dataset
+        self.indices = None
+
+    def pending(self, dataset=None):
+        """
+        Subset of `dataset` that has not been written yet,
+        predicting on this resumes an interrupted run.
+        """
+        dataset = dataset if dataset is not None else self.dataset
+        done = written_indices(self.output_dir)
+        self.indices = [idx for idx in range(len(dataset)) if idx not in done]
+        if len(done) > 0:
+            logging.info(
+                f"Resuming embedding, {len(self.indices)} samples pending"
+            )
+        return torch.utils.data.Subset(dataset, self.indices)
+
+    def rows(self, prediction, batch_indices, batch):
+        z = prediction["z"].detach().flatten(1).float().cpu().numpy()
+        labels = None
+        if isinstance(batch, (list, tuple)) and len(batch) > 1:
+            labels = batch[1].detach().cpu().numpy().reshape(len(z), -1)[:, 0]
+        scalings = prediction.get("scalings", None)
+        if scalings is not None:
+            scalings = scalings.detach().flatten(1)[:, 0].float().cpu().numpy()
+        if batch_indices is None:
+            batch_indices = [None] * len(z)
+        if self.indices is not None:
+            batch_indices = [self.indices[idx] for idx in batch_indices]
+        for i, idx in enumerate(batch_indices):
+            yield {
+                "index": idx,
+                "z": z[i],
+                "label": None if labels is None else labels[i].item(),
+                "scaling": None if scalings is None else scalings[i].item(),
+                "path": None if idx is None else source_path(self.dataset, idx),
+            }
+
+    def flush(self):
+        if not self.buffer:
+            return
+        z = np.stack([row["z"] for row in self.buffer]).astype(np.float32)
+        table = pa.table(
+            {
+                "index": pa.array(
+                    [row["index"] for row in self.buffer], pa.int64()
+                ),
+                "z": pa.FixedSizeListArray.from_arrays(
+                    pa.array(z.reshape(-1)), z.shape[1]
+                ),
+                "label": pa.array([row["label"] for row in self.buffer]),
+                "scaling": pa.array(
+                    [row["scaling"] for row in self.buffer], pa.float32()
+                ),
+                "path": pa.array(
+                    [row["path"] for row in self.buffer], pa.string()
+                ),
+            }
+        )
+        path = os.path.join(self.output_dir, f"part-{self.part:05d}.parquet")
+        # Write then rename so that readers never see a partial part
+        pq.write_table(table, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        self.part += 1
+        self.buffer = []
+
+    def write_on_batch_end(
+        self,
+        trainer,
+        pl_module,
+        prediction,
+        batch_indices,
+        batch,
+        batch_idx,
+        dataloader_idx,
+    ):
+        self.buffer.extend(self.rows(prediction, batch_indices, batch))
+        if len(self.buffer) >= self.rows_per_part:
+            self.flush()
+
+    def on_predict_epoch_end(self, trainer, pl_module, *args, **kwargs):
+        super().on_predict_epoch_end(trainer, pl_module, *args, **kwargs)
+        self.flush()
@@ -1,18 +1,16 @@
-import torch
-import torch.nn.functional as F
+# Model families are only imported once used, see bioimage_embed.lazy
+from ..lazy import attach
 
-# Note - you must have torchvision installed for this example
-from torch.utils.data import DataLoader
-
-# from .ae import AutoEncoder
-
-# from .vae_bio import Mask_VAE, Image_VAE
-# from .utils import BaseVAE
-# from .legacy.vae import VAE
-# from .vq_vae import VQ_VAE
-
-from .bolts import ResNet18VAEEncoder, ResNet18VAEDecoder
-
-from . import bolts
-from . import pythae
-from .factory import ModelFactory, create_model, __all_models__
\ No newline at end of file
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=["bolts", "factory", "legacy", "pythae", "vit"],
+    submod_attrs={
+        "bolts": ["ResNet18VAEEncoder", "ResNet18VAEDecoder"],
+        "factory": [
+            "ModelFactory",
+            "create_model",
+            "__all_models__",
+            "__vit_models__",
+        ],
+    },
+)
@@ -0,0 +1,63 @@
+"""
+The pl_bolts ResNet encoders and decoders are built for RGB images, these
+swap their first and last convolutions for other channel counts.
+
+The weights of the RGB convolution are carried over: for a single channel
+input the filters are summed over RGB, so a grey image gives the same
+activations as its RGB repeat, and a single channel output is the average
+of the RGB outputs. The ModelFactory loads no pretrained weights for these
+models (its pretrained flag is unused), so in the factory the adapted
+weights are the random initial ones.
+"""
+
+import torch
+from torch import nn
+
+
+def _conv_like(conv, in_channels, out_channels):
+    return nn.Conv2d(
+        in_channels,
+        out_channels,
+        kernel_size=conv.kernel_size,
+        stride=conv.stride,
+        padding=conv.padding,
+        dilation=conv.dilation,
+        groups=conv.groups,
+        bias=conv.bias is not None,
+    )
+
+
+def adapt_input_conv(conv, in_channels):
+    """Conv2d like conv taking in_channels, weights adapted from RGB"""
+    if conv.in_channels == in_channels:
+        return conv
+    new = _conv_like(conv, in_channels, conv.out_channels)
+    with torch.no_grad():
+        weight = conv.weight
+        if in_channels == 1:
+            weight = weight.sum(1, keepdim=True)
+        else:
+            # Cycle the RGB filters, rescaled to keep the activation scale
+            repeats = -(-in_channels // conv.in_channels)
+            weight = weight.repeat(1, repeats, 1, 1)[:, :in_channels]
+            weight = weight * conv.in_channels / in_channels
+        new.weight.copy_(weight)
+        if conv.bias is not None:
+            new.bias.copy_(conv.bias)
+    return new
+
+
+def adapt_output_conv(conv, out_channels):
+    """
+    Conv2d like conv producing out_channels, a single channel averages the
+    RGB weights, other counts are freshly initialised
+    """
+    if conv.out_channels == out_channels:
+        return conv
+    new = _conv_like(conv, conv.in_channels, out_channels)
+    with torch.no_grad():
+        if out_channels == 1:
+            new.weight.copy_(conv.weight.mean(0, keepdim=True))
+            if conv.bias is not None:
+                new.bias.copy_(conv.bias.mean(0, keepdim=True))
+    return new
@@ -7,6 +7,8 @@ from pythae import models
 from pythae.models import VAEConfig
 from pl_bolts.models import autoencoders as ae
 
+from .utils import adapt_input_conv, adapt_output_conv
+
 
 def count_params(model):
     return sum(p.numel() for p in model.parameters() if p.requires_grad)
@@ -24,6 +26,9 @@ class ResNet50VAEEncoder(BaseEncoder):
         latent_dim = model_config.latent_dim
 
         self.encoder = ae.resnet50_encoder(first_conv, maxpool1)
+        self.encoder.conv1 = adapt_input_conv(
+            self.encoder.conv1, model_config.input_dim[0]
+        )
         self.embedding = nn.Linear(self.enc_out_dim, latent_dim)
         self.log_var = nn.Linear(self.enc_out_dim, latent_dim)
         # self.fc1 = nn.Linear(512, latent_dim)
@@ -48,6 +53,9 @@ class ResNet50VAEDecoder(BaseDecoder):
         self.decoder = ae.resnet50_decoder(
             self.enc_out_dim, input_height, first_conv, maxpool1
         )
+        self.decoder.conv1 = adapt_output_conv(
+            self.decoder.conv1, model_config.input_dim[0]
+        )
 
     def forward(self, x):
         x = self.embedding(x)
@@ -67,6 +75,9 @@ class ResNet18VAEEncoder(BaseEncoder):
         latent_dim = model_config.latent_dim
 
         self.encoder = ae.resnet18_encoder(first_conv, maxpool1)
+        self.encoder.conv1 = adapt_input_conv(
+            self.encoder.conv1, model_config.input_dim[0]
+        )
         self.embedding = nn.Linear(self.enc_out_dim, latent_dim)
         self.log_var = nn.Linear(self.enc_out_dim, latent_dim)
 
@@ -88,6 +99,9 @@ class ResNet18VAEDecoder(BaseDecoder):
         self.decoder = ae.resnet18_decoder(
             self.enc_out_dim, input_height, first_conv, maxpool1
         )
+        self.decoder.conv1 = adapt_output_conv(
+            self.decoder.conv1, model_config.input_dim[0]
+        )
         self.embedding = nn.Linear(latent_dim, self.enc_out_dim)
 
     def forward(self, x):
@@ -121,10 +135,21 @@ class VAEPythaeWrapper(models.VAE):
             kl_coeff=kl_coeff,
             latent_dim=model_config.latent_dim,
         )
+        in_channels = model_config.input_dim[0]
+        self.model.encoder.conv1 = adapt_input_conv(
+            self.model.encoder.conv1, in_channels
+        )
+        self.model.decoder.conv1 = adapt_output_conv(
+            self.model.decoder.conv1, in_channels
+        )
         self.encoder = self.model.encoder
         self.decoder = self.model.decoder
         self.input_dim = self.model_config.input_dim
 
+    def encode(self, x):
+        mu = self.model.fc_mu(self.model.encoder(x["data"]))
+        return ModelOutput(z=mu)
+
     def forward(self, x, epoch=None):
         # return ModelOutput(x=x,recon_x=x,z=x,loss=1)
         # # Forward pass logic
@@ -5,6 +5,8 @@ from pythae.models import VAEConfig
 
 from pl_bolts.models import autoencoders as ae
 
+from .utils import adapt_input_conv, adapt_output_conv
+
 
 class BaseResNetVQVAEEncoder(BaseEncoder):
     def __init__(
@@ -23,6 +25,9 @@ class BaseResNetVQVAEEncoder(BaseEncoder):
         self.enc_out_dim = enc_out_dim
 
         self.encoder = resnet_encoder(first_conv, maxpool1)
+        self.encoder.conv1 = adapt_input_conv(
+            self.encoder.conv1, self.input_dim[0]
+        )
         # self.embedding = nn.Linear(self.enc_out_dim, self.latent_dim)
         # self.log_var = nn.Linear(self.enc_out_dim, self.latent_dim)
         self.prequantized = nn.Conv2d(self.enc_out_dim, self.latent_dim, 1, 1)
@@ -94,6 +99,9 @@ class BaseResNetVQVAEDecoder(BaseDecoder):
         self.decoder = resnet_decoder(
             self.enc_out_dim, self.input_height, first_conv, maxpool1
         )
+        self.decoder.conv1 = adapt_output_conv(
+            self.decoder.conv1, model_config.input_dim[0]
+        )
         # Activation layer might be useful here
         # https://github.com/AntixK/PyTorch-VAE/blob/a6896b944c918dd7030e7d795a8c13e5c6345ec7/models/vq_vae.py#L166
 
@@ -14,10 +14,11 @@
 
 from typing import Tuple
 import pythae
-from .pythae import legacy
-from . import bolts
 from functools import partial
 
+# The model families (pl_bolts, timm, ...) are imported by the builders
+# that use them, so creating one model does not import them all
+
 
 class ModelFactory:
     def __init__(
@@ -61,6 +62,8 @@ class ModelFactory:
         maxpool1=False,
         kl_coeff=1.0,
     ):
+        from . import bolts
+
         return self.create_model(
             pythae.models.VAEConfig,
             partial(
@@ -93,6 +96,8 @@ class ModelFactory:
         return self.resnet_vae_bolt(enc_type="resnet50", enc_out_dim=2048, **kwargs)
 
     def resnet18_vae(self):
+        from . import bolts
+
         return self.create_model(
             partial(
                 pythae.models.VAEConfig,
@@ -106,6 +111,8 @@ class ModelFactory:
         )
 
     def resnet50_vae(self):
+        from . import bolts
+
         return self.create_model(
             partial(
                 pythae.models.VAEConfig,
@@ -119,6 +126,8 @@ class ModelFactory:
         )
 
     def resnet18_vqvae(self):
+        from . import bolts
+
         return self.create_model(
             partial(
                 pythae.models.VQVAEConfig,
@@ -132,6 +141,8 @@ class ModelFactory:
         )
 
     def resnet50_vqvae(self):
+        from . import bolts
+
         return self.create_model(
             partial(
                 pythae.models.VQVAEConfig,
@@ -145,9 +156,15 @@ class ModelFactory:
         )
 
     def resnet_vae_legacy(self, depth):
+        from .pythae import legacy
+
         return self.create_model(
             pythae.models.VAEConfig,
-            partial(legacy.VAE, num_residual_hiddens=depth),
+            partial(
+                legacy.VAE,
+                num_residual_hiddens=depth,
+                checkpoint_segments=self.kwargs.get("checkpoint_segments", 0),
+            ),
             encoder_class=lambda x: None,
             decoder_class=lambda x: None,
         )
@@ -159,10 +176,16 @@ class ModelFactory:
         return self.resnet_vae_legacy(50)
 
     def resnet_vqvae_legacy(self, depth):
+        from .pythae import legacy
+
         return self.create_model(
             pythae.models.VQVAEConfig,
             # partial(legacy.vq_vae.VQVAE,**self.kwargs,num_hidden_residuals=depth),
-            partial(legacy.vq_vae.VQVAE, depth=depth),
+            partial(
+                legacy.vq_vae.VQVAE,
+                depth=depth,
+                checkpoint_segments=self.kwargs.get("checkpoint_segments", 0),
+            ),
             encoder_class=lambda x: None,
             decoder_class=lambda x: None,
         )
@@ -182,6 +205,53 @@ class ModelFactory:
     def resnet152_vqvae_legacy(self):
         return self.resnet_vqvae_legacy(152)
 
+    def mae_vit(self, arch):
+        from .vit import mae_pythae
+
+        return self.create_model(
+            pythae.models.BaseAEConfig,
+            partial(
+                mae_pythae.MAE,
+                arch=arch,
+                mask_ratio=self.kwargs.get("mask_ratio", 0.75),
+                norm_pix_loss=self.kwargs.get("norm_pix_loss", False),
+            ),
+            encoder_class=lambda x: None,
+            decoder_class=lambda x: None,
+        )
+
+    def mae_vit_base_patch16(self):
+        return self.mae_vit("mae_vit_base_patch16")
+
+    def mae_vit_large_patch16(self):
+        return self.mae_vit("mae_vit_large_patch16")
+
+    def mae_vit_huge_patch14(self):
+        return self.mae_vit("mae_vit_huge_patch14")
+
+    def sam_vae(self, arch):
+        from .vit import sam_pythae
+
+        return self.create_model(
+            partial(
+                pythae.models.VAEConfig,
+                use_default_encoder=False,
+                use_default_decoder=False,
+            ),
+            pythae.models.VAE,
+            partial(sam_pythae.SAMEncoder, arch=arch),
+            sam_pythae.SAMDecoder,
+        )
+
+    def sam_vit_b(self):
+        return self.sam_vae("sam_vit_b")
+
+    def sam_vit_l(self):
+        return self.sam_vae("sam_vit_l")
+
+    def sam_vit_h(self):
+        return self.sam_vae("sam_vit_h")
+
     def __call__(self, model):
         return getattr(self, model)()
 
@@ -210,6 +280,16 @@ __all_models__ = [
     "dummy_model",
 ]
 
+# Kept out of __all_models__ as the larger ones are slow to even build on CPU
+__vit_models__ = [
+    "mae_vit_base_patch16",
+    "mae_vit_large_patch16",
+    "mae_vit_huge_patch14",
+    "sam_vit_b",
+    "sam_vit_l",
+    "sam_vit_h",
+]
+
 __all_small_models__ = [
     "resnet18_vae",
     "resnet18_vqvae",
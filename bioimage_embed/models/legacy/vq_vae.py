@@ -4,6 +4,7 @@ from torch import nn
 import torch.nn.functional as F
 
 from ..nets.resnet import ResnetDecoder, ResnetEncoder
+from ...distributed import all_reduce_sum
 
 # https://colab.research.google.com/github/zalandoresearch/pytorch-vq-vae/blob/master/vq-vae.ipynb#scrollTo=fknqLRCvdJ4I
 
@@ -84,9 +85,12 @@ class VectorQuantizerEMA(nn.Module):
         self._embedding.weight.data.normal_()
         self._commitment_cost = commitment_cost
 
+        # EMA state is updated in place, never trained by the optimizer
         self.register_buffer("_ema_cluster_size", torch.zeros(num_embeddings))
-        self._ema_w = nn.Parameter(torch.Tensor(num_embeddings, self._embedding_dim))
-        self._ema_w.data.normal_()
+        self.register_buffer(
+            "_ema_w", torch.randn(num_embeddings, self._embedding_dim)
+        )
+        self._embedding.weight.requires_grad_(False)
 
         self._decay = decay
         self._epsilon = epsilon
@@ -118,28 +122,10 @@ class VectorQuantizerEMA(nn.Module):
         # Quantize and unflatten
         quantized = torch.matmul(encodings, self._embedding.weight).view(input_shape)
 
-        # Use EMA to update the embedding vectors
+        # Use EMA to update the embedding vectors, in place so no parameters
+        # are re-created every step (which also breaks torch.compile graphs)
         if self.training:
-            self._ema_cluster_size = self._ema_cluster_size * self._decay + (
-                1 - self._decay
-            ) * torch.sum(encodings, 0)
-
-            # Laplace smoothing of the cluster size
-            n = torch.sum(self._ema_cluster_size.data)
-            self._ema_cluster_size = (
-                (self._ema_cluster_size + self._epsilon)
-                / (n + self._num_embeddings * self._epsilon)
-                * n
-            )
-
-            dw = torch.matmul(encodings.t(), flat_input)
-            self._ema_w = nn.Parameter(
-                self._ema_w * self._decay + (1 - self._decay) * dw
-            )
-
-            self._embedding.weight = nn.Parameter(
-                self._ema_w / self._ema_cluster_size.unsqueeze(1)
-            )
+            self.update_ema(encodings, flat_input)
 
         # Loss
         e_latent_loss = F.mse_loss(quantized.detach(), inputs)
@@ -158,6 +144,29 @@ class VectorQuantizerEMA(nn.Module):
             encodings,
         )
 
+    @torch.no_grad()
+    def update_ema(self, encodings, flat_input):
+        # Statistics of the global batch when data parallel, so that every
+        # process keeps the same codebook
+        counts = encodings.sum(0)
+        dw = encodings.t() @ flat_input
+        all_reduce_sum(counts, dw)
+
+        self._ema_cluster_size.mul_(self._decay).add_(
+            counts, alpha=1 - self._decay
+        )
+
+        # Laplace smoothing of the cluster size
+        n = self._ema_cluster_size.sum()
+        self._ema_cluster_size.add_(self._epsilon).div_(
+            n + self._num_embeddings * self._epsilon
+        ).mul_(n)
+
+        self._ema_w.mul_(self._decay).add_(dw, alpha=1 - self._decay)
+        self._embedding.weight.copy_(
+            self._ema_w / self._ema_cluster_size.unsqueeze(1)
+        )
+
 
 class VQ_VAE(nn.Module):
     def __init__(
@@ -170,6 +179,7 @@ class VQ_VAE(nn.Module):
         commitment_cost=0.25,
         decay=0.99,
         channels=1,
+        checkpoint_segments=0,
         **kwargs,
     ):
         super(VQ_VAE, self).__init__()
@@ -179,6 +189,7 @@ class VQ_VAE(nn.Module):
             num_residual_layers,
             num_residual_hiddens,
             in_channels=channels,
+            checkpoint_segments=checkpoint_segments,
         )
         self._pre_vq_conv = nn.Conv2d(
             in_channels=num_hiddens,
@@ -200,6 +211,7 @@ class VQ_VAE(nn.Module):
             num_residual_layers,
             num_residual_hiddens,
             out_channels=channels,
+            checkpoint_segments=checkpoint_segments,
         )
 
     def forward(self, x):
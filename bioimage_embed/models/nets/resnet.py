@@ -1,5 +1,7 @@
+import torch
 from torch import nn
 from torch.nn import functional as F
+from torch.utils.checkpoint import checkpoint, checkpoint_sequential
 import types
 
 
@@ -7,7 +9,7 @@ class Residual(nn.Module):
     def __init__(self, in_channels, num_hiddens, num_residual_hiddens):
         super(Residual, self).__init__()
         self._block = nn.Sequential(
-            nn.ReLU(True),
+            nn.ReLU(),
             nn.Conv2d(
                 in_channels=in_channels,
                 out_channels=num_residual_hiddens,
@@ -16,7 +18,7 @@ class Residual(nn.Module):
                 padding=1,
                 bias=False,
             ),
-            nn.ReLU(True),
+            nn.ReLU(),
             nn.Conv2d(
                 in_channels=num_residual_hiddens,
                 out_channels=num_hiddens,
@@ -27,6 +29,10 @@ class Residual(nn.Module):
         )
 
     def forward(self, x):
+        # The block used to start with an in place ReLU, which rectified the
+        # skip connection too. Done out of place so checkpoint_sequential can
+        # recompute from the saved segment inputs, with the same outputs.
+        x = F.relu(x)
         return x + self._block(x)
 
 
@@ -37,6 +43,7 @@ class ResidualStack(nn.Module):
         num_hiddens,
         num_residual_layers,
         num_residual_hiddens,
+        checkpoint_segments=0,
     ):
         super(ResidualStack, self).__init__()
         self._num_residual_layers = num_residual_layers
@@ -46,10 +53,33 @@ class ResidualStack(nn.Module):
                 for _ in range(self._num_residual_layers)
             ]
         )
+        self.checkpoint_segments = checkpoint_segments
+
+    @property
+    def grad_checkpointing(self):
+        return self.checkpoint_segments > 0 and torch.is_grad_enabled()
+
+    def set_grad_checkpointing(self, enable=True, segments=None):
+        """
+        Recompute the residual blocks' activations in the backward pass.
+        Only the inputs of each of the segments (one per block by default)
+        are kept, fewer segments use less memory for longer recomputation.
+        """
+        if not enable:
+            segments = 0
+        elif segments is None:
+            segments = self.checkpoint_segments or self._num_residual_layers
+        self.checkpoint_segments = segments
 
     def forward(self, x):
-        for i in range(self._num_residual_layers):
-            x = self._layers[i](x)
+        if self.grad_checkpointing and self._num_residual_layers:
+            segments = min(self.checkpoint_segments, self._num_residual_layers)
+            x = checkpoint_sequential(
+                self._layers, segments, x, use_reentrant=False
+            )
+        else:
+            for i in range(self._num_residual_layers):
+                x = self._layers[i](x)
         return F.relu(x)
 
 
@@ -60,6 +90,7 @@ class ResnetEncoder(nn.Module):
         num_residual_layers,
         num_residual_hiddens,
         in_channels,
+        checkpoint_segments=0,
         **kwargs,
     ):
         super(ResnetEncoder, self).__init__()
@@ -90,16 +121,28 @@ class ResnetEncoder(nn.Module):
             num_hiddens=num_hiddens,
             num_residual_layers=num_residual_layers,
             num_residual_hiddens=num_residual_hiddens,
+            checkpoint_segments=checkpoint_segments,
         )
 
-    def forward(self, inputs):
+    def set_grad_checkpointing(self, enable=True, segments=None):
+        """The stem is one more segment in front of the residual stack"""
+        self._residual_stack.set_grad_checkpointing(enable, segments)
+
+    def stem(self, inputs):
         x = self._conv_1(inputs)
         x = F.relu(x)
 
         x = self._conv_2(x)
         x = F.relu(x)
 
-        x = self._conv_3(x)
+        return self._conv_3(x)
+
+    def forward(self, inputs):
+        # The stem's activations are the largest, at 1/2 and 1/4 resolution
+        if self._residual_stack.grad_checkpointing:
+            x = checkpoint(self.stem, inputs, use_reentrant=False)
+        else:
+            x = self.stem(inputs)
         return self._residual_stack(x)
 
 
@@ -111,6 +154,7 @@ class ResnetDecoder(nn.Module):
         num_residual_layers,
         num_residual_hiddens,
         out_channels,
+        checkpoint_segments=0,
     ):
         super(ResnetDecoder, self).__init__()
 
@@ -127,6 +171,7 @@ class ResnetDecoder(nn.Module):
             num_hiddens=num_hiddens,
             num_residual_layers=num_residual_layers,
             num_residual_hiddens=num_residual_hiddens,
+            checkpoint_segments=checkpoint_segments,
         )
 
         self._conv_trans_1 = nn.ConvTranspose2d(
@@ -145,16 +190,26 @@ class ResnetDecoder(nn.Module):
             padding=1,
         )
 
-    def forward(self, inputs):
-        x = self._conv_1(inputs)
-
-        x = self._residual_stack(x)
+    def set_grad_checkpointing(self, enable=True, segments=None):
+        """The upsampling head is one more segment after the residual stack"""
+        self._residual_stack.set_grad_checkpointing(enable, segments)
 
+    def head(self, x):
         x = self._conv_trans_1(x)
         x = F.relu(x)
 
         return self._conv_trans_2(x)
 
+    def forward(self, inputs):
+        x = self._conv_1(inputs)
+
+        x = self._residual_stack(x)
+
+        # Keeps the 1/4 resolution input instead of the 1/2 resolution hidden
+        if self._residual_stack.grad_checkpointing:
+            return checkpoint(self.head, x, use_reentrant=False)
+        return self.head(x)
+
 
 def resnet18_encoder():
     return ResnetEncoder(**resnet18_encoder_params)
@@ -26,6 +26,7 @@ class Encoder(BaseEncoder):
         num_hiddens,
         num_residual_hiddens,
         num_residual_layers,
+        checkpoint_segments=0,
     ):
         super(Encoder, self).__init__()
         embedding_dim = model_config.latent_dim
@@ -36,6 +37,7 @@ class Encoder(BaseEncoder):
             num_hiddens=num_hiddens,
             num_residual_hiddens=num_residual_hiddens,
             num_residual_layers=num_residual_layers,
+            checkpoint_segments=checkpoint_segments,
         )
 
 
@@ -56,6 +58,7 @@ class VAEDecoder(BaseDecoder):
         num_hiddens,
         num_residual_hiddens,
         num_residual_layers,
+        checkpoint_segments=0,
     ):
         super(VAEDecoder, self).__init__()
         self.model = ResnetDecoder(
@@ -64,6 +67,7 @@ class VAEDecoder(BaseDecoder):
             num_hiddens=num_hiddens,
             num_residual_layers=num_residual_layers,
             num_residual_hiddens=num_residual_hiddens,
+            checkpoint_segments=checkpoint_segments,
         )
 
     def forward(self, x):
@@ -83,6 +87,7 @@ class VQVAE(models.VQVAE):
         encoder=None,
         decoder=None,
         strict_latent_size=True,
+        checkpoint_segments=0,
     ):
         super(models.BaseAE, self).__init__()
         # super(nn.Module)
@@ -100,6 +105,7 @@ class VQVAE(models.VQVAE):
             embedding_dim=model_config.latent_dim,
             num_hiddens=model_config.latent_dim,
             num_residual_layers=depth,
+            checkpoint_segments=checkpoint_segments,
         )
         self.encoder = self.model._encoder
         self.decoder = self.model._decoder
@@ -107,6 +113,14 @@ class VQVAE(models.VQVAE):
         # This isn't completely necessary for training I don't think
         # self._set_quantizer(model_config)
 
+    def encode(self, x):
+        z = self.model.encoder(x["data"])
+        z = self.model._pre_vq_conv(z)
+        if self.strict_latent_size:
+            z = self.avgpool(z).permute(0, 2, 3, 1)
+        _, quantized, _, _ = self.model._vq_vae(z)
+        return ModelOutput(z=quantized.flatten(1))
+
     def forward(self, x, epoch=None):
         # loss, x_recon, perplexity = self.model.forward(x["data"])
         z = self.model.encoder(x["data"])
@@ -138,7 +152,10 @@ class VQVAE(models.VQVAE):
         )
         # This matches how pythae returns the loss
 
-        indices = (encodings == 1).nonzero(as_tuple=True)
+        # Same (row, code) pairs as (encodings == 1).nonzero() as every row
+        # is one-hot, without its host sync and data dependent shape
+        codes = encodings.argmax(1)
+        indices = (torch.arange(len(codes), device=codes.device), codes)
 
         recon_loss = F.mse_loss(x_recon, x["data"], reduction="sum")
         mse_loss = F.mse_loss(x_recon, x["data"], reduction="mean")
@@ -167,6 +184,7 @@ class VAE(models.VAE):
         num_residual_layers=2,
         encoder=None,
         decoder=None,
+        checkpoint_segments=0,
     ):
         super(models.BaseAE, self).__init__()
         # super(nn.Module)
@@ -179,12 +197,14 @@ class VAE(models.VAE):
             num_hiddens=num_hiddens,
             num_residual_hiddens=num_residual_hiddens,
             num_residual_layers=num_residual_layers,
+            checkpoint_segments=checkpoint_segments,
         )
         self.decoder = VAEDecoder(
             model_config,
             num_hiddens=num_hiddens,
             num_residual_hiddens=num_residual_hiddens,
             num_residual_layers=num_residual_layers,
+            checkpoint_segments=checkpoint_segments,
         )
         self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
         self.fc = nn.Linear(num_hiddens, model_config.latent_dim * 2)
@@ -195,20 +215,26 @@ class VAE(models.VAE):
         eps = torch.randn_like(std)
         return mu + eps * std
 
+    def encode(self, x):
+        h = self.encoder(x)["embedding"]
+        h = torch.flatten(self.avgpool(h), 1)
+        mu, log_var = torch.split(self.fc(h), self.model_config.latent_dim, dim=1)
+        return ModelOutput(z=mu)
+
     def forward(self, x, epoch=None):
         h = self.encoder(x)["embedding"]
         # pre_encode_size = torch.tensor(x["data"].shape[-2:])
         # scale = torch.floor_divide(torch.tensor(x["data"].shape[-2:]),torch.tensor(h.shape[-2:]))
-        pre_encode_size = torch.tensor(h.shape[-2:])
+        # Sizes as python ints, tensors of them cost a sync and a graph break
+        pre_encode_size = h.shape[-2:]
         h = self.avgpool(h)
-        post_encode_size = torch.tensor(h.shape[-2:])
-        scale = torch.div(pre_encode_size, post_encode_size, rounding_mode="trunc")
+        scale = [a // b for a, b in zip(pre_encode_size, h.shape[-2:])]
         h = torch.flatten(h, 1)
         h = self.fc(h)
         mu, log_var = torch.split(h, h.size(1) // 2, dim=1)
         z = self.reparameterize(mu, log_var)
         # x_recon = self.decoder(z.view(z.size(0), z.size(1), 1, 1))
-        embedding = z.unsqueeze(-1).unsqueeze(-1).repeat(1, 1, *scale.tolist())
+        embedding = z.unsqueeze(-1).unsqueeze(-1).repeat(1, 1, *scale)
         x_recon = self.decoder({"embedding": embedding})["reconstruction"]
         # return x_recon, mu, log_var
 
@@ -0,0 +1,64 @@
+import pytest
+import torch
+
+from bioimage_embed.models import create_model
+from bioimage_embed.models.nets.resnet import (
+    ResidualStack,
+    ResnetDecoder,
+    ResnetEncoder,
+)
+
+
+def autoencoder(checkpoint_segments=0):
+    torch.manual_seed(0)
+    params = dict(num_hiddens=16, num_residual_layers=4, num_residual_hiddens=8)
+    encoder = ResnetEncoder(
+        in_channels=1, checkpoint_segments=checkpoint_segments, **params
+    )
+    decoder = ResnetDecoder(
+        in_channels=16,
+        out_channels=1,
+        checkpoint_segments=checkpoint_segments,
+        **params,
+    )
+    return torch.nn.Sequential(encoder, decoder)
+
+
+@pytest.mark.parametrize("segments", [1, 2, 4, 8])
+def test_segments_match_reference(segments):
+    x = torch.rand(2, 1, 32, 32)
+    reference, checkpointed = autoencoder(), autoencoder(segments)
+    outputs = []
+    for model in (reference, checkpointed):
+        out = model(x)
+        out.square().sum().backward()
+        outputs.append(out)
+    assert torch.allclose(*outputs, atol=1e-6)
+    for p, q in zip(reference.parameters(), checkpointed.parameters()):
+        assert torch.allclose(p.grad, q.grad, atol=1e-5)
+
+
+def test_no_checkpointing_without_grad():
+    model = autoencoder(2)
+    with torch.no_grad():
+        assert not model[0]._residual_stack.grad_checkpointing
+        model(torch.rand(1, 1, 32, 32))
+
+
+def test_set_grad_checkpointing():
+    stack = ResidualStack(8, 8, num_residual_layers=3, num_residual_hiddens=4)
+    stack.set_grad_checkpointing()
+    assert stack.checkpoint_segments == 3
+    stack.set_grad_checkpointing(segments=1)
+    assert stack.checkpoint_segments == 1
+    stack.set_grad_checkpointing(False)
+    assert not stack.grad_checkpointing
+
+
+def test_factory_checkpoint_segments():
+    model = create_model(
+        "resnet18_vqvae_legacy", (1, 64, 64), 16, checkpoint_segments=3
+    )
+    stacks = [m for m in model.modules() if isinstance(m, ResidualStack)]
+    assert stacks
+    assert all(stack.checkpoint_segments == 3 for stack in stacks)
@@ -9,6 +9,7 @@ torch.manual_seed(42)
 
 image_dim = [(256, 256), (224, 224)]
 channel_dim = [
+    1,
     3,
 ]
 latent_dim = [64, 16]
@@ -34,3 +35,43 @@ def test_create_model(model, c, idim, ld, pretrained, progress, batch):
     # assert output.z.shape == (batch, ld)
     if len(output.z.flatten()) != ld:
         pytest.skip("Not an exact latent dimension match")
+
+
+@pytest.mark.parametrize("model", ["mae_vit_base_patch16", "sam_vit_b"])
+@pytest.mark.parametrize("c", [1, 3])
+def test_create_vit_model(model, c, idim=(64, 64), ld=16, batch=2):
+    input_dim = (c, *idim)
+    generated_model = create_model(model, input_dim, ld)
+    data = torch.rand(batch, *input_dim)
+    output = generated_model({"data": data})
+    assert output.z.shape == (batch, ld)
+    assert output.recon_x.shape == data.shape
+    assert torch.isfinite(output.loss)
+
+
+@pytest.mark.parametrize("mask_ratio", [0.75, 0.5])
+def test_mae_masked_tokens(mask_ratio, input_dim=(3, 64, 64), ld=16):
+    model = create_model(
+        "mae_vit_base_patch16", input_dim, ld, mask_ratio=mask_ratio
+    )
+    data = torch.rand(1, *input_dim)
+    num_patches = model.model.patch_embed.num_patches
+    # The encoder only sees the kept tokens, plus the cls token
+    model.train()
+    encoded = model.encoder(data, mask_ratio=model.mask_ratio)
+    assert encoded.tokens.shape[1] == 1 + int(num_patches * (1 - mask_ratio))
+    model.eval()
+    encoded = model.encoder(data)
+    assert encoded.tokens.shape[1] == 1 + num_patches
+
+
+@pytest.mark.parametrize("model", ["resnet18_vae", "resnet18_vqvae"])
+def test_single_channel_matches_rgb(model, idim=(64, 64), ld=16):
+    # Summed RGB filters see a grey image like its 3 channel repeat
+    from bioimage_embed.models.bolts.utils import adapt_input_conv
+
+    rgb = create_model(model, (3, *idim), ld).encoder.encoder.conv1
+    grey = adapt_input_conv(rgb, 1)
+    assert grey.in_channels == 1
+    x = torch.rand(2, 1, *idim)
+    assert torch.allclose(grey(x), rgb(x.expand(-1, 3, -1, -1)), atol=1e-5)
@@ -16,7 +16,7 @@ import torch.nn as nn
 
 from timm.models.vision_transformer import PatchEmbed, Block
 
-from _mae.util.pos_embed import get_2d_sincos_pos_embed
+from .pos_embed import get_2d_sincos_pos_embed
 
 
 class MaskedAutoencoderViT(nn.Module):
@@ -56,7 +56,6 @@ class MaskedAutoencoderViT(nn.Module):
                     num_heads,
                     mlp_ratio,
                     qkv_bias=True,
-                    qk_scale=None,
                     norm_layer=norm_layer,
                 )
                 for i in range(depth)
@@ -83,7 +82,6 @@ class MaskedAutoencoderViT(nn.Module):
                     decoder_num_heads,
                     mlp_ratio,
                     qkv_bias=True,
-                    qk_scale=None,
                     norm_layer=norm_layer,
                 )
                 for i in range(decoder_depth)
@@ -105,14 +103,14 @@ class MaskedAutoencoderViT(nn.Module):
         # initialize (and freeze) pos_embed by sin-cos embedding
         pos_embed = get_2d_sincos_pos_embed(
             self.pos_embed.shape[-1],
-            int(self.patch_embed.num_patches**0.5),
+            tuple(self.patch_embed.grid_size),
             cls_token=True,
         )
         self.pos_embed.data.copy_(torch.from_numpy(pos_embed).float().unsqueeze(0))
 
         decoder_pos_embed = get_2d_sincos_pos_embed(
             self.decoder_pos_embed.shape[-1],
-            int(self.patch_embed.num_patches**0.5),
+            tuple(self.patch_embed.grid_size),
             cls_token=True,
         )
         self.decoder_pos_embed.data.copy_(
@@ -142,30 +140,32 @@ class MaskedAutoencoderViT(nn.Module):
 
     def patchify(self, imgs):
         """
-        imgs: (N, 3, H, W)
-        x: (N, L, patch_size**2 *3)
+        imgs: (N, C, H, W)
+        x: (N, L, patch_size**2 *C)
         """
         p = self.patch_embed.patch_size[0]
-        assert imgs.shape[2] == imgs.shape[3] and imgs.shape[2] % p == 0
+        c = imgs.shape[1]
+        assert imgs.shape[2] % p == 0 and imgs.shape[3] % p == 0
 
-        h = w = imgs.shape[2] // p
-        x = imgs.reshape(shape=(imgs.shape[0], 3, h, p, w, p))
+        h, w = imgs.shape[2] // p, imgs.shape[3] // p
+        x = imgs.reshape(shape=(imgs.shape[0], c, h, p, w, p))
         x = torch.einsum("nchpwq->nhwpqc", x)
-        x = x.reshape(shape=(imgs.shape[0], h * w, p**2 * 3))
+        x = x.reshape(shape=(imgs.shape[0], h * w, p**2 * c))
         return x
 
     def unpatchify(self, x):
         """
-        x: (N, L, patch_size**2 *3)
-        imgs: (N, 3, H, W)
+        x: (N, L, patch_size**2 *C)
+        imgs: (N, C, H, W)
         """
         p = self.patch_embed.patch_size[0]
-        h = w = int(x.shape[1] ** 0.5)
+        h, w = self.patch_embed.grid_size
         assert h * w == x.shape[1]
+        c = x.shape[-1] // p**2
 
-        x = x.reshape(shape=(x.shape[0], h, w, p, p, 3))
+        x = x.reshape(shape=(x.shape[0], h, w, p, p, c))
         x = torch.einsum("nhwpqc->nchpwq", x)
-        imgs = x.reshape(shape=(x.shape[0], 3, h * p, h * p))
+        imgs = x.reshape(shape=(x.shape[0], c, h * p, w * p))
         return imgs
 
     def random_masking(self, x, mask_ratio):
@@ -1,32 +1,100 @@
-from .._mae.models_mae import MAEMaskedAutoencoderViT
+"""
+Masked autoencoder (MAE) as a pythae style model for the ModelFactory.
 
+While training the encoder only sees the tokens kept by the random masking,
+(1 - mask_ratio) of them, and the loss is taken on the masked patches only.
+In eval mode nothing is masked so z is computed from the whole image.
+
+Between the encoder and the decoder the tokens are projected down to
+latent_dim, z is the projected cls token.
+"""
+
+import torch
+from torch import nn
 from transformers.utils import ModelOutput
+from pythae import models
 from pythae.models.nn import BaseDecoder, BaseEncoder
 
-# class Encoder(BaseEncoder,MAEMaskedAutoencoderViT):
+from .mae import mae
+
+
+class Encoder(BaseEncoder):
+    def __init__(self, mae_model, latent_dim):
+        super().__init__()
+        self.mae = mae_model
+        self.embedding = nn.Linear(mae_model.pos_embed.shape[-1], latent_dim)
+
+    def forward(self, x, mask_ratio=0.0):
+        tokens, mask, ids_restore = self.mae.forward_encoder(x, mask_ratio)
+        tokens = self.embedding(tokens)
+        return ModelOutput(
+            embedding=tokens[:, 0],
+            tokens=tokens,
+            mask=mask,
+            ids_restore=ids_restore,
+        )
 
 
-class Encoder(BaseEncoder, MAEMaskedAutoencoderViT):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        super(BaseEncoder, self).__init__(*args, **kwargs)
+class Decoder(BaseDecoder):
+    def __init__(self, mae_model):
+        super().__init__()
+        self.mae = mae_model
 
-    def forward(self, x, mask_ratio=0.75):
-        x, mask, ids_restore = self.forward_encoder(x)
-        return ModelOutput(embedding=x, mask=mask, ids_restore=ids_restore)
+    def forward(self, x):
+        pred = self.mae.forward_decoder(x.tokens, x.ids_restore)
+        return ModelOutput(reconstruction=self.mae.unpatchify(pred), pred=pred)
 
 
-class Decoder(BaseDecoder, MAEMaskedAutoencoderViT):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        super(BaseDecoder, self).__init__(*args, **kwargs)
+class MAE(models.BaseAE):
+    def __init__(
+        self,
+        model_config,
+        arch="mae_vit_base_patch16",
+        mask_ratio=0.75,
+        norm_pix_loss=False,
+        encoder=None,
+        decoder=None,
+    ):
+        super(models.BaseAE, self).__init__()
+        self.model_name = "MAE"
+        self.model_config = model_config
+        self.input_dim = self.model_config.input_dim
+        self.mask_ratio = mask_ratio
+        in_chans, height, width = self.input_dim
+        self.model = getattr(mae, arch)(
+            img_size=(height, width),
+            in_chans=in_chans,
+            norm_pix_loss=norm_pix_loss,
+        )
+        # The decoder takes the latent_dim tokens instead of embed_dim
+        decoder_embed = nn.Linear(
+            model_config.latent_dim, self.model.decoder_embed.out_features
+        )
+        self.model._init_weights(decoder_embed)
+        self.model.decoder_embed = decoder_embed
 
-    def forward(self, x, mask_ratio=0.75):
-        x = self.forward_decoder(x=x.embedding, ids_restore=x.ids_restore)
-        return ModelOutput(reconstruction=x)
+        self.encoder = Encoder(self.model, model_config.latent_dim)
+        self.decoder = Decoder(self.model)
 
+    def encode(self, x):
+        return ModelOutput(z=self.encoder(x["data"]).embedding)
 
-# # set recommended archs
-# mae_vit_base_patch16 = mae_vit_base_patch16_dec512d8b  # decoder: 512 dim, 8 blocks
-# mae_vit_large_patch16 = mae_vit_large_patch16_dec512d8b  # decoder: 512 dim, 8 blocks
-# mae_vit_huge_patch14 = mae_vit_huge_patch14_dec512d8b  # decoder: 512 dim, 8 blocks
+    def forward(self, x, epoch=None):
+        x = x["data"]
+        mask_ratio = self.mask_ratio if self.training else 0.0
+        encoded = self.encoder(x, mask_ratio=mask_ratio)
+        decoded = self.decoder(encoded)
+        if mask_ratio > 0:
+            loss = self.model.forward_loss(x, decoded.pred, encoded.mask)
+        else:
+            # Nothing is masked, score every patch
+            loss = self.model.forward_loss(
+                x, decoded.pred, torch.ones_like(encoded.mask)
+            )
+        return ModelOutput(
+            recon_x=decoded.reconstruction,
+            z=encoded.embedding,
+            mask=encoded.mask,
+            loss=loss,
+            recon_loss=loss,
+        )
@@ -4,10 +4,13 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import math
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from functools import partial
 from typing import Optional, Tuple, Type
 
 from .common import LayerNorm2d, MLPBlock
@@ -33,6 +36,7 @@ class ImageEncoderViT(nn.Module):
         rel_pos_zero_init: bool = True,
         window_size: int = 0,
         global_attn_indexes: Tuple[int, ...] = (),
+        variable_resolution: bool = False,
     ) -> None:
         """
         Args:
@@ -51,9 +55,12 @@ class ImageEncoderViT(nn.Module):
             rel_pos_zero_init (bool): If True, zero initialize relative positional parameters.
             window_size (int): Window size for window attention blocks.
             global_attn_indexes (list): Indexes for blocks using global attention.
+            variable_resolution (bool): If True, accept inputs of any size, see set_variable_resolution.
         """
         super().__init__()
         self.img_size = img_size
+        self.variable_resolution = variable_resolution
+        self._pos_cache = {}
 
         self.patch_embed = PatchEmbed(
             kernel_size=(patch_size, patch_size),
@@ -105,10 +112,37 @@ class ImageEncoderViT(nn.Module):
             LayerNorm2d(out_chans),
         )
 
+    def set_variable_resolution(self, enabled: bool = True) -> "ImageEncoderViT":
+        """
+        Inference mode for images of other sizes than img_size. The absolute
+        and relative position embeddings are interpolated to the patch grid
+        of the input and, while gradients are off, cached per resolution.
+        Batches must still hold images of a single size, see
+        lightning.dataloader.SizeBucketBatchSampler.
+        """
+        self.variable_resolution = enabled
+        return self
+
+    def abs_pos(self, hw: Tuple[int, int]) -> torch.Tensor:
+        if tuple(self.pos_embed.shape[1:3]) == tuple(hw):
+            return self.pos_embed
+        if not self.variable_resolution:
+            raise ValueError(
+                f"Input patch grid {tuple(hw)} does not match "
+                f"{tuple(self.pos_embed.shape[1:3])}, "
+                "enable set_variable_resolution for other image sizes"
+            )
+        return cached(
+            self._pos_cache,
+            tuple(hw),
+            self.pos_embed,
+            lambda: get_abs_pos(self.pos_embed, hw),
+        )
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         x = self.patch_embed(x)
         if self.pos_embed is not None:
-            x = x + self.pos_embed
+            x = x + self.abs_pos(x.shape[1:3])
 
         for blk in self.blocks:
             x = blk(x)
@@ -224,30 +258,48 @@ class Attention(nn.Module):
             # initialize relative positional embeddings
             self.rel_pos_h = nn.Parameter(torch.zeros(2 * input_size[0] - 1, head_dim))
             self.rel_pos_w = nn.Parameter(torch.zeros(2 * input_size[1] - 1, head_dim))
+        self._rel_pos_cache = {}
+
+    def get_rel_pos(
+        self, q_size: Tuple[int, int], k_size: Tuple[int, int]
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Relative positional embeddings (Rh, Rw) for the given sizes, cached at inference"""
+        return (
+            cached(
+                self._rel_pos_cache,
+                ("h", q_size[0], k_size[0]),
+                self.rel_pos_h,
+                lambda: get_rel_pos(q_size[0], k_size[0], self.rel_pos_h),
+            ),
+            cached(
+                self._rel_pos_cache,
+                ("w", q_size[1], k_size[1]),
+                self.rel_pos_w,
+                lambda: get_rel_pos(q_size[1], k_size[1], self.rel_pos_w),
+            ),
+        )
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        B, H, W, _ = x.shape
-        # qkv with shape (3, B, nHead, H * W, C)
-        qkv = (
-            self.qkv(x).reshape(B, H * W, 3, self.num_heads, -1).permute(2, 0, 3, 1, 4)
+        # x is [B, H, W, C] or windows [B, nH, nW, window, window, C]
+        *batch, H, W, C = x.shape
+        B = math.prod(batch)
+        # q, k, v with shape (B, nHead, H * W, C)
+        q, k, v = (
+            self.qkv(x)
+            .reshape(B, H * W, 3, self.num_heads, -1)
+            .permute(2, 0, 3, 1, 4)
+            .unbind(0)
         )
-        # q, k, v with shape (B * nHead, H * W, C)
-        q, k, v = qkv.reshape(3, B * self.num_heads, H * W, -1).unbind(0)
-
-        attn = (q * self.scale) @ k.transpose(-2, -1)
 
+        # The relative positions enter as an additive bias to q @ k^T * scale
+        attn_mask = None
         if self.use_rel_pos:
-            attn = add_decomposed_rel_pos(
-                attn, q, self.rel_pos_h, self.rel_pos_w, (H, W), (H, W)
-            )
+            Rh, Rw = self.get_rel_pos((H, W), (H, W))
+            attn_mask = decomposed_rel_pos_bias(q, Rh, Rw, (H, W), (H, W))
+            attn_mask = attn_mask.to(q.dtype)
 
-        attn = attn.softmax(dim=-1)
-        x = (
-            (attn @ v)
-            .view(B, self.num_heads, H, W, -1)
-            .permute(0, 2, 3, 1, 4)
-            .reshape(B, H, W, -1)
-        )
+        x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+        x = x.transpose(1, 2).reshape(*batch, H, W, C)
         x = self.proj(x)
 
         return x
@@ -258,12 +310,13 @@ def window_partition(
 ) -> Tuple[torch.Tensor, Tuple[int, int]]:
     """
     Partition into non-overlapping windows with padding if needed.
+    Without padding the windows are a view of x, no copy is made.
     Args:
         x (tensor): input tokens with [B, H, W, C].
         window_size (int): window size.
 
     Returns:
-        windows: windows after partition with [B * num_windows, window_size, window_size, C].
+        windows: windows after partition with [B, Hp // window_size, Wp // window_size, window_size, window_size, C].
         (Hp, Wp): padded height and width before partition
     """
     B, H, W, C = x.shape
@@ -275,9 +328,7 @@ def window_partition(
     Hp, Wp = H + pad_h, W + pad_w
 
     x = x.view(B, Hp // window_size, window_size, Wp // window_size, window_size, C)
-    windows = (
-        x.permute(0, 1, 3, 2, 4, 5).contiguous().view(-1, window_size, window_size, C)
-    )
+    windows = x.permute(0, 1, 3, 2, 4, 5)
     return windows, (Hp, Wp)
 
 
@@ -290,27 +341,49 @@ def window_unpartition(
     """
     Window unpartition into original sequences and removing padding.
     Args:
-        windows (tensor): input tokens with [B * num_windows, window_size, window_size, C].
+        windows (tensor): input tokens with [B, Hp // window_size, Wp // window_size, window_size, window_size, C].
         window_size (int): window size.
         pad_hw (Tuple): padded height and width (Hp, Wp).
         hw (Tuple): original height and width (H, W) before padding.
 
     Returns:
-        x: unpartitioned sequences with [B, H, W, C].
+        x: unpartitioned sequences with [B, H, W, C], a view when padding was removed.
     """
     Hp, Wp = pad_hw
     H, W = hw
-    B = windows.shape[0] // (Hp * Wp // window_size // window_size)
-    x = windows.view(
-        B, Hp // window_size, Wp // window_size, window_size, window_size, -1
-    )
-    x = x.permute(0, 1, 3, 2, 4, 5).contiguous().view(B, Hp, Wp, -1)
+    B = windows.shape[0]
+    x = windows.permute(0, 1, 3, 2, 4, 5).reshape(B, Hp, Wp, -1)
 
     if Hp > H or Wp > W:
-        x = x[:, :H, :W, :].contiguous()
+        x = x[:, :H, :W, :]
     return x
 
 
+def cached(cache: dict, key, param: torch.Tensor, compute):
+    """
+    Memoises compute() per key while gradients are off, i.e. at inference.
+    Entries are recomputed once param has been updated (or reloaded).
+    """
+    if torch.is_grad_enabled():
+        return compute()
+    version = (param._version, param.device, param.dtype)
+    if key not in cache or cache[key][0] != version:
+        cache[key] = (version, compute())
+    return cache[key][1]
+
+
+def get_abs_pos(pos_embed: torch.Tensor, hw: Tuple[int, int]) -> torch.Tensor:
+    """
+    Resize the absolute positional embeddings (1, H, W, C) to the (h, w) patch grid.
+    """
+    return F.interpolate(
+        pos_embed.permute(0, 3, 1, 2),
+        size=tuple(hw),
+        mode="bicubic",
+        align_corners=False,
+    ).permute(0, 2, 3, 1)
+
+
 def get_rel_pos(q_size: int, k_size: int, rel_pos: torch.Tensor) -> torch.Tensor:
     """
     Get relative positional embeddings according to the relative positions of
@@ -337,13 +410,53 @@ def get_rel_pos(q_size: int, k_size: int, rel_pos: torch.Tensor) -> torch.Tensor
         rel_pos_resized = rel_pos
 
     # Scale the coords with short length if shapes for q and k are different.
-    q_coords = torch.arange(q_size)[:, None] * max(k_size / q_size, 1.0)
-    k_coords = torch.arange(k_size)[None, :] * max(q_size / k_size, 1.0)
+    q_coords = torch.arange(q_size, device=rel_pos.device)[:, None] * max(
+        k_size / q_size, 1.0
+    )
+    k_coords = torch.arange(k_size, device=rel_pos.device)[None, :] * max(
+        q_size / k_size, 1.0
+    )
     relative_coords = (q_coords - k_coords) + (k_size - 1) * max(q_size / k_size, 1.0)
 
     return rel_pos_resized[relative_coords.long()]
 
 
+def decomposed_rel_pos_bias(
+    q: torch.Tensor,
+    rel_pos_h: torch.Tensor,
+    rel_pos_w: torch.Tensor,
+    q_size: Tuple[int, int],
+    k_size: Tuple[int, int],
+) -> torch.Tensor:
+    """
+    Calculate the decomposed Relative Positional Embeddings from :paper:`mvitv2`
+    as an additive attention bias, e.g. the attn_mask of scaled_dot_product_attention.
+    Args:
+        q (Tensor): query q in the attention layer with shape (..., q_h * q_w, C).
+        rel_pos_h (Tensor): relative position embeddings (Lh, C) for height axis,
+            or the (q_h, k_h, C) embeddings already extracted by get_rel_pos.
+        rel_pos_w (Tensor): relative position embeddings (Lw, C) for width axis,
+            or the (q_w, k_w, C) embeddings already extracted by get_rel_pos.
+        q_size (Tuple): spatial sequence size of query q with (q_h, q_w).
+        k_size (Tuple): spatial sequence size of key k with (k_h, k_w).
+
+    Returns:
+        bias (Tensor): attention bias with shape (..., q_h * q_w, k_h * k_w).
+    """
+    q_h, q_w = q_size
+    k_h, k_w = k_size
+    Rh = rel_pos_h if rel_pos_h.dim() == 3 else get_rel_pos(q_h, k_h, rel_pos_h)
+    Rw = rel_pos_w if rel_pos_w.dim() == 3 else get_rel_pos(q_w, k_w, rel_pos_w)
+
+    batch, dim = q.shape[:-2], q.shape[-1]
+    r_q = q.reshape(*batch, q_h, q_w, dim)
+    rel_h = torch.einsum("...hwc,hkc->...hwk", r_q, Rh)
+    rel_w = torch.einsum("...hwc,wkc->...hwk", r_q, Rw)
+
+    bias = rel_h[..., :, :, :, None] + rel_w[..., :, :, None, :]
+    return bias.reshape(*batch, q_h * q_w, k_h * k_w)
+
+
 def add_decomposed_rel_pos(
     attn: torch.Tensor,
     q: torch.Tensor,
@@ -353,7 +466,8 @@ def add_decomposed_rel_pos(
     k_size: Tuple[int, int],
 ) -> torch.Tensor:
     """
-    Calculate decomposed Relative Positional Embeddings from :paper:`mvitv2`.
+    Add the decomposed Relative Positional Embeddings to an explicit attention map,
+    see decomposed_rel_pos_bias.
     https://github.com/facebookresearch/mvit/blob/19786631e330df9f3622e5402b4a419a263a2c80/mvit/models/attention.py   # noqa B950
     Args:
         attn (Tensor): attention map.
@@ -366,23 +480,7 @@ def add_decomposed_rel_pos(
     Returns:
         attn (Tensor): attention map with added relative positional embeddings.
     """
-    q_h, q_w = q_size
-    k_h, k_w = k_size
-    Rh = get_rel_pos(q_h, k_h, rel_pos_h)
-    Rw = get_rel_pos(q_w, k_w, rel_pos_w)
-
-    B, _, dim = q.shape
-    r_q = q.reshape(B, q_h, q_w, dim)
-    rel_h = torch.einsum("bhwc,hkc->bhwk", r_q, Rh)
-    rel_w = torch.einsum("bhwc,wkc->bhwk", r_q, Rw)
-
-    attn = (
-        attn.view(B, q_h, q_w, k_h, k_w)
-        + rel_h[:, :, :, :, None]
-        + rel_w[:, :, :, None, :]
-    ).view(B, q_h * q_w, k_h * k_w)
-
-    return attn
+    return attn + decomposed_rel_pos_bias(q, rel_pos_h, rel_pos_w, q_size, k_size)
 
 
 class PatchEmbed(nn.Module):
@@ -421,3 +519,53 @@ class PatchEmbed(nn.Module):
         # B C H W -> B H W C
         x = x.permute(0, 2, 3, 1)
         return x
+
+
+def _build_sam_encoder(
+    embed_dim, depth, num_heads, global_attn_indexes, img_size=1024, **kwargs
+):
+    return ImageEncoderViT(
+        img_size=img_size,
+        patch_size=16,
+        embed_dim=embed_dim,
+        depth=depth,
+        num_heads=num_heads,
+        mlp_ratio=4,
+        out_chans=256,
+        qkv_bias=True,
+        norm_layer=partial(torch.nn.LayerNorm, eps=1e-6),
+        use_rel_pos=True,
+        window_size=14,
+        global_attn_indexes=global_attn_indexes,
+        **kwargs,
+    )
+
+
+def sam_vit_b(**kwargs):
+    return _build_sam_encoder(
+        embed_dim=768,
+        depth=12,
+        num_heads=12,
+        global_attn_indexes=[2, 5, 8, 11],
+        **kwargs,
+    )
+
+
+def sam_vit_l(**kwargs):
+    return _build_sam_encoder(
+        embed_dim=1024,
+        depth=24,
+        num_heads=16,
+        global_attn_indexes=[5, 11, 17, 23],
+        **kwargs,
+    )
+
+
+def sam_vit_h(**kwargs):
+    return _build_sam_encoder(
+        embed_dim=1280,
+        depth=32,
+        num_heads=16,
+        global_attn_indexes=[7, 15, 23, 31],
+        **kwargs,
+    )
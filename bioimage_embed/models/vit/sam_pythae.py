@@ -0,0 +1,66 @@
+"""
+Windowed attention ViT encoders from Segment Anything as VAE encoders.
+
+The image encoder's neck output (out_chans, H / 16, W / 16) is average pooled
+to the latent mean and log variance. The decoder broadcasts z over the
+patch grid and upsamples back to the image with PixelShuffle stages.
+"""
+
+import math
+
+import torch
+from torch import nn
+from transformers.utils import ModelOutput
+from pythae.models import VAEConfig
+from pythae.models.nn import BaseDecoder, BaseEncoder
+
+from . import sam
+from .common import LayerNorm2d
+
+
+class SAMEncoder(BaseEncoder):
+    def __init__(self, model_config: VAEConfig, arch="sam_vit_b", **kwargs):
+        super().__init__()
+        in_chans, height, width = model_config.input_dim
+        assert height == width, "ImageEncoderViT expects square images"
+        self.encoder = getattr(sam, arch)(
+            img_size=height, in_chans=in_chans, **kwargs
+        )
+        out_chans = self.encoder.neck[0].out_channels
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.embedding = nn.Linear(out_chans, model_config.latent_dim)
+        self.log_var = nn.Linear(out_chans, model_config.latent_dim)
+
+    def forward(self, x):
+        x = self.pool(self.encoder(x)).flatten(1)
+        return ModelOutput(
+            embedding=self.embedding(x), log_covariance=self.log_var(x)
+        )
+
+
+class SAMDecoder(BaseDecoder):
+    def __init__(self, model_config: VAEConfig, patch_size=16, out_chans=256):
+        super().__init__()
+        in_chans, height, width = model_config.input_dim
+        self.grid_size = (height // patch_size, width // patch_size)
+        self.embedding = nn.Linear(model_config.latent_dim, out_chans)
+        self.pos_embed = nn.Parameter(
+            torch.zeros(1, out_chans, *self.grid_size)
+        )
+
+        layers = []
+        channels = out_chans
+        for _ in range(int(math.log2(patch_size))):
+            layers += [
+                nn.Conv2d(channels, 2 * channels, kernel_size=3, padding=1),
+                nn.PixelShuffle(2),
+                LayerNorm2d(channels // 2),
+                nn.GELU(),
+            ]
+            channels //= 2
+        layers.append(nn.Conv2d(channels, in_chans, kernel_size=1))
+        self.decoder = nn.Sequential(*layers)
+
+    def forward(self, z):
+        x = self.embedding(z.flatten(1))[:, :, None, None] + self.pos_embed
+        return ModelOutput(reconstruction=self.decoder(x))
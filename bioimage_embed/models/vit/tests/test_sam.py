@@ -0,0 +1,108 @@
+import pytest
+import torch
+
+from bioimage_embed.models.vit.sam import (
+    Attention,
+    ImageEncoderViT,
+    add_decomposed_rel_pos,
+    window_partition,
+    window_unpartition,
+)
+
+
+@pytest.fixture()
+def encoder():
+    encoder = ImageEncoderViT(
+        img_size=64,
+        patch_size=16,
+        embed_dim=32,
+        depth=2,
+        num_heads=2,
+        out_chans=8,
+        use_rel_pos=True,
+        window_size=2,
+        global_attn_indexes=(1,),
+    )
+    # Non zero relative positions so their interpolation matters
+    for name, param in encoder.named_parameters():
+        if "rel_pos" in name:
+            torch.nn.init.normal_(param, std=0.02)
+    return encoder.eval()
+
+
+@pytest.mark.parametrize("hw", [(64, 64), (32, 96), (128, 48)])
+def test_variable_resolution(encoder, hw):
+    x = torch.rand(2, 3, *hw)
+    encoder.set_variable_resolution()
+    with torch.inference_mode():
+        y = encoder(x)
+        # Second call is served from the cache
+        assert torch.equal(encoder(x), y)
+    assert y.shape == (2, 8, hw[0] // 16, hw[1] // 16)
+    if hw != (64, 64):
+        assert (hw[0] // 16, hw[1] // 16) in encoder._pos_cache
+
+
+def test_native_resolution_unchanged(encoder):
+    x = torch.rand(1, 3, 64, 64)
+    with torch.no_grad():
+        y = encoder(x)
+        assert torch.allclose(encoder.set_variable_resolution()(x), y)
+
+
+def test_other_resolution_needs_variable_resolution(encoder):
+    with pytest.raises(ValueError):
+        encoder(torch.rand(1, 3, 32, 32))
+
+
+def test_cache_invalidated_by_update(encoder):
+    encoder.set_variable_resolution()
+    x = torch.rand(1, 3, 32, 32)
+    with torch.no_grad():
+        y = encoder(x)
+        encoder.pos_embed.add_(torch.randn_like(encoder.pos_embed))
+        assert not torch.allclose(encoder(x), y)
+
+
+def reference_attention(attn, x):
+    # Explicit q @ k^T, softmax and decomposed relative positions
+    B, H, W, _ = x.shape
+    qkv = (
+        attn.qkv(x)
+        .reshape(B, H * W, 3, attn.num_heads, -1)
+        .permute(2, 0, 3, 1, 4)
+    )
+    q, k, v = qkv.reshape(3, B * attn.num_heads, H * W, -1).unbind(0)
+    a = (q * attn.scale) @ k.transpose(-2, -1)
+    a = add_decomposed_rel_pos(
+        a, q, attn.rel_pos_h, attn.rel_pos_w, (H, W), (H, W)
+    )
+    a = a.softmax(dim=-1)
+    x = (
+        (a @ v)
+        .view(B, attn.num_heads, H, W, -1)
+        .permute(0, 2, 3, 1, 4)
+        .reshape(B, H, W, -1)
+    )
+    return attn.proj(x)
+
+
+@pytest.mark.parametrize("hw", [(4, 4), (6, 3)])
+def test_fused_attention(hw, dim=16):
+    attn = Attention(dim, num_heads=2, use_rel_pos=True, input_size=(4, 4))
+    torch.nn.init.normal_(attn.rel_pos_h, std=0.1)
+    torch.nn.init.normal_(attn.rel_pos_w, std=0.1)
+    x = torch.rand(2, *hw, dim)
+    assert torch.allclose(attn(x), reference_attention(attn, x), atol=1e-5)
+
+
+@pytest.mark.parametrize("hw", [(8, 8), (7, 10)])
+def test_window_partition(hw, window_size=4):
+    x = torch.rand(2, *hw, 3)
+    windows, pad_hw = window_partition(x, window_size)
+    assert windows.shape[-3:] == (window_size, window_size, 3)
+    if pad_hw == hw:
+        # No padding, the windows are a view
+        assert windows.data_ptr() == x.data_ptr()
+    y = window_unpartition(windows, window_size, pad_hw, hw)
+    assert torch.equal(y, x)
@@ -0,0 +1,151 @@
+"""
+Dry run of a lightning model on fake data, a check of the model and its
+training wiring in seconds instead of a pass over the real dataset.
+
+A batch of zeros of input_dim is collated like the DataModule collates
+samples and pushed through eval_step, the forward pass and the loss
+function. On the meta device no memory is allocated and nothing is
+computed, only shapes and dtypes are propagated.
+
+The report has, for every module at the given depth (e.g. model.encoder):
+params -> number of parameters
+flops -> floating point operations of its forward pass, for the batch
+activation_bytes -> summed output sizes of its leaf modules, roughly what
+    is kept for the backward pass
+"""
+
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+from . import utils
+
+
+def fake_batch(input_dim, batch_size=2, collate_fn=utils.collate_none):
+    """(x, y) batch of zero images and labels as the dataloader collates"""
+    samples = [(torch.zeros(*input_dim), 0) for _ in range(batch_size)]
+    return collate_fn(samples)
+
+
+def tensor_bytes(output):
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, dict):
+        return sum(tensor_bytes(value) for value in output.values())
+    if isinstance(output, (list, tuple)):
+        return sum(tensor_bytes(value) for value in output)
+    return 0
+
+
+def row_names(model, depth):
+    return [
+        name
+        for name, _ in model.named_modules()
+        if name and name.count(".") == depth - 1
+    ]
+
+
+def row_of(name, rows):
+    return next(
+        (row for row in rows if name == row or name.startswith(f"{row}.")),
+        None,
+    )
+
+
+def dry_run(lit_model, input_dim, batch_size=2, device="cpu", depth=2):
+    """
+    Runs eval_step on a fake batch and checks the reconstruction has the
+    input's shape and the loss is a scalar. Returns the report, a dict
+    with rows (one per module at depth, then the total) and the shapes.
+    """
+    x, y = fake_batch(input_dim, batch_size)
+    batch = (x.to(device), y.to(device))
+    lit_model.eval()
+
+    rows = row_names(lit_model, depth)
+    report = {
+        row: {"module": row, "params": 0, "flops": 0, "activation_bytes": 0}
+        for row in [*rows, "total"]
+    }
+    for name, param in lit_model.named_parameters():
+        for row in (row_of(name, rows), "total"):
+            if row is not None:
+                report[row]["params"] += param.numel()
+
+    counter = FlopCounterMode(display=False)
+    starts = {row: [] for row in rows}
+    handles = []
+
+    def count_flops(row):
+        def pre_hook(module, args):
+            starts[row].append(counter.get_total_flops())
+
+        def hook(module, args, output):
+            flops = counter.get_total_flops() - starts[row].pop()
+            report[row]["flops"] += flops
+
+        return pre_hook, hook
+
+    def count_activations(row):
+        def hook(module, args, output):
+            for key in (row, "total"):
+                if key is not None:
+                    report[key]["activation_bytes"] += tensor_bytes(output)
+
+        return hook
+
+    for name, module in lit_model.named_modules():
+        if name in starts:
+            pre_hook, hook = count_flops(name)
+            handles.append(module.register_forward_pre_hook(pre_hook))
+            handles.append(module.register_forward_hook(hook))
+        if next(module.children(), None) is None:
+            hook = count_activations(row_of(name, rows))
+            handles.append(module.register_forward_hook(hook))
+
+    try:
+        with torch.no_grad(), counter:
+            loss, model_output = lit_model.eval_step(batch, 0)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    report["total"]["flops"] = counter.get_total_flops()
+    recon_shape = tuple(model_output.recon_x.shape)
+    if recon_shape != tuple(x.shape):
+        raise ValueError(
+            f"Reconstruction of shape {recon_shape} "
+            f"for an input of shape {tuple(x.shape)}"
+        )
+    if loss["loss"].numel() != 1:
+        raise ValueError(f"Loss of shape {tuple(loss['loss'].shape)}")
+    return {
+        "device": str(device),
+        "input_shape": tuple(x.shape),
+        "z_shape": tuple(model_output.z.shape),
+        "recon_shape": recon_shape,
+        "losses": sorted(loss),
+        "rows": list(report.values()),
+    }
+
+
+def human(value, units=("", "K", "M", "G", "T", "P")):
+    for unit in units[:-1]:
+        if abs(value) < 1000:
+            return f"{value:.1f}{unit}"
+        value /= 1000
+    return f"{value:.1f}{units[-1]}"
+
+
+def format_report(report):
+    lines = [
+        f"device {report['device']}, input {report['input_shape']}, "
+        f"z {report['z_shape']}, reconstruction {report['recon_shape']}, "
+        f"losses {report['losses']}",
+        f"{'module':<40} {'params':>9} {'flops':>9} {'activations':>12}",
+    ]
+    for row in report["rows"]:
+        lines.append(
+            f"{row['module']:<40} {human(row['params']):>9} "
+            f"{human(row['flops']):>9} {human(row['activation_bytes']):>11}B"
+        )
+    return "\n".join(lines)
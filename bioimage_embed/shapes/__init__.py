@@ -1,14 +1,15 @@
 from .lightning import MaskEmbed, MaskEmbedLatentAugment
 import torch
 import torch.nn.functional as F
-from .transforms import DistogramToMaskPipeline
+from .decode import decode_latents
+
 
 def mask_from_latent(self, z, window_size):
     # This should be class-method based
     # I.e. self.decoder(z)
-    dist = self.decoder(z).detach().numpy()
-    mask = DistogramToMaskPipeline(window_size)(dist)
-    return mask
+    # Batched over all of z, see decode.decode_latents for the other stages
+    mask = decode_latents(self.decoder, z, window_size, outputs=("mask",))
+    return mask["mask"].numpy()
 
 
 def loss_function(self, *args, recons, input, distance_matrix_loss=True, **kwargs):
@@ -0,0 +1,142 @@
+"""
+Batched decoding of latent vectors back into shapes:
+
+z -> distogram -> (symmetric) distogram -> coords -> mask
+
+All stages run in torch on whole chunks of latents at once, instead of one
+z at a time through sklearn MDS and skimage polygon2mask. Chunks are sized
+so that each stays within a memory budget.
+"""
+
+import torch
+
+from .mds import mds
+
+STAGES = ("distogram", "coords", "mask")
+
+
+def symmetrise(distogram):
+    """Elementwise max of D and D^T, as in AsymmetricDistogramToSymmetricDistogram"""
+    return torch.maximum(distogram, distogram.transpose(-1, -2))
+
+
+def distogram_to_coords(distogram, size):
+    """
+    Coordinates of (..., n, n) distograms via classical MDS, scaled to the
+    window like DistogramToCoords. Returns (..., n, 2) coordinates.
+    """
+    coords = mds(distogram.float())
+    return coords * size + size / 2
+
+
+def coords_to_mask(coords, mask_shape):
+    """
+    Rasterises (..., n, 2) polygons in (row, col) order into boolean masks
+    of shape (..., *mask_shape), as skimage.draw.polygon2mask does.
+
+    Scanline even-odd fill: for every row, the columns at which the polygon
+    edges cross the row are sorted and a pixel is inside if an odd number
+    of crossings lie to its left.
+    """
+    height, width = mask_shape
+    batch_shape = coords.shape[:-2]
+    coords = coords.reshape(-1, *coords.shape[-2:]).float()
+
+    start = coords
+    end = torch.roll(coords, shifts=-1, dims=-2)
+    rows = torch.arange(height, device=coords.device, dtype=coords.dtype)
+    cols = torch.arange(width, device=coords.device, dtype=coords.dtype)
+
+    # (m, h, n) for every polygon, row and edge
+    r = rows[None, :, None]
+    start_r, start_c = start[:, None, :, 0], start[:, None, :, 1]
+    end_r, end_c = end[:, None, :, 0], end[:, None, :, 1]
+    crosses = (start_r > r) != (end_r > r)
+    # Guard the division, non crossing edges are discarded below
+    delta_r = torch.where(crosses, end_r - start_r, torch.ones_like(end_r))
+    crossing_c = start_c + (r - start_r) * (end_c - start_c) / delta_r
+    crossing_c = torch.where(
+        crosses, crossing_c, torch.full_like(crossing_c, float("inf"))
+    )
+    crossing_c, _ = torch.sort(crossing_c, dim=-1)
+
+    # Number of crossings strictly left of each pixel centre, (m, h, w)
+    left = torch.searchsorted(
+        crossing_c.contiguous(),
+        cols.expand(*crossing_c.shape[:-1], width).contiguous(),
+    )
+    mask = left % 2 == 1
+    return mask.reshape(*batch_shape, height, width)
+
+
+def chunk_size(sample_bytes, memory_budget):
+    return max(1, int(memory_budget // max(sample_bytes, 1)))
+
+
+def decode_latents(
+    decoder,
+    z,
+    window_size,
+    outputs=("mask",),
+    latent_shape=None,
+    symmetric=True,
+    memory_budget=2**30,
+):
+    """
+    Decodes a batch of latents z (m, latent_dim) into shapes in a single
+    pass per chunk through decoder, symmetrisation, MDS and rasterisation.
+
+    Args:
+        decoder: maps a batch of latents to distograms, may return a
+            ModelOutput with a reconstruction like the pythae decoders.
+        z: (m, latent_dim) latents as a tensor or array.
+        window_size: size of the coordinate window and of the masks.
+        outputs: which of STAGES to return.
+        latent_shape: shape the decoder expects per latent, e.g. (latent_dim, 1, 1).
+        symmetric: symmetrise the distograms before MDS.
+        memory_budget: approximate bytes of working memory per chunk.
+
+    Returns:
+        dict of the requested stages, each concatenated over all m latents
+        with shapes (m, c, n, n), (m, c, n, 2) and (m, c, window, window).
+    """
+    unknown = set(outputs) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown outputs {unknown}, expected any of {STAGES}")
+    z = torch.as_tensor(z)
+    if latent_shape is not None:
+        z = z.reshape(-1, *latent_shape)
+
+    results = {stage: [] for stage in outputs}
+    chunk = None
+    start = 0
+    with torch.inference_mode():
+        while start < len(z):
+            batch = z[start : start + (chunk or 1)]
+            distogram = decoder(batch)
+            if isinstance(distogram, dict):
+                distogram = distogram["reconstruction"]
+            if chunk is None:
+                # Size the chunks from the first decoded sample
+                c, n = distogram.shape[-3], distogram.shape[-1]
+                sample_bytes = (
+                    4
+                    * c
+                    * (4 * n * n + 3 * window_size * n + 3 * window_size**2)
+                )
+                chunk = chunk_size(sample_bytes, memory_budget)
+            start += len(batch)
+
+            if symmetric:
+                distogram = symmetrise(distogram)
+            if "distogram" in outputs:
+                results["distogram"].append(distogram.cpu())
+            if not {"coords", "mask"} & set(outputs):
+                continue
+            coords = distogram_to_coords(distogram, window_size)
+            if "coords" in outputs:
+                results["coords"].append(coords.cpu())
+            if "mask" in outputs:
+                mask = coords_to_mask(coords, (window_size, window_size))
+                results["mask"].append(mask.cpu())
+    return {stage: torch.cat(values) for stage, values in results.items()}
@@ -1,9 +1,10 @@
 import torch
-import torchvision
 
 from torch import nn
 from ..lightning import AutoEncoderUnsupervised
 from . import loss_functions as lf
+from . import symmetric, tta
+from .transforms import RotateIndexingClockwise
 from transformers.utils import ModelOutput
 from types import SimpleNamespace
 
@@ -15,6 +16,71 @@ def frobenius_norm_2D_torch(tensor: torch.Tensor) -> torch.Tensor:
 class MaskEmbed(AutoEncoderUnsupervised):
     def __init__(self, model, args=SimpleNamespace()):
         super().__init__(model, args)
+        # Random start index per sample, applied to whole batches on device
+        self.rotate_indexing = RotateIndexingClockwise(
+            p=getattr(self.args, "rotate_indexing_p", 0.0), batched=True
+        )
+        # Symmetric reconstructions by construction, see shapes.symmetric
+        self.symmetric_decoder = getattr(self.args, "symmetric_decoder", None)
+        # Whether the last forward pass decoded through the wrapper, models
+        # decoding some other way keep the diagonal and symmetry losses
+        self.decoded_symmetric = False
+        if self.symmetric_decoder:
+            wrapper = symmetric.wrap_decoder(
+                self, self.model.decoder, self.symmetric_decoder
+            )
+            wrapper.register_forward_hook(self._on_symmetric_decode)
+            self.decoder = self.model.decoder
+
+    def _on_symmetric_decode(self, module, args, output):
+        self.decoded_symmetric = True
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        x, *rest = batch if isinstance(batch, (list, tuple)) else (batch,)
+        if getattr(self.args, "packed_distograms", False):
+            x = symmetric.unpack_triangle(x)
+        if self.trainer.training and self.rotate_indexing.probability:
+            x = self.rotate_indexing(x)
+        return (x, *rest) if isinstance(batch, (list, tuple)) else x
+
+    def encode(self, x):
+        """
+        Encoder only forward pass, with test time augmentation over the
+        contour reorderings if tta_shifts is set, see shapes.tta
+        """
+        num_shifts = getattr(self.args, "tta_shifts", 0)
+        if not num_shifts:
+            return super().encode(x)
+        return tta.tta_encode(
+            super().encode,
+            x,
+            num_shifts=num_shifts,
+            flips=getattr(self.args, "tta_flips", False),
+            reduction=getattr(self.args, "tta_reduction", "mean"),
+        )
+
+    def predict_step(self, batch, batch_idx, dataloader_idx=0):
+        if isinstance(batch, (list, tuple)):
+            batch = batch[0]
+        self.decoded_symmetric = False
+        model_output = super().predict_step(batch, batch_idx, dataloader_idx)
+        if getattr(self.args, "tta_shifts", 0) and not self.training:
+            # Embeddings over the reorderings, recon_x and the losses stay
+            # those of the identity view
+            for key, value in self.encode(batch).items():
+                model_output[key] = value
+        # Item assignment, ModelOutput only keeps new attributes off its keys
+        model_output["scalings"] = self.scalings(batch)
+        return model_output
+
+    def scalings(self, x):
+        """
+        Per sample and channel frobenius norms of x, (B, C, 1, 1), with
+        frobenius_norm, ones otherwise
+        """
+        if getattr(self.args, "frobenius_norm", False):
+            return frobenius_norm_2D_torch(x.float())
+        return x.new_ones(*x.shape[:2], 1, 1, dtype=torch.float)
 
     def batch_to_tensor(self, batch):
         """
@@ -22,30 +88,27 @@ class MaskEmbed(AutoEncoderUnsupervised):
         Batch is expected to be normalised to the window size which will be the same or smaller than the image size in question.
         The batch is also optionally frobenius normalised to make the loss function invariant to the size of the shape.
         """
-        # x = batch[0].float()
-        output = super().batch_to_tensor(batch)
-        normalised_data = output["data"]
-        if self.args.frobenius_norm:
-            scalings = frobenius_norm_2D_torch(output["data"])
-        else:
-            scalings = torch.ones_like(output["data"])
-        return ModelOutput(data=normalised_data / scalings, scalings=scalings)
+        x = batch[0] if isinstance(batch, (list, tuple)) else batch
+        x = x["data"] if isinstance(x, dict) else x
+        scalings = self.scalings(x)
+        return ModelOutput(data=x.float() / scalings, scalings=scalings)
 
     def loss_function(self, model_output, *args, **kwargs):
-        loss_ops = lf.DistanceMatrixLoss(model_output.recon_x, norm=False)
+        # Shape losses in float32, also under bf16 or fp16 autocast
+        loss_ops = lf.DistanceMatrixLoss(
+            model_output.recon_x.float(), norm=False
+        )
         loss = model_output.loss
 
-        shape_loss = torch.sum(
-            torch.stack(
-                [
-                    loss_ops.diagonal_loss(),
-                    loss_ops.symmetry_loss(),
-                    # loss_ops.triangle_inequality(),
-                    loss_ops.non_negative_loss(),
-                    # loss_ops.clockwise_order_loss(),
-                ]
-            )
-        )
+        shape_losses = [
+            # loss_ops.triangle_inequality(),
+            loss_ops.non_negative_loss(),
+            # loss_ops.clockwise_order_loss(),
+        ]
+        if not self.decoded_symmetric:
+            # Hold by construction with a symmetric decoder
+            shape_losses += [loss_ops.diagonal_loss(), loss_ops.symmetry_loss()]
+        shape_loss = torch.sum(torch.stack(shape_losses))
         loss += shape_loss
 
         # loss += lf.diagonal_loss(model_output.recon_x)
@@ -110,17 +173,13 @@ class MaskEmbedLatentAugment(MaskEmbed):
 
         # self.log("train_loss", self.loss)
         # self.log("train_loss", loss)
-        self.logger.experiment.add_scalar("Loss/train", loss, batch_idx)
-
-        self.logger.experiment.add_image(
-            "input", torchvision.utils.make_grid(x["data"]), batch_idx
-        )
+        self.log("Loss/train", loss)
 
         # if self.PYTHAE_FLAG:
-        self.logger.experiment.add_image(
-            "output",
-            torchvision.utils.make_grid(model_output.recon_x),
-            batch_idx,
+        self.image_logger.log(
+            self.logger.experiment,
+            {"input": x["data"], "output": model_output.recon_x},
+            self.global_step,
         )
 
         return loss
@@ -1,25 +1,25 @@
 import torch
 
 
-def mds(d):
+def mds(d, n_components=2):
     """
-    Multidimensional Scaling (MDS) in PyTorch.
+    Classical Multidimensional Scaling (MDS) in PyTorch.
 
-    :param d: Distance matrix.
-    :return: A matrix of x, y coordinates.
+    :param d: Distance matrix, or a batch of them with shape (..., n, n).
+    :param n_components: Dimensions of the embedding.
+    :return: A matrix of x, y coordinates with shape (..., n, n_components).
     """
-    n = d.size(0)
-    I = torch.eye(n)
-    H = I - torch.ones((n, n)) / n
+    n = d.size(-1)
+    I = torch.eye(n, dtype=d.dtype, device=d.device)
+    H = I - torch.ones((n, n), dtype=d.dtype, device=d.device) / n
 
-    S = -0.5 * H @ d @ H
-    eigvals, eigvecs = S.symeig(eigenvectors=True)
+    # Double centering of the squared distances gives the Gram matrix
+    S = -0.5 * H @ d.pow(2) @ H
+    eigvals, eigvecs = torch.linalg.eigh(S)
 
-    # Sort the eigenvalues and eigenvectors in decreasing order
-    idx = eigvals.argsort(descending=True)
-    eigvals, eigvecs = eigvals[idx], eigvecs[:, idx]
+    # eigh sorts in ascending order, take the largest eigenvalues
+    eigvals = eigvals[..., -n_components:].flip(-1)
+    eigvecs = eigvecs[..., -n_components:].flip(-1)
 
-    # Take the square root of the two largest eigenvalues
-    diag_lambdas = torch.diag(torch.sqrt(eigvals[:2]))
-
-    return eigvecs[:, :2] @ diag_lambdas
+    # Take the square root of the largest eigenvalues
+    return eigvecs * torch.sqrt(eigvals.clamp(min=0)).unsqueeze(-2)
@@ -0,0 +1,105 @@
+"""
+Distograms are symmetric with a zero diagonal by construction.
+
+SymmetricDecoder wraps a decoder so its reconstructions are too, either by
+averaging D and D^T or by keeping the strict upper triangle and mirroring
+it, so the symmetry and diagonal losses are not needed. It only enforces
+the symmetry: the wrapped (convolutional) decoders still decode the full
+n x n image, so neither mode saves decoder or loss compute.
+
+Distograms can also be stored and transferred as their packed strict upper
+triangles, (..., n (n - 1) / 2). They are unpacked on device before the
+encoder, which always sees the full n x n input.
+"""
+
+import math
+
+import torch
+from pythae.models.nn import BaseDecoder
+
+MODES = ("average", "triangle")
+
+
+def triangle_size(n):
+    """Length of the packed strict upper triangle of an n x n matrix"""
+    return n * (n - 1) // 2
+
+
+def triangle_side(m):
+    """n of an n x n matrix with a packed strict upper triangle of length m"""
+    n = (1 + math.isqrt(1 + 8 * m)) // 2
+    if triangle_size(n) != m:
+        raise ValueError(f"{m} is not the size of a packed triangle")
+    return n
+
+
+def pack_triangle(x):
+    """Strict upper triangle of (..., n, n) matrices as (..., n (n - 1) / 2)"""
+    n = x.shape[-1]
+    rows, cols = torch.triu_indices(n, n, offset=1, device=x.device)
+    return x[..., rows, cols]
+
+
+def unpack_triangle(packed):
+    """Symmetric (..., n, n) matrices with a zero diagonal from pack_triangle"""
+    n = triangle_side(packed.shape[-1])
+    rows, cols = torch.triu_indices(n, n, offset=1, device=packed.device)
+    x = packed.new_zeros(*packed.shape[:-1], n, n)
+    x[..., rows, cols] = packed
+    x[..., cols, rows] = packed
+    return x
+
+
+def symmetrise(x, mode="average"):
+    """Symmetric, zero diagonal version of (..., n, n) matrices"""
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, expected {MODES}")
+    if mode == "average":
+        x = (x + x.transpose(-1, -2)) / 2
+    upper = x.triu(1)
+    return upper + upper.transpose(-1, -2)
+
+
+class PackTriangle(torch.nn.Module):
+    """Transform packing a (..., n, n) distogram into its upper triangle"""
+
+    def forward(self, x):
+        return pack_triangle(torch.as_tensor(x))
+
+
+class SymmetricDecoder(BaseDecoder):
+    """Wraps a decoder so its reconstructions are symmetric distograms"""
+
+    def __init__(self, decoder, mode="average"):
+        super().__init__()
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode}, expected {MODES}")
+        self.decoder = decoder
+        self.mode = mode
+
+    def forward(self, z):
+        output = self.decoder(z)
+        if not isinstance(output, dict):
+            return symmetrise(output, self.mode)
+        output["reconstruction"] = symmetrise(
+            output["reconstruction"], self.mode
+        )
+        return output
+
+
+def wrap_decoder(module, decoder, mode="average"):
+    """
+    Replaces every reference to decoder within module by a SymmetricDecoder,
+    also the ones a model decodes through, e.g. model.model._decoder of the
+    legacy VQVAE or the pl_bolts VAE's decoder. Returns the wrapper.
+    """
+    parents = [
+        (parent, name)
+        for parent in module.modules()
+        for name, child in parent.named_children()
+        if child is decoder
+    ]
+    wrapper = SymmetricDecoder(decoder, mode)
+    for parent, name in parents:
+        setattr(parent, name, wrapper)
+    return wrapper
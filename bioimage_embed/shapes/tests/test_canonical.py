@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from bioimage_embed.shapes.transforms import (
+    CanonicalizeCoords,
+    signed_area,
+)
+
+
+@pytest.fixture()
+def coords(n=64):
+    # Irregular star shaped polygon, counter-clockwise
+    theta = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    radius = 1 + 0.3 * np.sin(3 * theta) + 0.1 * np.cos(5 * theta)
+    return np.stack([radius * np.cos(theta), radius * np.sin(theta)])
+
+
+def distogram(coords):
+    return np.linalg.norm(coords[:, :, None] - coords[:, None, :], axis=0)
+
+
+@pytest.mark.parametrize("shift", [0, 1, 17])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_canonical_ordering(coords, shift, reverse):
+    canonical = CanonicalizeCoords()(coords)
+    reordered = np.roll(coords, shift, axis=1)
+    if reverse:
+        reordered = reordered[:, ::-1]
+    assert np.allclose(CanonicalizeCoords()(reordered), canonical)
+    assert np.allclose(
+        distogram(CanonicalizeCoords()(reordered)), distogram(canonical)
+    )
+    assert signed_area(canonical) > 0
+
+
+def test_canonical_rotation_invariant(coords, angle=0.7):
+    rotation = np.array(
+        [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    )
+    canonical = CanonicalizeCoords()(coords)
+    rotated = CanonicalizeCoords()(rotation @ np.roll(coords, 5, axis=1))
+    assert np.allclose(distogram(rotated), distogram(canonical))
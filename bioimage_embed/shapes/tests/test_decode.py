@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import torch
+from skimage.draw import polygon2mask
+
+from bioimage_embed.shapes.decode import (
+    coords_to_mask,
+    decode_latents,
+    distogram_to_coords,
+)
+from bioimage_embed.shapes.mds import mds
+
+
+@pytest.fixture(params=[64])
+def window_size(request):
+    return request.param
+
+
+@pytest.fixture()
+def circle(window_size, n=32):
+    theta = torch.linspace(0, 2 * np.pi, n + 1)[:-1]
+    radius = window_size / 4
+    return torch.stack(
+        [
+            window_size / 2 + radius * torch.cos(theta),
+            window_size / 2 + radius * torch.sin(theta),
+        ],
+        dim=-1,
+    )
+
+
+def test_mds_preserves_distances(circle):
+    # In double, cdist's matrix multiplication path loses too much in float
+    circle = circle.double()
+    d = torch.cdist(circle, circle)
+    xy = mds(d[None])[0]
+    assert torch.allclose(torch.cdist(xy, xy), d, atol=1e-6)
+
+
+def test_coords_to_mask(circle, window_size):
+    mask = coords_to_mask(circle[None], (window_size, window_size))[0]
+    expected = polygon2mask((window_size, window_size), circle.numpy())
+    # Pixels exactly on an edge may fall either way
+    assert (mask.numpy() != expected).sum() <= 0.01 * expected.sum()
+
+
+def test_decode_latents(circle, window_size, latent_dim=8, samples=5):
+    d = torch.cdist(circle, circle) / window_size
+    weight = torch.rand(latent_dim)
+
+    def decoder(z):
+        # Every latent decodes to a scaled copy of the same distogram
+        scale = 0.5 + (z @ weight)[:, None, None, None] / latent_dim
+        return {"reconstruction": scale * d}
+
+    z = torch.rand(samples, latent_dim)
+    out = decode_latents(
+        decoder,
+        z,
+        window_size,
+        outputs=("distogram", "coords", "mask"),
+        memory_budget=1,
+    )
+    n = len(circle)
+    assert out["distogram"].shape == (samples, 1, n, n)
+    assert out["coords"].shape == (samples, 1, n, 2)
+    assert out["mask"].shape == (samples, 1, window_size, window_size)
+    coords = distogram_to_coords(out["distogram"], window_size)
+    assert torch.allclose(coords, out["coords"])
+    assert out["mask"].any(dim=(-1, -2)).all()
+
+
+def test_decode_latents_unknown_output(window_size):
+    with pytest.raises(ValueError):
+        decode_latents(lambda z: z, torch.rand(1, 4), window_size, ("image",))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+
+from bioimage_embed.shapes.transforms import (
+    ChannelExpand,
+    CoordsToDistogram,
+    coords_to_distogram,
+)
+
+
+@pytest.fixture()
+def coords(batch=4, n=32):
+    return np.random.default_rng(0).uniform(0, 64, (batch, 2, n))
+
+
+def reference(coords, size, matrix_normalised):
+    distogram = np.linalg.norm(
+        coords[:, :, None] - coords[:, None, :], axis=0
+    ) / (np.sqrt(2) * size)
+    if matrix_normalised:
+        return distogram / np.linalg.norm(distogram, "fro")
+    return distogram / np.linalg.norm([size, size])
+
+
+@pytest.mark.parametrize("matrix_normalised", [False, True])
+def test_matches_reference(coords, matrix_normalised, size=64):
+    out = CoordsToDistogram(size, matrix_normalised)(coords[0])
+    assert out.shape == (1, 32, 32)
+    assert out.dtype == torch.float32
+    expected = reference(coords[0], size, matrix_normalised)
+    assert np.allclose(out[0].numpy(), expected, atol=1e-6)
+
+
+def test_batched(coords, size=64):
+    out = coords_to_distogram(torch.tensor(coords), size)
+    assert out.shape == (4, 1, 32, 32)
+    for c, d in zip(coords, out):
+        assert torch.allclose(d, coords_to_distogram(c, size), atol=1e-6)
+
+
+def test_bfloat16(coords, size=64):
+    out = coords_to_distogram(coords, size, dtype=torch.bfloat16)
+    assert out.dtype == torch.bfloat16
+    assert torch.allclose(
+        out.float(), coords_to_distogram(coords, size), rtol=1e-2
+    )
+
+
+def test_channel_expand_is_a_view(coords, size=64):
+    distogram = coords_to_distogram(coords[0], size)
+    rgb = ChannelExpand(3)(distogram)
+    assert rgb.shape == (3, 32, 32)
+    assert rgb.data_ptr() == distogram.data_ptr()
+    assert (rgb == distogram).all()
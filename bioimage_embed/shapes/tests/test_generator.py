@@ -18,11 +18,6 @@ from bioimage_embed.shapes.transforms import (
 )
 
 
-@pytest.fixture(scope="session")
-def gray2rgb():
-    return T.Lambda(lambda x: x.repeat(3, 1, 1))
-
-
 @pytest.fixture(scope="session")
 def window_size():
     return 128 - 32
@@ -35,7 +30,7 @@ def interp_size(window_size):
 
 @pytest.fixture(scope="session")
 def input_dim(window_size):
-    return (3, window_size, window_size)
+    return (1, window_size, window_size)
 
 
 @pytest.fixture(scope="session")
@@ -96,15 +91,12 @@ def transformer_coords(window_size):
 
 @pytest.fixture(scope="session")
 def transform(transformer_crop, transformer_dist, binary_mask):
-    gray2rgb = T.Lambda(lambda x: x.repeat(3, 1, 1))
     transformer = T.Compose(
         [
             T.Grayscale(1),
             transformer_crop,
             transformer_dist,
             # transformer_coords,
-            T.ToTensor(),
-            gray2rgb,
         ]
     )
     return transformer
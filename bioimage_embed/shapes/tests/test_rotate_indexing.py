@@ -0,0 +1,50 @@
+import pytest
+import torch
+
+from bioimage_embed.shapes.transforms import RotateIndexingClockwise
+
+
+@pytest.fixture()
+def distogram(batch=8, n=16):
+    coords = torch.rand(batch, n, 2)
+    return torch.cdist(coords, coords)[:, None]
+
+
+def rolls(x):
+    """Every cyclic shift of a single (C, n, n) distogram"""
+    return [torch.roll(x, (s, s), dims=(-2, -1)) for s in range(x.shape[-1])]
+
+
+def test_batched_per_sample_shifts(distogram):
+    torch.manual_seed(0)
+    rotate = RotateIndexingClockwise(batched=True)
+    out = rotate(distogram)
+    assert out.shape == distogram.shape
+    shifts = []
+    for x, y in zip(distogram, out):
+        matches = [torch.equal(y, r) for r in rolls(x)]
+        assert any(matches)
+        shifts.append(matches.index(True))
+    # Shifts are drawn per sample, not once per batch
+    assert len(set(shifts)) > 1
+    assert rotate.max_rotations is None
+
+
+def test_single_sample(distogram):
+    out = RotateIndexingClockwise(max_rotations=4)(distogram[0])
+    matches = [torch.equal(out, r) for r in rolls(distogram[0])]
+    assert matches.index(True) < 4
+
+
+def test_probability_zero_is_identity(distogram):
+    rotate = RotateIndexingClockwise(p=0.0, batched=True)
+    assert torch.equal(rotate(distogram), distogram)
+
+
+def test_index_table_is_cached(distogram):
+    rotate = RotateIndexingClockwise(batched=True)
+    rotate(distogram)
+    table = rotate.table(distogram.shape[-1], distogram.device)
+    rotate(distogram)
+    assert rotate.table(distogram.shape[-1], distogram.device) is table
+    assert len(rotate._tables) == 1
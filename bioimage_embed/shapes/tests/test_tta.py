@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+from transformers.utils import ModelOutput
+
+from bioimage_embed.models import create_model
+from bioimage_embed.shapes import tta
+from bioimage_embed.shapes.lightning import MaskEmbed
+
+
+@pytest.fixture()
+def distogram(batch=2, n=12):
+    coords = torch.rand(batch, n, 2)
+    return torch.cdist(coords, coords)[:, None]
+
+
+def encode(x):
+    # The flattened distogram, changes with the ordering of the points
+    return ModelOutput(z=x.flatten(1))
+
+
+@pytest.mark.parametrize("num_shifts", [None, 1, 4])
+@pytest.mark.parametrize("flips", [False, True])
+def test_index_table(num_shifts, flips, n=12):
+    table = tta.index_table(n, num_shifts, flips)
+    k = (num_shifts or n) * (2 if flips else 1)
+    assert table.shape == (k, n)
+    # Every row is a permutation of the points
+    assert (table.sort(-1).values == torch.arange(n)).all()
+    assert len(torch.unique(table, dim=0)) == k
+
+
+def test_augment_matches_roll(distogram, shift=3):
+    table = tta.index_table(distogram.shape[-1], flips=True)
+    views = tta.augment(distogram, table)
+    expected = torch.roll(distogram, shifts=(shift, shift), dims=(-2, -1))
+    assert torch.equal(views[:, shift], expected)
+    flipped = distogram.flip(-1, -2)
+    assert torch.equal(views[:, distogram.shape[-1]], flipped)
+
+
+@pytest.mark.parametrize("reduction", ["mean", "median"])
+def test_tta_invariant(distogram, reduction):
+    out = tta.tta_encode(encode, distogram, flips=True, reduction=reduction)
+    rolled = torch.roll(distogram, shifts=(5, 5), dims=(-2, -1))
+    out_rolled = tta.tta_encode(encode, rolled, flips=True, reduction=reduction)
+    # Averaging over the whole group makes the embedding invariant
+    assert torch.allclose(out.z, out_rolled.z, atol=1e-6)
+    assert out.z_var.shape == out.z.shape
+    assert out.z_tta.shape[1] == 2 * distogram.shape[-1]
+
+
+def test_mask_embed_predict_keeps_recon_x(batch=2, n=64):
+    args = SimpleNamespace(tta_shifts=4, tta_flips=True, frobenius_norm=False)
+    lit_model = MaskEmbed(create_model("resnet18_vae", (1, n, n), 8), args)
+    lit_model.eval()
+    x = torch.rand(batch, 1, n, n)
+    with torch.no_grad():
+        out = lit_model.predict_step((x, torch.zeros(batch)), 0)
+    # As scripts/shapes/shape_embed.py reads reconstructions
+    assert out.recon_x.shape == x.shape
+    assert out.z_tta.shape[:2] == (batch, 8)
+    assert out.z.shape == (batch, 8)
@@ -7,7 +7,6 @@ from skimage.measure import regionprops
 from torchvision.transforms.functional import crop
 import torch
 from sklearn.manifold import MDS
-from sklearn.metrics.pairwise import euclidean_distances
 from skimage.measure import find_contours
 from torch import nn
 
@@ -124,10 +123,11 @@ class DistogramToCoords(torch.nn.Module):
 
 
 class ImageToDistogram(torch.nn.Module):
-    def __init__(self, size, matrix_normalised=False):
+    def __init__(self, size, matrix_normalised=False, dtype=torch.float32):
         super().__init__()
         self.size = size
         self.matrix_normalised = matrix_normalised
+        self.dtype = dtype
 
     def forward(self, img):
         # return self.get_distogram(img, self.size)
@@ -136,16 +136,48 @@ class ImageToDistogram(torch.nn.Module):
     def pipeline(self):
         components = [
             ImageToCoords(self.size),
-            CoordsToDistogram(self.size, matrix_normalised=self.matrix_normalised),
+            CoordsToDistogram(
+                self.size,
+                matrix_normalised=self.matrix_normalised,
+                dtype=self.dtype,
+            ),
         ]
         return transforms.Compose(components)
 
 
+def coords_to_distogram(
+    coords, size, matrix_normalised=False, dtype=torch.float32
+):
+    """
+    Distograms of (..., 2, n) coordinates, numpy or torch, as a
+    (..., 1, n, n) tensor of dtype.
+
+    Distances are computed with torch.cdist in float32 (or the precision
+    of coords if higher) and normalised in place, either by their Frobenius
+    norm or by the diagonal of the size x size window.
+    """
+    coords = torch.as_tensor(coords)
+    if not coords.is_floating_point() or coords.dtype in (
+        torch.float16,
+        torch.bfloat16,
+    ):
+        coords = coords.float()
+    points = coords.transpose(-2, -1)
+    distogram = torch.cdist(points, points)
+    if matrix_normalised:
+        distogram.div_(torch.linalg.norm(distogram, dim=(-2, -1), keepdim=True))
+    else:
+        # The previous sqrt(2) * size scaling followed by the window diagonal
+        distogram.div_(2 * size**2)
+    return distogram.to(dtype).unsqueeze(-3)
+
+
 class CoordsToDistogram(torch.nn.Module):
-    def __init__(self, size, matrix_normalised=False):
+    def __init__(self, size, matrix_normalised=False, dtype=torch.float32):
         super().__init__()
         self.size = size
         self.matrix_normalised = matrix_normalised
+        self.dtype = dtype
 
     def forward(self, coords):
         return self.get_distogram(coords, matrix_normalised=self.matrix_normalised)
@@ -154,18 +186,62 @@ class CoordsToDistogram(torch.nn.Module):
         return self.__class__.__name__ + f"(size={self.size})"
 
     def get_distogram(self, coords, matrix_normalised=False):
-        xii, yii = coords
-        distance_matrix = euclidean_distances(np.array([xii, yii]).T) / (
-            np.sqrt(2) * self.size
+        return coords_to_distogram(
+            coords, self.size, matrix_normalised, dtype=self.dtype
         )
-        # TODO size should be shape of matrix and the normalisation should be
-        # D / (np.linalg.norm(x.shape[-2:]))
 
-        norm = np.linalg.norm(distance_matrix, "fro")
-        if matrix_normalised:
-            return distance_matrix / np.linalg.norm(distance_matrix, "fro")
-        if not matrix_normalised:
-            return distance_matrix / np.linalg.norm([self.size, self.size])
+
+class ChannelExpand(torch.nn.Module):
+    """
+    Repeats a single channel (..., 1, H, W) image to num_channels as an
+    expand view, no memory is copied. The view must not be written to.
+    """
+
+    def __init__(self, num_channels=3):
+        super().__init__()
+        self.num_channels = num_channels
+
+    def forward(self, x):
+        return x.expand(*x.shape[:-3], self.num_channels, *x.shape[-2:])
+
+    def __repr__(self):
+        return self.__class__.__name__ + f"(num_channels={self.num_channels})"
+
+
+def signed_area(coords):
+    """Shoelace area of (2, n) polygon coordinates, positive when counter-clockwise"""
+    x, y = coords
+    return np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y) / 2
+
+
+def canonical_index(coords):
+    """
+    Deterministic reordering of (2, n) contour coordinates: counter-clockwise
+    (in the axes of the coordinates) and starting from the point farthest
+    from the centroid, which does not depend on the rotation of the shape.
+    """
+    x, y = coords
+    order = np.arange(len(x))
+    if signed_area(coords) < 0:
+        order = order[::-1]
+    radius = (x - x.mean()) ** 2 + (y - y.mean()) ** 2
+    start = np.argmax(radius[order])
+    return np.roll(order, -start)
+
+
+class CanonicalizeCoords(torch.nn.Module):
+    """
+    Reorders contour coordinates to their canonical_index, so every shape
+    has a single distogram regardless of the first contour point and the
+    direction it was traced in.
+    """
+
+    def forward(self, coords):
+        coords = np.asarray(coords)
+        return coords[:, canonical_index(coords)]
+
+    def __repr__(self):
+        return self.__class__.__name__
 
 
 def find_longest_array(arrays):
@@ -372,24 +448,54 @@ class AsymmetricDistogramToSymmetricDistogram(torch.nn.Module):
         return self.asym_dist_to_sym_dist(x)
 
     def asym_dist_to_sym_dist(self, asymm_dist):
-        dist_stack = np.stack([asymm_dist, asymm_dist.transpose(0, 1, 3, 2)], axis=0)
-
-        sym_dist = np.max(dist_stack, axis=0)
-        return torch.tensor(np.array(sym_dist))
+        # Elementwise max of D and D^T without stacking them
+        asymm_dist = torch.as_tensor(np.asarray(asymm_dist))
+        return torch.maximum(asymm_dist, asymm_dist.transpose(-1, -2))
 
 
 class RotateIndexingClockwise(nn.Module):
-    def __init__(self, max_rotations=None, p=1.0):
+    """
+    Random cyclic shift of the contour start index of distograms,
+    D[i, j] -> D[i - s, j - s], with s drawn below max_rotations (default n).
+
+    Runs on the device of the input. With batched=True the input is a
+    collated (B, ..., n, n) batch and every sample gets its own shift,
+    otherwise a single (..., n, n) distogram is shifted. The shifts are
+    gathered from an index table, built once per n and device.
+    """
+
+    def __init__(self, max_rotations=None, p=1.0, batched=False):
         super(RotateIndexingClockwise, self).__init__()
         self.max_rotations = max_rotations
         self.probability = p
+        self.batched = batched
+        self._tables = {}
+
+    @staticmethod
+    def index_table(n, device=None):
+        """(n, n) table, row s is the ordering of the points shifted by s"""
+        points = torch.arange(n, device=device)
+        return (points[None, :] - points[:, None]) % n
+
+    def table(self, n, device):
+        """index_table(n) on device, cached"""
+        key = (n, torch.device(device))
+        if key not in self._tables:
+            self._tables[key] = self.index_table(n, device=device)
+        return self._tables[key]
 
     def forward(self, img):
-        if np.random.rand() < self.probability:
-            if self.max_rotations is None:
-                self.max_rotations = img.shape[0]
-            num_rotations = np.random.randint(0, self.max_rotations)
-            img = np.roll(
-                img.numpy(), shift=[num_rotations, num_rotations], axis=[0, 1]
-            )
-        return torch.from_numpy(img)
+        x = torch.as_tensor(img)
+        if not self.batched:
+            x = x[None]
+        batch, n = x.shape[0], x.shape[-1]
+        max_rotations = self.max_rotations or n
+        shifts = torch.randint(0, max_rotations, (batch,), device=x.device)
+        shifts = shifts * (torch.rand(batch, device=x.device) < self.probability)
+        index = self.table(n, x.device)[shifts]
+
+        # (B, 1, ..., n, 1) and (B, 1, ..., 1, n) views broadcast over x
+        index = index.view(batch, *([1] * (x.dim() - 3)), n)
+        x = torch.gather(x, -2, index[..., :, None].expand(x.shape))
+        x = torch.gather(x, -1, index[..., None, :].expand(x.shape))
+        return x if self.batched else x[0]
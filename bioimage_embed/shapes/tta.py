@@ -0,0 +1,62 @@
+"""
+Test time augmentation for distograms.
+
+The contour a distogram is built from has no natural first point or
+direction, so cyclic shifts of the start index, D[i - s, j - s], and the
+reversed ordering, D[n - 1 - i, n - 1 - j], describe the same shape.
+All the variants of a batch are gathered at once with an index table and
+embedded in a single forward pass, the embeddings are then reduced over
+the variants.
+"""
+
+import torch
+from transformers.utils import ModelOutput
+
+REDUCTIONS = ("mean", "median")
+
+
+def index_table(n, num_shifts=None, flips=False, device=None):
+    """
+    (K, n) reorderings of n contour points, num_shifts evenly spaced cyclic
+    shifts (all n if None), each also reversed if flips
+    """
+    num_shifts = n if num_shifts is None or num_shifts < 0 else num_shifts
+    shifts = torch.div(
+        torch.arange(num_shifts, device=device) * n,
+        num_shifts,
+        rounding_mode="floor",
+    )
+    points = torch.arange(n, device=device)
+    table = (points[None, :] - shifts[:, None]) % n
+    if flips:
+        table = torch.cat([table, table.flip(-1)])
+    return table
+
+
+def augment(x, table):
+    """
+    All reorderings of a (B, C, n, n) batch of distograms,
+    returns (B, K, C, n, n)
+    """
+    # (B, C, K, n, n) gather, then the reorderings next to the batch
+    return x[..., table[:, :, None], table[:, None, :]].movedim(2, 1)
+
+
+def tta_encode(encode, x, num_shifts=None, flips=False, reduction="mean"):
+    """
+    Embeds every sample of x under all the reorderings of index_table in
+    one call to encode and reduces over them.
+
+    Returns a ModelOutput with z, the reduced embedding, z_var, the variance
+    across the reorderings, and z_tta, all (B, K, latent_dim) embeddings.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(
+            f"Unknown reduction {reduction}, expected {REDUCTIONS}"
+        )
+    table = index_table(x.shape[-1], num_shifts, flips, device=x.device)
+    batch, k = x.shape[0], table.shape[0]
+    views = augment(x, table).flatten(0, 1)
+    z = encode(views).z.reshape(batch, k, -1)
+    z_reduced = z.mean(1) if reduction == "mean" else z.median(1).values
+    return ModelOutput(z=z_reduced, z_var=z.var(1, unbiased=False), z_tta=z)
@@ -0,0 +1,230 @@
+"""
+Embedding extraction spread over several processes on one machine.
+
+The dataset (the file manifest) is split into contiguous, disjoint shards.
+Every shard is embedded by one worker process using the encoder only path
+and written to its own directory:
+
+output_dir/
+    shards.json -> number of shards and samples of the run
+    shard-00000/part-00000.parquet
+    shard-00000/_SUCCESS -> completion marker
+    ...
+
+A restart only processes shards without a completion marker, and within an
+unfinished shard only the samples that were not written yet.
+"""
+
+import os
+import json
+import logging
+
+import numpy as np
+import pyarrow as pa
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from . import utils
+from .lightning.writer import (
+    EmbeddingWriter,
+    part_paths,
+    read_embeddings,
+    written_indices,
+)
+
+MARKER = "_SUCCESS"
+
+# Set in the parent before forking so the workers inherit the model
+# and the dataset instead of having them pickled
+_STATE = {}
+
+
+def shard_indices(size, num_shards):
+    """Splits range(size) in num_shards contiguous, disjoint chunks"""
+    return [
+        chunk.tolist() for chunk in np.array_split(np.arange(size), num_shards)
+    ]
+
+
+def shard_dir(output_dir, shard):
+    return os.path.join(output_dir, f"shard-{shard:05d}")
+
+
+def is_complete(output_dir, shard):
+    return os.path.isfile(os.path.join(shard_dir(output_dir, shard), MARKER))
+
+
+def pending_shards(output_dir, num_shards):
+    return [
+        shard
+        for shard in range(num_shards)
+        if not is_complete(output_dir, shard)
+    ]
+
+
+def check_manifest(output_dir, num_shards, size):
+    """
+    Shards are only meaningful for the run that created them,
+    so a restart has to use the same manifest and number of shards
+    """
+    manifest = {"num_shards": num_shards, "size": size}
+    path = os.path.join(output_dir, "shards.json")
+    if os.path.isfile(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise ValueError(
+                f"{output_dir} was created with {previous}, not {manifest}"
+            )
+        return
+    os.makedirs(output_dir, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+class IndexedSubset(Dataset):
+    """
+    Subset of dataset whose samples are (index in the dataset, sample).
+    Wraps the dataset rather than subclassing Subset, whose __getitems__
+    would bypass __getitem__ in the DataLoader.
+    """
+
+    def __init__(self, dataset, indices):
+        self.dataset = dataset
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        sample = self.dataset[self.indices[idx]]
+        # Left for the collate function to drop
+        return None if sample is None else (self.indices[idx], sample)
+
+
+def collate_indexed(batch):
+    """
+    collate_none for IndexedSubset samples, returns the dataset indices of
+    the samples that were kept and their batch (None if all were dropped)
+    """
+    batch = [item for item in batch if item is not None]
+    if not batch:
+        return [], None
+    indices, samples = zip(*batch)
+    return list(indices), utils.collate_none(list(samples))
+
+
+def embed_shard(
+    lit_model,
+    dataset,
+    indices,
+    path,
+    batch_size=32,
+    num_threads=1,
+):
+    torch.set_num_threads(num_threads)
+    writer = EmbeddingWriter(path, dataset=dataset)
+    done = written_indices(path)
+    # Samples carry their index in the full dataset, so rows stay aligned
+    # when collate_none drops unreadable (None) samples
+    dataloader = DataLoader(
+        IndexedSubset(dataset, [idx for idx in indices if idx not in done]),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=0,
+        collate_fn=collate_indexed,
+    )
+    lit_model.eval()
+    with torch.inference_mode():
+        for batch_idx, (batch_indices, batch) in enumerate(dataloader):
+            if batch is None:
+                continue
+            x, _ = batch
+            prediction = lit_model.encode(x)
+            writer.write_on_batch_end(
+                None,
+                lit_model,
+                prediction,
+                batch_indices,
+                batch,
+                batch_idx,
+                0,
+            )
+    writer.flush()
+    open(os.path.join(path, MARKER), "w").close()
+
+
+def _embed_shard(shard):
+    state = _STATE
+    embed_shard(
+        state["lit_model"],
+        state["dataset"],
+        state["shards"][shard],
+        shard_dir(state["output_dir"], shard),
+        batch_size=state["batch_size"],
+        num_threads=state["num_threads"],
+    )
+    return shard
+
+
+def embed(
+    lit_model,
+    dataset,
+    output_dir="embeddings",
+    num_workers=1,
+    num_shards=None,
+    batch_size=32,
+    threads_per_worker=None,
+):
+    """
+    Embeds `dataset` with `lit_model.encode` across num_workers processes,
+    returns the shards processed by this call.
+    """
+    num_shards = num_shards or num_workers
+    threads_per_worker = threads_per_worker or max(
+        1, (os.cpu_count() or 1) // num_workers
+    )
+    check_manifest(output_dir, num_shards, len(dataset))
+    shards = shard_indices(len(dataset), num_shards)
+    pending = pending_shards(output_dir, num_shards)
+    logging.info(
+        f"Embedding {len(pending)}/{num_shards} shards "
+        f"with {num_workers} workers x {threads_per_worker} threads"
+    )
+    if not pending:
+        return pending
+
+    _STATE.update(
+        lit_model=lit_model,
+        dataset=dataset,
+        shards=shards,
+        output_dir=output_dir,
+        batch_size=batch_size,
+        num_threads=threads_per_worker,
+    )
+    try:
+        if num_workers == 1:
+            for shard in pending:
+                _embed_shard(shard)
+        else:
+            # Fork so the workers share the parent's model and dataset
+            ctx = torch.multiprocessing.get_context("fork")
+            with ctx.Pool(min(num_workers, len(pending))) as pool:
+                for shard in pool.imap_unordered(_embed_shard, pending):
+                    logging.info(f"Shard {shard} complete")
+    finally:
+        _STATE.clear()
+    return pending
+
+
+def read_shards(output_dir, columns=None, memory_map=True):
+    """Reads the embeddings of all complete shards as one pyarrow Table"""
+    with open(os.path.join(output_dir, "shards.json")) as f:
+        num_shards = json.load(f)["num_shards"]
+    tables = [
+        read_embeddings(shard_dir(output_dir, shard), columns, memory_map)
+        for shard in range(num_shards)
+        if is_complete(output_dir, shard)
+        and part_paths(shard_dir(output_dir, shard))
+    ]
+    return pa.concat_tables(tables)
@@ -1,6 +1,8 @@
 from .. import config
-from .. import bie
+from .. import utils
+from .. import bie as bie_module
 from ..bie import BioImageEmbed
+import os
 import pytest
 from hydra.utils import instantiate
 from torchvision.datasets import FakeData
@@ -66,3 +68,87 @@ def test_model_check(bie):
 
 def test_train_check(bie):
     bie.trainer_check()
+
+
+def test_apply_profiles(cfg):
+    cfg.profiles = ["bf16-mixed", "channels_last", "grad-checkpointing"]
+    config.apply_profiles(cfg)
+    assert cfg.trainer.precision == "bf16"
+    assert cfg.recipe.channels_last
+    assert cfg.recipe.grad_checkpointing
+
+
+def test_unknown_profile(cfg):
+    cfg.profiles = ["fp8"]
+    with pytest.raises(ValueError):
+        config.apply_profiles(cfg)
+
+
+def test_config_hash(cfg, dataloader, model):
+    other = config.Config(dataloader=dataloader, model=model)
+    assert config.config_hash(cfg) == config.config_hash(other)
+    # Where and how fast a run goes does not change its id
+    other.paths.model = "elsewhere"
+    other.trainer.devices = 4
+    other.recipe.channels_last = True
+    assert config.config_hash(cfg) == config.config_hash(other)
+    other.recipe.lr = 1.0
+    assert config.config_hash(cfg) != config.config_hash(other)
+
+
+def test_config_hash_callbacks(cfg, dataloader, model):
+    other = config.Config(dataloader=dataloader, model=model)
+    other.trainer.callbacks[0].dirpath = "elsewhere"
+    assert config.config_hash(cfg) == config.config_hash(other)
+    # Early stopping changes what is trained
+    other.trainer.callbacks[1].patience = 10
+    assert config.config_hash(cfg) != config.config_hash(other)
+
+
+def test_canonical_hash_objects(input_dim):
+    # Objects are hashed by content, not by a repr with their address
+    def dataset():
+        return FakeData(size=8, image_size=input_dim)
+
+    assert utils.canonical_hash([dataset()]) == utils.canonical_hash(
+        [dataset()]
+    )
+    with pytest.raises(TypeError):
+        utils.canonical_hash({"lock": object()})
+
+
+def test_uuid_is_config_hash(bie):
+    assert bie.cfg.uuid == config.config_hash(bie.cfg)
+    assert bie.checkpoint_dir().endswith(bie.cfg.uuid)
+
+
+def test_train_skips_complete_run(bie, monkeypatch):
+    def fit(*args, **kwargs):
+        raise AssertionError("A complete run is not trained again")
+
+    checkpoint_dir = bie.checkpoint_dir()
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    marker = os.path.join(checkpoint_dir, bie_module.COMPLETE)
+    open(marker, "w").close()
+    try:
+        monkeypatch.setattr(bie, "_train", fit)
+        bie.train()
+    finally:
+        os.remove(marker)
+
+
+def test_lazy_sections(bie):
+    # Nothing is built up front, only what a command uses
+    assert bie.icfg.built() == []
+    bie.checkpoint_dir()
+    assert bie.icfg.built() == []
+    assert bie.icfg.lit_model is bie.icfg.lit_model
+    assert bie.icfg.built() == ["lit_model"]
+
+
+def test_dry_run(bie):
+    report = bie.dry_run()
+    assert report["recon_shape"][1:] == tuple(bie.ocfg.lit_model.model.input_dim)
+    # Neither the dataset nor the trainer are needed
+    assert "dataloader" not in bie.icfg.built()
+    assert "trainer" not in bie.icfg.built()
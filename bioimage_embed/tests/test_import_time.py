@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Budgets in seconds, well below the several seconds it takes to import
+# torch, Lightning and the models. Wall clock times flake on loaded CI
+# runners, so they are only checked with BIE_IMPORT_BUDGETS=1.
+IMPORT_BUDGET = 1.0
+CLI_HELP_BUDGET = 2.0
+
+budgets = pytest.mark.skipif(
+    not os.environ.get("BIE_IMPORT_BUDGETS"),
+    reason="set BIE_IMPORT_BUDGETS=1 to check import times",
+)
+
+HEAVY_MODULES = [
+    "torch",
+    "pytorch_lightning",
+    "pythae",
+    "timm",
+    "monai",
+    "transformers",
+    "albumentations",
+]
+
+CLI_HELP = (
+    "from typer.testing import CliRunner\n"
+    "from bioimage_embed.cli import app\n"
+    "assert CliRunner().invoke(app, ['--help']).exit_code == 0"
+)
+
+
+def importtime(code):
+    """
+    Runs code in a fresh interpreter under python -X importtime, returns
+    the cumulative import time of every top level module in seconds and
+    the heavy modules that got imported
+    """
+    check = (
+        "import json, sys; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES} if m in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{code}\n{check}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, us, name = line[len("import time:") :].split("|")
+        # Nested imports are indented, keep the top level ones
+        if not name.startswith("  "):
+            cumulative[name.strip()] = int(us) / 1e6
+    return cumulative, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_light():
+    _, heavy = importtime("import bioimage_embed")
+    assert heavy == []
+
+
+def test_cli_help_is_light():
+    pytest.importorskip("typer")
+    _, heavy = importtime(CLI_HELP)
+    assert heavy == []
+
+
+@budgets
+def test_import_budget():
+    cumulative, _ = importtime("import bioimage_embed")
+    assert cumulative["bioimage_embed"] < IMPORT_BUDGET
+
+
+@budgets
+def test_cli_help_budget():
+    pytest.importorskip("typer")
+    cumulative, _ = importtime(CLI_HELP)
+    assert sum(cumulative.values()) < CLI_HELP_BUDGET
+
+
+def test_lazy_attributes():
+    import bioimage_embed
+
+    assert "BioImageEmbed" in dir(bioimage_embed)
+    with pytest.raises(AttributeError):
+        bioimage_embed.not_an_attribute
@@ -0,0 +1,41 @@
+import pytest
+import torch
+
+from bioimage_embed import profiling
+from bioimage_embed.lightning import AEUnsupervised
+from bioimage_embed.models import create_model
+
+input_dim = (1, 64, 64)
+
+
+def lit_model(device="cpu"):
+    with torch.device(device):
+        return AEUnsupervised(create_model("resnet18_vae", input_dim, 16))
+
+
+def test_dry_run_cpu():
+    report = profiling.dry_run(lit_model(), input_dim, batch_size=2)
+    assert report["recon_shape"] == (2, *input_dim)
+    assert "loss" in report["losses"]
+    rows = {row["module"]: row for row in report["rows"]}
+    assert {"model.encoder", "model.decoder", "total"} <= rows.keys()
+    total = rows.pop("total")
+    assert total["params"] == sum(p.numel() for p in lit_model().parameters())
+    assert total["params"] == sum(row["params"] for row in rows.values())
+    assert rows["model.encoder"]["flops"] > 0
+    assert 0 < rows["model.encoder"]["activation_bytes"]
+    assert total["flops"] >= sum(row["flops"] for row in rows.values())
+    assert profiling.format_report(report)
+
+
+def test_dry_run_meta_matches_cpu():
+    cpu = profiling.dry_run(lit_model(), input_dim)
+    meta = profiling.dry_run(lit_model("meta"), input_dim, device="meta")
+    assert meta["device"] == "meta"
+    assert meta["rows"] == cpu["rows"]
+
+
+def test_dry_run_shape_mismatch():
+    # Either the loss or the shape check fails
+    with pytest.raises((ValueError, RuntimeError)):
+        profiling.dry_run(lit_model(), (1, 32, 32))
@@ -0,0 +1,77 @@
+import os
+import pytest
+import torch
+from torch.utils.data import TensorDataset
+from transformers.utils import ModelOutput
+
+from .. import sharding
+
+
+class Identity(torch.nn.Module):
+    # Stands in for a LightningModule, the embedding is the input itself
+    def encode(self, x):
+        return ModelOutput(z=x.flatten(1))
+
+
+@pytest.fixture()
+def dataset(samples=20, latent_dim=8):
+    x = torch.rand(samples, latent_dim)
+    y = torch.randint(0, 2, (samples,))
+    return TensorDataset(x, y)
+
+
+@pytest.mark.parametrize("num_shards", [1, 3, 7])
+def test_shard_indices(num_shards, size=20):
+    shards = sharding.shard_indices(size, num_shards)
+    assert len(shards) == num_shards
+    assert sorted(sum(shards, [])) == list(range(size))
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_embed(tmp_path, dataset, num_workers):
+    processed = sharding.embed(
+        Identity(),
+        dataset,
+        output_dir=tmp_path,
+        num_workers=num_workers,
+        num_shards=4,
+        batch_size=3,
+    )
+    assert processed == [0, 1, 2, 3]
+    table = sharding.read_shards(tmp_path)
+    order = table["index"].to_pylist()
+    assert sorted(order) == list(range(len(dataset)))
+    z = torch.tensor(table["z"].to_pylist())
+    assert torch.allclose(z, dataset.tensors[0][order])
+
+
+class Unreadable(TensorDataset):
+    # A sample that fails to load or transform, dropped by collate_none
+    def __getitem__(self, idx):
+        return None if idx == 4 else super().__getitem__(idx)
+
+
+def test_embed_skips_none(tmp_path, dataset):
+    dataset = Unreadable(*dataset.tensors)
+    sharding.embed(Identity(), dataset, output_dir=tmp_path, batch_size=3)
+    table = sharding.read_shards(tmp_path)
+    order = table["index"].to_pylist()
+    assert sorted(order) == [idx for idx in range(len(dataset)) if idx != 4]
+    z = torch.tensor(table["z"].to_pylist())
+    assert torch.allclose(z, dataset.tensors[0][order])
+
+
+def test_resume(tmp_path, dataset):
+    sharding.embed(Identity(), dataset, output_dir=tmp_path, num_shards=4)
+    os.remove(os.path.join(sharding.shard_dir(tmp_path, 2), sharding.MARKER))
+    processed = sharding.embed(
+        Identity(), dataset, output_dir=tmp_path, num_shards=4
+    )
+    assert processed == [2]
+    assert len(sharding.read_shards(tmp_path)) == len(dataset)
+
+
+def test_manifest_mismatch(tmp_path, dataset):
+    sharding.embed(Identity(), dataset, output_dir=tmp_path, num_shards=4)
+    with pytest.raises(ValueError):
+        sharding.embed(Identity(), dataset, output_dir=tmp_path, num_shards=2)
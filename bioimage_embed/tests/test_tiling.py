@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import torch
+from transformers.utils import ModelOutput
+
+from bioimage_embed import tiling
+
+
+class ChannelMean(torch.nn.Module):
+    # Stands in for a LightningModule, embeds a tile by its channel means
+    def encode(self, x):
+        return ModelOutput(z=x.mean(dim=(-1, -2)))
+
+    # and reconstructs it perfectly
+    def forward(self, x):
+        return ModelOutput(recon_x=x)
+
+
+@pytest.mark.parametrize("size", [16, 100, 128])
+@pytest.mark.parametrize("stride", [16, 32])
+def test_tile_origins_cover(size, stride, tile_size=32):
+    origins = tiling.tile_origins(size, tile_size, stride)
+    covered = np.zeros(size, dtype=bool)
+    for origin in origins:
+        covered[origin : origin + tile_size] = True
+    assert covered.all()
+    assert all(origin + tile_size <= max(size, tile_size) for origin in origins)
+
+
+@pytest.fixture()
+def image_path(tmp_path, shape=(2, 100, 70)):
+    path = tmp_path / "plane.npy"
+    np.save(path, np.random.rand(*shape).astype(np.float32))
+    return path
+
+
+def test_tile_dataset_memmap(image_path, tile_size=32):
+    dataset = tiling.TileDataset(image_path, tile_size, stride=16)
+    assert isinstance(dataset.array, np.memmap)
+    image = np.load(image_path)
+    for idx in [0, len(dataset) - 1]:
+        tile, _ = dataset[idx]
+        y, x = dataset.origin(idx)
+        expected = image[:, y : y + tile_size, x : x + tile_size]
+        assert torch.equal(tile, torch.from_numpy(expected))
+
+
+def test_embed_tiles(image_path, tile_size=32, stride=16):
+    out = tiling.embed_tiles(
+        ChannelMean(), image_path, tile_size, stride, batch_size=5
+    )
+    rows, cols = tiling.tile_grid((100, 70), tile_size, stride)
+    assert out.embedding_map.shape == (2, len(rows), len(cols))
+    assert out.z.shape == (len(rows) * len(cols), 2)
+    image = np.load(image_path)
+    y, x = rows[1], cols[2]
+    expected = image[:, y : y + tile_size, x : x + tile_size].mean((-1, -2))
+    assert torch.allclose(
+        out.embedding_map[:, 1, 2], torch.from_numpy(expected)
+    )
+    assert torch.allclose(out.embedding, out.z.mean(0))
+
+
+def test_small_image_is_padded(tile_size=32):
+    dataset = tiling.TileDataset(np.ones((20, 10)), tile_size)
+    tile, _ = dataset[0]
+    assert len(dataset) == 1
+    assert tile.shape == (1, tile_size, tile_size)
+    assert tile.sum() == 200
+
+
+@pytest.mark.parametrize("stride", [16, 32])
+def test_reconstruct_tiles(image_path, stride, tile_size=32):
+    # Blending perfect tile reconstructions gives back the image
+    recon = tiling.reconstruct_tiles(
+        ChannelMean(), image_path, tile_size, stride, batch_size=5
+    )
+    assert torch.allclose(recon, torch.from_numpy(np.load(image_path)))
+
+
+def test_reconstruct_small_image(tile_size=32):
+    image = np.random.rand(20, 10).astype(np.float32)
+    recon = tiling.reconstruct_tiles(ChannelMean(), image, tile_size)
+    assert torch.allclose(recon, torch.from_numpy(image)[None])
+
+
+def test_blend_window(tile_size=8):
+    window = tiling.blend_window(tile_size)
+    assert (window > 0).all()
+    assert window[0, 0] == window.min()
+    assert torch.equal(window, window.T)
+    assert torch.equal(window, window.flip(0))
@@ -0,0 +1,212 @@
+"""
+Embedding of images larger than the model's input by tiling.
+
+A grid of tile_size tiles, stride apart, covers the whole image, the last
+row and column of tiles are shifted back to end on the image border so
+nothing is left out and only images smaller than a tile are padded.
+Tiles are read one at a time from memory mapped sources (.npy, .tif or any
+array that slices lazily, e.g. zarr) so a full plane is never loaded.
+
+Per tile embeddings are arranged on the tile grid, (latent_dim, rows, cols),
+and pooled into an image level embedding. Per tile reconstructions are
+stitched back into the whole image, overlapping tiles are blended with
+weights falling off linearly towards the tile borders to hide the seams.
+"""
+
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from transformers.utils import ModelOutput
+
+
+def tile_origins(size, tile_size, stride):
+    """Top left coordinates of tiles along one axis, the last ends on the border"""
+    if size <= tile_size:
+        return [0]
+    origins = list(range(0, size - tile_size + 1, stride))
+    if origins[-1] + tile_size < size:
+        origins.append(size - tile_size)
+    return origins
+
+
+def tile_grid(shape, tile_size, stride=None):
+    """(rows, cols) origins of the tiles covering an image of shape (..., H, W)"""
+    stride = stride or tile_size
+    height, width = shape[-2:]
+    return (
+        tile_origins(height, tile_size, stride),
+        tile_origins(width, tile_size, stride),
+    )
+
+
+def open_image(image):
+    """Opens paths as memory maps, anything else is assumed to be array-like"""
+    if not isinstance(image, (str, os.PathLike)):
+        return image
+    path = os.fspath(image)
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if path.endswith((".tif", ".tiff")):
+        import tifffile
+
+        return tifffile.memmap(path, mode="r")
+    raise ValueError(f"Cannot memory map {path}, expected .npy or .tif")
+
+
+class TileDataset(Dataset):
+    """
+    Tiles of a single (H, W) or (C, H, W) image. Paths are opened lazily so
+    every DataLoader worker maps the file itself instead of pickling it.
+    """
+
+    def __init__(self, image, tile_size, stride=None, transform=None):
+        self.image = image
+        self.tile_size = tile_size
+        self.transform = transform
+        self._array = None
+        self.rows, self.cols = tile_grid(self.array.shape, tile_size, stride)
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = open_image(self.image)
+        return self._array
+
+    @property
+    def grid_shape(self):
+        return len(self.rows), len(self.cols)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if isinstance(self.image, (str, os.PathLike)):
+            state["_array"] = None
+        return state
+
+    def __len__(self):
+        return len(self.rows) * len(self.cols)
+
+    def origin(self, idx):
+        row, col = divmod(idx, len(self.cols))
+        return self.rows[row], self.cols[col]
+
+    def __getitem__(self, idx):
+        y, x = self.origin(idx)
+        # Only the tile is read (and copied) from the memory map
+        tile = np.array(
+            self.array[..., y : y + self.tile_size, x : x + self.tile_size],
+            dtype=np.float32,
+        )
+        tile = torch.from_numpy(tile)
+        if tile.dim() == 2:
+            tile = tile[None]
+        pad_h = self.tile_size - tile.shape[-2]
+        pad_w = self.tile_size - tile.shape[-1]
+        if pad_h or pad_w:
+            tile = F.pad(tile, (0, pad_w, 0, pad_h))
+        if self.transform is not None:
+            tile = self.transform(tile)
+        return tile, idx
+
+
+def pool_embeddings(z, pool="mean"):
+    if pool == "mean":
+        return z.mean(0)
+    if pool == "max":
+        return z.amax(0)
+    raise ValueError(f"Unknown pooling {pool}, expected mean or max")
+
+
+def embed_tiles(
+    lit_model,
+    image,
+    tile_size,
+    stride=None,
+    batch_size=32,
+    num_workers=0,
+    pool="mean",
+    transform=None,
+):
+    """
+    Embeds a whole image tile by tile with `lit_model.encode`.
+
+    Returns a ModelOutput with:
+        z: (num_tiles, latent_dim) tile embeddings in row major grid order
+        origins: (num_tiles, 2) top left (y, x) of every tile
+        embedding_map: (latent_dim, rows, cols) tile embeddings on the grid
+        embedding: (latent_dim,) pooled image level embedding
+    """
+    dataset = TileDataset(image, tile_size, stride, transform)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+    )
+    lit_model.eval()
+    embeddings = []
+    with torch.inference_mode():
+        for tiles, _ in dataloader:
+            tiles = tiles.to(getattr(lit_model, "device", "cpu"))
+            z = lit_model.encode(tiles).z
+            embeddings.append(z.flatten(1).cpu())
+    z = torch.cat(embeddings)
+    rows, cols = dataset.grid_shape
+    return ModelOutput(
+        z=z,
+        origins=torch.tensor([dataset.origin(idx) for idx in range(len(z))]),
+        embedding_map=z.T.reshape(-1, rows, cols),
+        embedding=pool_embeddings(z, pool),
+    )
+
+
+def blend_window(tile_size):
+    """(tile_size, tile_size) weights, highest in the centre and never zero"""
+    ramp = torch.arange(tile_size, dtype=torch.float32)
+    ramp = torch.minimum(ramp + 1, tile_size - ramp)
+    return ramp[:, None] * ramp[None, :]
+
+
+def reconstruct_tiles(
+    lit_model,
+    image,
+    tile_size,
+    stride=None,
+    batch_size=32,
+    num_workers=0,
+    transform=None,
+):
+    """
+    Reconstructs a whole image tile by tile with `lit_model`, the
+    reconstructions of overlapping tiles are blended with blend_window.
+    Returns the (C, H, W) reconstruction.
+    """
+    dataset = TileDataset(image, tile_size, stride, transform)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+    )
+    height, width = dataset.array.shape[-2:]
+    # Images smaller than a tile are padded, and cropped back at the end
+    padded = max(height, tile_size), max(width, tile_size)
+    window = blend_window(tile_size)
+    stitched = None
+    weights = torch.zeros(padded)
+    lit_model.eval()
+    with torch.inference_mode():
+        for tiles, indices in dataloader:
+            tiles = tiles.to(getattr(lit_model, "device", "cpu"))
+            recon = lit_model(tiles).recon_x.float().cpu()
+            if stitched is None:
+                stitched = torch.zeros(recon.shape[1], *padded)
+            for tile, idx in zip(recon, indices.tolist()):
+                y, x = dataset.origin(idx)
+                stitched[:, y : y + tile_size, x : x + tile_size] += (
+                    tile * window
+                )
+                weights[y : y + tile_size, x : x + tile_size] += window
+    return (stitched / weights)[:, :height, :width]
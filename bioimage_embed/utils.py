@@ -1,11 +1,12 @@
-import torch
 from types import SimpleNamespace
-import pickle
-import base64
 import hashlib
+import inspect
+import json
 
 
 def collate_none(batch):
+    import torch
+
     batch = list(filter(lambda x: x is not None, batch))
     return torch.utils.data.dataloader.default_collate(batch)
 
@@ -20,8 +21,35 @@ def merge_params(list_of_dicts):
     return SimpleNamespace({k: v for d in list_of_dicts for k, v in d.items()})
 
 
+def hashable_content(obj):
+    """
+    JSON serialisable content of an object json cannot serialise, classes
+    and functions by name, other objects by their type and public
+    attributes. Never a repr, which usually holds a memory address.
+    """
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    if isinstance(obj, type) or inspect.isroutine(obj):
+        return f"{obj.__module__}.{obj.__qualname__}"
+    cls = type(obj)
+    if not hasattr(obj, "__dict__"):
+        raise TypeError(
+            f"Cannot hash {cls.__module__}.{cls.__qualname__} by its content"
+        )
+    content = {k: v for k, v in vars(obj).items() if not k.startswith("_")}
+    return {"__type__": f"{cls.__module__}.{cls.__qualname__}", **content}
+
+
+def canonical_hash(obj, length=16):
+    """
+    Hash of a JSON like object that only depends on its content, not on
+    key order, and unlike pickle is stable across runs and versions
+    """
+    serialized = json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), default=hashable_content
+    )
+    return hashlib.sha256(serialized.encode()).hexdigest()[:length]
+
+
 def hashing_fn(args):
-    serialized_args = pickle.dumps(vars(args))
-    hash_object = hashlib.sha256(serialized_args)
-    hashed_string = base64.urlsafe_b64encode(hash_object.digest()).decode()
-    return hashed_string
+    return canonical_hash(vars(args))
@@ -0,0 +1,75 @@
+"""
+Training steps per second on CPU with and without torch.compile, see the
+compile options of the Recipe and AutoEncoder.compile_model.
+
+A step is the forward pass, loss, backward pass and optimizer step of
+AutoEncoder.eval_step outside of a Trainer. The compiled warmup steps,
+which include the compilation itself, are not timed.
+
+python scripts/benchmarks/compile_step.py resnet18_vae resnet18_vqvae
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+import torch
+
+from bioimage_embed.lightning.torch import AutoEncoder
+from bioimage_embed.models import create_model
+
+
+def steps_per_second(model_name, compile, args):
+    torch.manual_seed(0)
+    model = create_model(model_name, (args.channels, args.size, args.size), 64)
+    lit_model = AutoEncoder(
+        model,
+        SimpleNamespace(compile=compile, compile_mode=args.mode),
+    ).train()
+    optimizer = torch.optim.AdamW(lit_model.parameters(), lr=1e-4)
+    batch = (
+        torch.rand(args.batch_size, args.channels, args.size, args.size),
+        torch.zeros(args.batch_size, dtype=torch.long),
+    )
+
+    def step():
+        loss, _ = lit_model.eval_step(batch, 0)
+        optimizer.zero_grad(set_to_none=True)
+        loss["loss"].backward()
+        optimizer.step()
+
+    for _ in range(args.warmup):
+        step()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        step()
+    return args.steps / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Training steps per second with and without torch.compile"
+    )
+    parser.add_argument(
+        "models", nargs="*", default=["resnet18_vae", "resnet18_vqvae"]
+    )
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--mode", default=None)
+    args = parser.parse_args()
+
+    print(f"{'model':>16} {'eager':>9} {'compiled':>9} {'speedup':>8}")
+    for model_name in args.models:
+        eager = steps_per_second(model_name, False, args)
+        compiled = steps_per_second(model_name, True, args)
+        print(
+            f"{model_name:>16} {eager:>9.2f} {compiled:>9.2f} "
+            f"{compiled / eager:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
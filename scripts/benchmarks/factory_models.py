@@ -0,0 +1,283 @@
+"""
+CPU throughput benchmark of the factory models, to choose architectures by
+measurement and to track regressions across versions.
+
+Every (model, input_dim, latent_dim, mode) case runs in its own process so
+that peak memory is the growth of that process' maximum resident set size.
+The modes are:
+
+train -> forward pass with the loss and backward pass
+embed -> encoder only forward pass, as AutoEncoder.encode, no gradients
+decode -> decoder only forward pass from the latents, no gradients
+
+Results, one row per case, are written as JSON or CSV (by file extension).
+
+python scripts/benchmarks/factory_models.py --models resnet18_vae \\
+    --input-dims 1,64,64 3,224,224 --latent-dims 16 64 -o results.csv
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+from importlib import metadata
+from queue import Empty
+
+import torch
+
+from bioimage_embed.models import __all_models__, create_model
+
+MODES = ("train", "embed", "decode")
+
+
+def version(package="bioimage_embed"):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def encode(model, x):
+    # Same as AutoEncoder.encode
+    if hasattr(model, "encode"):
+        return model.encode({"data": x}).z
+    return model.encoder(x).embedding.flatten(1)
+
+
+def decoder_inputs(model, x):
+    """Arguments the decoder is called with in a forward pass of x"""
+    captured = {}
+
+    def hook(module, args, kwargs):
+        captured["args"], captured["kwargs"] = args, kwargs
+
+    handle = model.decoder.register_forward_pre_hook(hook, with_kwargs=True)
+    try:
+        with torch.inference_mode():
+            model({"data": x})
+    finally:
+        handle.remove()
+    return captured["args"], captured["kwargs"]
+
+
+def timed(step, warmup, repeats):
+    """Mean seconds per step, after warmup steps"""
+    for _ in range(warmup):
+        step()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(
+    model_name,
+    input_dim,
+    latent_dim,
+    mode="train",
+    batch_size=4,
+    warmup=1,
+    repeats=3,
+    threads=None,
+):
+    """Latency, throughput and peak memory of a single case, in process"""
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, expected any of {MODES}")
+    torch.manual_seed(0)
+    if threads:
+        torch.set_num_threads(threads)
+    baseline = peak_rss_mb()
+    model = create_model(model_name, input_dim, latent_dim)
+    x = torch.rand(batch_size, *input_dim)
+    result = {
+        "model": model_name,
+        "input_dim": "x".join(map(str, input_dim)),
+        "latent_dim": latent_dim,
+        "mode": mode,
+        "batch_size": batch_size,
+        "threads": torch.get_num_threads(),
+        "params": sum(p.numel() for p in model.parameters()),
+        "forward_ms": None,
+        "backward_ms": None,
+    }
+
+    if mode == "train":
+        model.train()
+        timings = {"forward": 0.0, "backward": 0.0}
+
+        def step():
+            start = time.perf_counter()
+            loss = model({"data": x}).loss
+            middle = time.perf_counter()
+            loss.backward()
+            model.zero_grad(set_to_none=True)
+            timings["forward"] += middle - start
+            timings["backward"] += time.perf_counter() - middle
+
+        for _ in range(warmup):
+            step()
+        timings.update(forward=0.0, backward=0.0)
+        latency = timed(step, 0, repeats)
+        result["forward_ms"] = 1e3 * timings["forward"] / repeats
+        result["backward_ms"] = 1e3 * timings["backward"] / repeats
+    else:
+        model.eval()
+        if mode == "embed":
+            step = lambda: encode(model, x)  # noqa: E731
+        else:
+            args, kwargs = decoder_inputs(model, x)
+            step = lambda: model.decoder(*args, **kwargs)  # noqa: E731
+        with torch.inference_mode():
+            latency = timed(step, warmup, repeats)
+        result["forward_ms"] = 1e3 * latency
+
+    result["latency_ms"] = 1e3 * latency
+    result["samples_per_s"] = batch_size / latency
+    result["peak_rss_mb"] = peak_rss_mb() - baseline
+    return result
+
+
+def failed(case, error):
+    return {
+        "model": case["model_name"],
+        "input_dim": "x".join(map(str, case["input_dim"])),
+        "latent_dim": case["latent_dim"],
+        "mode": case["mode"],
+        "error": error,
+    }
+
+
+def _run(case, queue):
+    try:
+        queue.put(benchmark(**case))
+    except Exception as e:
+        queue.put(failed(case, f"{type(e).__name__}: {e}"))
+
+
+def run(
+    models=__all_models__,
+    input_dims=((3, 224, 224),),
+    latent_dims=(64,),
+    modes=MODES,
+    in_process=False,
+    **options,
+):
+    """
+    Benchmarks every combination of models, input_dims, latent_dims and
+    modes, each in a fresh process. Yields result rows, failing cases (e.g.
+    unsupported sizes) have an error instead. in_process runs them in this
+    process and raises, for debugging.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    environment = {
+        "bioimage_embed": version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+    }
+    for model_name, input_dim, latent_dim, mode in itertools.product(
+        models, input_dims, latent_dims, modes
+    ):
+        case = dict(
+            model_name=model_name,
+            input_dim=tuple(input_dim),
+            latent_dim=latent_dim,
+            mode=mode,
+            **options,
+        )
+        if in_process:
+            result = benchmark(**case)
+        else:
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run, args=(case, queue))
+            process.start()
+            # Read before joining, a child only exits once its queued result
+            # is consumed
+            result = None
+            while result is None:
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    if not process.is_alive() and queue.empty():
+                        # Killed, e.g. out of memory
+                        result = failed(case, f"exit code {process.exitcode}")
+            process.join()
+        yield {**environment, **result}
+
+
+def write_results(results, path):
+    """Writes result rows to path, .json or .csv"""
+    results = list(results)
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+        return results
+    if not path.endswith(".csv"):
+        raise ValueError(f"Cannot write {path}, expected .json or .csv")
+    fields = list(dict.fromkeys(key for row in results for key in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    return results
+
+
+def parse_dim(value):
+    return tuple(int(size) for size in value.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU throughput benchmark of the factory models"
+    )
+    parser.add_argument("--models", nargs="*", default=__all_models__)
+    parser.add_argument(
+        "--input-dims", nargs="*", type=parse_dim, default=[(3, 224, 224)]
+    )
+    parser.add_argument("--latent-dims", nargs="*", type=int, default=[64])
+    parser.add_argument("--modes", nargs="*", choices=MODES, default=MODES)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("-o", "--output", default="benchmark.csv")
+    args = parser.parse_args()
+
+    results = []
+    for result in run(
+        args.models,
+        args.input_dims,
+        args.latent_dims,
+        args.modes,
+        batch_size=args.batch_size,
+        warmup=args.warmup,
+        repeats=args.repeats,
+        threads=args.threads,
+    ):
+        results.append(result)
+        if "error" in result:
+            print(f"{result['model']} {result['mode']}: {result['error']}")
+        else:
+            print(
+                f"{result['model']:<28} {result['input_dim']:>11} "
+                f"{result['latent_dim']:>4} {result['mode']:>6} "
+                f"{result['latency_ms']:>10.1f} ms "
+                f"{result['samples_per_s']:>8.1f}/s "
+                f"{result['peak_rss_mb']:>8.1f} MB"
+            )
+    write_results(results, args.output)
+    print(f"Results written to {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
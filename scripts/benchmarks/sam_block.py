@@ -0,0 +1,136 @@
+"""
+Per block latency and peak memory of sam.Block on CPU, for the fused
+scaled_dot_product_attention path against the explicit q @ k^T, softmax
+and decomposed relative position path it replaced.
+
+Every case runs in its own process, peak memory is the growth of the
+maximum resident set size over the forward passes.
+
+python scripts/benchmarks/sam_block.py --grid 64 14 0
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+import types
+
+import torch
+
+from bioimage_embed.models.vit import sam
+
+
+def explicit_attention(self, x):
+    B, H, W, _ = x.shape
+    qkv = (
+        self.qkv(x)
+        .reshape(B, H * W, 3, self.num_heads, -1)
+        .permute(2, 0, 3, 1, 4)
+    )
+    q, k, v = qkv.reshape(3, B * self.num_heads, H * W, -1).unbind(0)
+    attn = (q * self.scale) @ k.transpose(-2, -1)
+    attn = sam.add_decomposed_rel_pos(
+        attn, q, self.rel_pos_h, self.rel_pos_w, (H, W), (H, W)
+    )
+    attn = attn.softmax(dim=-1)
+    x = (
+        (attn @ v)
+        .view(B, self.num_heads, H, W, -1)
+        .permute(0, 2, 3, 1, 4)
+        .reshape(B, H, W, -1)
+    )
+    return self.proj(x)
+
+
+def explicit_block(self, x):
+    shortcut = x
+    x = self.norm1(x)
+    if self.window_size > 0:
+        H, W = x.shape[1], x.shape[2]
+        x, pad_hw = sam.window_partition(x, self.window_size)
+        # Copy into [B * num_windows, window, window, C] as before
+        x = x.contiguous().view(-1, *x.shape[-3:])
+    x = self.attn(x)
+    if self.window_size > 0:
+        x = x.view(
+            shortcut.shape[0],
+            pad_hw[0] // self.window_size,
+            pad_hw[1] // self.window_size,
+            *x.shape[-3:],
+        )
+        x = sam.window_unpartition(x, self.window_size, pad_hw, (H, W))
+        x = x.contiguous()
+    x = shortcut + x
+    return x + self.mlp(self.norm2(x))
+
+
+def run(case, queue):
+    torch.manual_seed(0)
+    torch.set_num_threads(case["threads"])
+    block = sam.Block(
+        dim=case["dim"],
+        num_heads=case["num_heads"],
+        use_rel_pos=True,
+        window_size=case["window_size"],
+        input_size=(case["grid"], case["grid"]),
+    ).eval()
+    if case["path"] == "explicit":
+        block.attn.forward = types.MethodType(explicit_attention, block.attn)
+        block.forward = types.MethodType(explicit_block, block)
+    x = torch.rand(case["batch_size"], case["grid"], case["grid"], case["dim"])
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with torch.inference_mode():
+        for _ in range(case["warmup"]):
+            block(x)
+        start = time.perf_counter()
+        for _ in range(case["repeats"]):
+            block(x)
+        latency = (time.perf_counter() - start) / case["repeats"]
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    # ru_maxrss is in kilobytes on Linux
+    queue.put({**case, "latency_ms": 1e3 * latency, "peak_mb": peak / 1024})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per block latency and peak memory of sam.Block on CPU"
+    )
+    parser.add_argument("window_sizes", type=int, nargs="*", default=[14, 0])
+    parser.add_argument("--grid", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--num-heads", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    print(f"{'path':>9} {'window':>6} {'latency ms':>11} {'peak MB':>9}")
+    for window_size in args.window_sizes:
+        for path in ("explicit", "fused"):
+            case = dict(
+                path=path,
+                window_size=window_size,
+                grid=args.grid,
+                dim=args.dim,
+                num_heads=args.num_heads,
+                batch_size=args.batch_size,
+                threads=args.threads,
+                warmup=args.warmup,
+                repeats=args.repeats,
+            )
+            process = ctx.Process(target=run, args=(case, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            print(
+                f"{path:>9} {window_size:>6} "
+                f"{result['latency_ms']:>11.2f} {result['peak_mb']:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -104,7 +104,7 @@ def shape_embed_process():
         "epochs": 75,
         "batch_size": 3,
         "num_workers": 2**4,
-        "input_dim": (3, interp_size, interp_size),
+        "input_dim": (1, interp_size, interp_size),
         "latent_dim": (interp_size) * 8,
         "num_embeddings": 16,
         "num_hiddens": 16,
@@ -192,8 +192,10 @@ def shape_embed_process():
 
     for key, value in train_data.items():
         print(key, len(value))
-        plt.imshow(train_data[key][0][0], cmap="gray")
-        plt.imsave(metadata(f"{key}.png"), train_data[key][0][0], cmap="gray")
+        # Distograms are (1, N, N) tensors
+        image = np.array(train_data[key][0][0]).squeeze()
+        plt.imshow(image, cmap="gray")
+        plt.imsave(metadata(f"{key}.png"), image, cmap="gray")
         # plt.show()
         plt.close()
 
@@ -228,10 +230,7 @@ def shape_embed_process():
     plt.close()
     # import albumentations as A
     # %%
-    gray2rgb = transforms.Lambda(lambda x: x.repeat(3, 1, 1))
-    transform = transforms.Compose(
-        [transform_mask_to_dist, transforms.ToTensor(), gray2rgb]
-    )
+    transform = transforms.Compose([transform_mask_to_dist])
 
     dataset = datasets.ImageFolder(train_data_path, transform=transform)
 
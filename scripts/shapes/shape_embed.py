@@ -1,4 +1,5 @@
 # %%
+import argparse
 import seaborn as sns
 import pyefd
 from sklearn.discriminant_analysis import StandardScaler
@@ -37,14 +38,17 @@ from bioimage_embed import shapes
 import bioimage_embed
 from pytorch_lightning import loggers as pl_loggers
 from torchvision import transforms
-from bioimage_embed.lightning import DataModule
+from bioimage_embed.lightning import DataModule, EmbeddingWriter
+from bioimage_embed.config import PROFILES, profile_overrides
+from hydra.utils import instantiate
+from bioimage_embed.lightning.writer import read_embeddings, embeddings_to_numpy
 
 from torchvision import datasets
 from bioimage_embed.shapes.transforms import (
     ImageToCoords,
     CropCentroidPipeline,
     DistogramToCoords,
-    RotateIndexingClockwise,
+    CanonicalizeCoords,
     CoordsToDistogram,
     AsymmetricDistogramToCoordsPipeline,
 )
@@ -147,7 +151,7 @@ def scoring_df(X, y):
     return pd.DataFrame(cv_results)
 
 
-def shape_embed_process():
+def shape_embed_process(profiles=()):
     # Setting the font size
     mpl.rcParams["font.size"] = 10
 
@@ -173,7 +177,7 @@ def shape_embed_process():
         "epochs": 250,
         "batch_size": 4,
         "num_workers": 2**4,
-        "input_dim": (3, interp_size, interp_size),
+        "input_dim": (1, interp_size, interp_size),
         "latent_dim": interp_size,
         "num_embeddings": interp_size,
         "num_hiddens": interp_size,
@@ -203,7 +207,15 @@ def shape_embed_process():
         "cycle_momentum": False,
     }
 
-    args = SimpleNamespace(**params, **optimizer_params, **lr_scheduler_params)
+    # Performance profiles, see bioimage_embed.config.PROFILES
+    overrides = profile_overrides(profiles)
+
+    args = SimpleNamespace(
+        **params,
+        **optimizer_params,
+        **lr_scheduler_params,
+        **overrides.get("recipe", {}),
+    )
 
     dataset_path = args.dataset
 
@@ -233,10 +245,13 @@ def shape_embed_process():
         ]
     )
 
+    # One ordering of the contour per shape, instead of learning the
+    # invariance to the start point from random rotations of the indexing
     transform_mask_to_coords = transforms.Compose(
         [
             transform_mask_to_crop,
             transform_coords,
+            CanonicalizeCoords(),
         ]
     )
 
@@ -247,13 +262,11 @@ def shape_embed_process():
         ]
     )
 
-    gray2rgb = transforms.Lambda(lambda x: x.repeat(3, 1, 1))
+    # Distograms are float32 (1, N, N) tensors, fed to single channel models.
+    # For 3 channel (e.g. pretrained RGB) models append ChannelExpand(3).
     transform = transforms.Compose(
         [
             transform_mask_to_dist,
-            transforms.ToTensor(),
-            RotateIndexingClockwise(p=1),
-            gray2rgb,
         ]
     )
 
@@ -293,8 +306,10 @@ def shape_embed_process():
 
     for key, value in train_data.items():
         logger.info(key, len(value))
-        plt.imshow(np.array(train_data[key][0][0]), cmap="gray")
-        plt.imsave(metadata(f"{key}.png"), train_data[key][0][0], cmap="gray")
+        # Distograms are (1, N, N) tensors
+        image = np.array(train_data[key][0][0]).squeeze()
+        plt.imshow(image, cmap="gray")
+        plt.imsave(metadata(f"{key}.png"), image, cmap="gray")
         # plt.show()
         plt.close()
 
@@ -359,19 +374,29 @@ def shape_embed_process():
     )
     wandb.watch(lit_model, log="all")
 
-    trainer = pl.Trainer(
+    # Embeddings are streamed to parquet during prediction rather than held in RAM
+    embedding_writer = EmbeddingWriter(metadata("embeddings"), dataset=dataset)
+
+    trainer_kwargs = dict(
         logger=[wandb, tb_logger],
         gradient_clip_val=0.5,
         enable_checkpointing=True,
         devices=1,
         accelerator="gpu",
         accumulate_grad_batches=4,
-        callbacks=[checkpoint_callback],
+        callbacks=[checkpoint_callback, embedding_writer],
         min_epochs=50,
         max_epochs=args.epochs,
         # callbacks=[EarlyStopping(monitor="loss/val", mode="min")],
         log_every_n_steps=1,
     )
+    # Profiles replace the defaults above, e.g. ddp-cpu's accelerator
+    trainer_kwargs.update(overrides.get("trainer", {}))
+    # Profile plugins are config dataclasses, e.g. config.AsyncCheckpointIO
+    trainer_kwargs["plugins"] = [
+        instantiate(plugin) for plugin in trainer_kwargs.get("plugins") or []
+    ] or None
+    trainer = pl.Trainer(**trainer_kwargs)
     # %%
 
     # Determine the checkpoint path for resuming
@@ -399,9 +424,10 @@ def shape_embed_process():
 
     # %%
     # Inference on full dataset
+    # Only samples without an embedding on disk are predicted, so reruns resume
     dataloader = DataModule(
-        dataset,
-        batch_size=1,
+        embedding_writer.pending(dataset),
+        batch_size=args.batch_size,
         shuffle=False,
         num_workers=args.num_workers,
         # Transform is commented here to avoid augmentations in real data
@@ -410,13 +436,16 @@ def shape_embed_process():
     )
     dataloader.setup()
 
-    predictions = trainer.predict(lit_model, datamodule=dataloader)
+    trainer.predict(lit_model, datamodule=dataloader, return_predictions=False)
+
+    test_batch = next(iter(DataModule(dataset, batch_size=1).predict_dataloader()))
+    test_prediction = lit_model.predict_step(test_batch, 0)
 
-    test_dist_pred = predictions[0].out.recon_x
+    test_dist_pred = test_prediction.recon_x.detach()
     plt.imsave(metadata("test_dist_pred.png"), test_dist_pred.mean(axis=(0, 1)))
     plt.close()
 
-    test_dist_in = predictions[0].x.data
+    test_dist_in = test_batch[0]
     plt.imsave(metadata("test_dist_in.png"), test_dist_in.mean(axis=(0, 1)))
     plt.close()
 
@@ -429,20 +458,21 @@ def shape_embed_process():
     plt.savefig(metadata("test_pred_coords.png"), bbox_inches="tight", pad_inches=0)
     plt.close()
 
-    # Use the namespace variables
-    latent_space = torch.stack([d.out.z.flatten() for d in predictions])
-    scalings = torch.stack([d.x.scalings.flatten() for d in predictions])
+    # Memory mapped read of the streamed embeddings
+    embeddings = read_embeddings(metadata("embeddings"))
+    latent_space = embeddings_to_numpy(embeddings)
+    scalings = embeddings["scaling"].to_numpy(zero_copy_only=False)
     idx_to_class = {v: k for k, v in dataset.dataset.class_to_idx.items()}
-    y = np.array([int(data[-1]) for data in dataloader.predict_dataloader()])
+    y = embeddings["label"].to_numpy(zero_copy_only=False).astype(int)
 
     y_partial = y.copy()
     indices = np.random.choice(y.size, int(0.3 * y.size), replace=False)
     y_partial[indices] = -1
     y_blind = -1 * np.ones_like(y)
 
-    df = pd.DataFrame(latent_space.numpy())
+    df = pd.DataFrame(latent_space)
     df["Class"] = pd.Series(y).map(idx_to_class).astype("category")
-    df["Scale"] = scalings[:, 0].squeeze()
+    df["Scale"] = scalings
     df = df.set_index("Class")
     df_shape_embed = df.copy()
 
@@ -575,4 +605,12 @@ def shape_embed_process():
 
 
 if __name__ == "__main__":
-    shape_embed_process()
+    parser = argparse.ArgumentParser(description="Shape embedding pipeline")
+    parser.add_argument(
+        "--profiles",
+        nargs="*",
+        default=[],
+        choices=sorted(PROFILES),
+        help="performance profiles, see bioimage_embed.config.PROFILES",
+    )
+    shape_embed_process(parser.parse_args().profiles)